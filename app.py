@@ -1,13 +1,31 @@
 import os
 import shutil
+import hashlib
+import secrets
 import io
 import csv
-from functools import wraps
-from datetime import date
-
+import json
+import re
+import struct
+import time
+import threading
+import calendar
+import zipfile
+import tempfile
+import multiprocessing
+from functools import wraps, lru_cache
+from itertools import groupby
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, datetime, timedelta
+
+import click
+from flask.cli import AppGroup
 from flask import (
-    Flask, render_template, request, redirect,
-    url_for, flash, send_file, session
+    Flask, Blueprint, render_template, request, redirect,
+    url_for, flash, send_file, session, Response, jsonify,
+    get_template_attribute, current_app, stream_with_context
 )
 import sqlite3
 from werkzeug.security import generate_password_hash, check_password_hash
@@ -20,20 +38,63 @@ except ImportError:
     pdfmetrics = None
     TTFont = None
 
-# ----------------- AYARLAR -----------------
-DB_NAME = "servis_takip.db"
-
-app = Flask(__name__)
-app.secret_key = os.environ.get("SECRET_KEY", "yerelde-cok-gizli-olmayan-bir-sey")
-
-# PDF font klasörü
-FONT_DIR = os.path.join(os.path.dirname(__file__), "fonts")
-
+# Gerçek .xlsx çıktısı için (xlsxwriter yoksa Excel raporları CSV'ye düşer)
+try:
+    import xlsxwriter
+except ImportError:
+    xlsxwriter = None
 
-def register_pdf_fonts():
+# ----------------- AYARLAR -----------------
+# Varsayılan ayarlar; create_app(config) verilen anahtarlarla ezer.
+DEFAULT_CONFIG = {
+    # SQLite dosyası; ":memory:" verilirse uygulamaya özel bellek içi DB kullanılır
+    "DATABASE": "servis_takip.db",
+    "SECRET_KEY": os.environ.get("SECRET_KEY", "yerelde-cok-gizli-olmayan-bir-sey"),
+    # Şifre özeti yöntemi; testler "pbkdf2:sha256:1" gibi ucuz bir tur sayısı verir
+    "PASSWORD_HASH_METHOD": "pbkdf2:sha256",
+    # PDF font klasörü
+    "FONT_DIR": os.path.join(os.path.dirname(__file__), "fonts"),
+    # Günlük yedek klasörü; boşsa yedek alınmaz
+    "BACKUP_DIR": "backups",
+    # Kapanmış sezonların arşiv dosyaları (season_2024-2025.db ...)
+    "ARCHIVE_DIR": "archives",
+    # Arka plan rapor işlerinin ürettiği dosyalar
+    "REPORT_JOB_DIR": "report_jobs",
+    # "thread": her web sürecinde worker thread; "external": `flask report-worker`
+    "REPORT_WORKER": os.environ.get("REPORT_WORKER", "thread"),
+    # Sürekli WAL kopyası klasörü (tercihen başka disk); boşsa kapalı. Yalnızca SQLite dosyası
+    "REPLICA_DIR": os.environ.get("REPLICA_DIR", ""),
+    # "thread": her web sürecinde gönderici thread; "external": `flask replica run`
+    "REPLICA_SHIPPER": os.environ.get("REPLICA_SHIPPER", "thread"),
+    # True ise arka plan rapor işleri canlı DB yerine okuma kopyasından okur
+    "REPORTS_FROM_REPLICA": False,
+    # [(telefon, mesaj), ...] alıp [(başarılı_mı, hata), ...] dönen çağrılabilir;
+    # None ise mesajlar yalnızca konsola yazılır
+    "SMS_GATEWAY": None,
+}
+
+# Route'lar ve komutlar burada toplanır, create_app() uygulamaya bağlar
+bp = Blueprint("servis", __name__, cli_group=None)
+
+# Okul sezonu bu ayda başlar (Eylül) ve 12 ay sürer
+SEASON_START_MONTH = 9
+
+# Veli ekstreleri PDF üretiminde kullanılacak süreç sayısı
+STATEMENT_WORKERS = int(os.environ.get("STATEMENT_WORKERS", os.cpu_count() or 2))
+# Havuz süreçleri fork ile değil temiz bir süreçten başlatılır: çok thread'li
+# web sürecini (açık SQLite bağlantıları, kilitler) kopyalamamak için
+STATEMENT_MP_CONTEXT = ("forkserver" if "forkserver" in multiprocessing.get_all_start_methods()
+                        else "spawn")
+# Süreç başına kuyrukta bekleyen ekstre sayısı; bağlantı koparsa en fazla bu kadarı boşa üretilir
+STATEMENT_QUEUE_PER_WORKER = 2
+# Ekstre ilerleme kayıtları bu süre sonra silinir (yarıda kalan indirmeler dahil)
+STATEMENT_PROGRESS_TTL_HOURS = 1
+
+
+def register_pdf_fonts(font_dir=None):
     """
     Türkçe karakterler için DejaVu fontlarını kaydeder.
-    'fonts' klasöründeki TTF dosyalarını kullanır.
+    font_dir verilmezse FONT_DIR ayarındaki TTF dosyalarını kullanır.
     """
     if pdfmetrics is None or TTFont is None:
         # reportlab kurulmamışsa sessizce geç
@@ -45,8 +106,9 @@ def register_pdf_fonts():
         if "DejaVu" in registered:
             return  # daha önce kaydedilmiş
 
-        normal_path = os.path.join(FONT_DIR, "DejaVuSans.ttf")
-        bold_path = os.path.join(FONT_DIR, "DejaVuSans-Bold.ttf")
+        font_dir = font_dir or current_app.config["FONT_DIR"]
+        normal_path = os.path.join(font_dir, "DejaVuSans.ttf")
+        bold_path = os.path.join(font_dir, "DejaVuSans-Bold.ttf")
 
         pdfmetrics.registerFont(TTFont("DejaVu", normal_path))
         pdfmetrics.registerFont(TTFont("DejaVu-Bold", bold_path))
@@ -56,14 +118,241 @@ def register_pdf_fonts():
 
 
 # ----------------- DB BAĞLANTI -----------------
+@lru_cache(maxsize=256)
+def row_type(columns):
+    """Sütun adlarından satır tipi (namedtuple) üretir; aynı sorgu tipi tekrar kullanır."""
+    return namedtuple("Row", columns, rename=True)
+
+
+def named_row(cursor, row):
+    """
+    row_factory: satırlar hâlâ tuple'dır (s[1] çalışır, JSON'da liste olur)
+    ama alan adıyla da okunur (s.name). Örnek başına sözlük tutulmaz.
+    Aynı ada sahip sütunlar (ör. iki tablonun name'i) SQL'de AS ile ayrılmalıdır.
+    """
+    return row_type(tuple(col[0] for col in cursor.description))._make(row)
+
+
+# Türkçe alfabe sırası; SQLite'ın ikili karşılaştırması Ç, Ğ, İ, Ö, Ş, Ü'yü Z'den sonraya atar
+TURKISH_ALPHABET = "abcçdefgğhıijklmnoöpqrsştuüvwxyz"
+TURKISH_LETTER_RANK = {ch: 0x80 + i for i, ch in enumerate(TURKISH_ALPHABET)}
+# I/İ Türkçe kurala göre küçültülür, şapkalı harfler düz harf sayılır
+TURKISH_FOLD = str.maketrans({"I": "ı", "İ": "i", "â": "a", "Â": "a", "î": "i", "Î": "i",
+                              "û": "u", "Û": "u"})
+
+
+@lru_cache(maxsize=4096)
+def turkish_sort_key(text):
+    """
+    Büyük/küçük harf ayrımsız Türkçe sıralama anahtarı. Rakam, boşluk ve
+    noktalama harflerden önce, alfabe dışı karakterler sonra gelir. Eşitlikte
+    metnin kendisi karşılaştırılır; yalnızca aynı metinler eşit sayılır.
+    """
+    folded = text.translate(TURKISH_FOLD).lower()
+    return tuple(
+        TURKISH_LETTER_RANK.get(ch, ord(ch) if ord(ch) < 0x80 else 0x100 + ord(ch))
+        for ch in folded
+    ), text
+
+
+def turkish_collation(a, b):
+    """SQLite "turkish" collation'ı: COLLATE turkish ile sıralanan sütunlar ve indeksler için."""
+    key_a, key_b = turkish_sort_key(a), turkish_sort_key(b)
+    return (key_a > key_b) - (key_a < key_b)
+
+
 def get_conn():
-    return sqlite3.connect(DB_NAME)
+    # uri=True: bellek içi test DB'leri "file:...?mode=memory" adresiyle açılır
+    conn = sqlite3.connect(current_app.config["DATABASE"], uri=True)
+    conn.row_factory = named_row
+    # Öğrenci indeksleri bu collation'la kuruludur; students'a yazan her bağlantıda gerekir
+    conn.create_collation("turkish", turkish_collation)
+    if current_app.config["REPLICA_DIR"] and replica_shipper_alive():
+        # WAL'i yalnızca gönderici checkpoint eder; yoksa gönderilmemiş çerçeveler
+        # silinebilir. Gönderici susmuşsa WAL sınırsız büyümesin diye SQLite'ın
+        # otomatik checkpoint'i açık kalır (gönderici dönünce yeni nesil açar).
+        conn.execute("PRAGMA wal_autocheckpoint = 0")
+    return conn
+
+
+def get_read_conn():
+    """
+    Ağır rapor okumaları için bağlantı: REPORTS_FROM_REPLICA açıksa ve okuma
+    kopyası hazırsa onu (en fazla REPLICA_READ_REFRESH_SECONDS geride),
+    değilse canlı DB'yi açar.
+    """
+    if current_app.config["REPLICA_DIR"] and current_app.config["REPORTS_FROM_REPLICA"]:
+        replica = latest_read_replica()
+        if replica:
+            # Kopya yerinde değişmez, yenisiyle değiştirilir: immutable kilitsiz okur
+            conn = sqlite3.connect(f"file:{os.path.abspath(replica[0])}?mode=ro&immutable=1", uri=True)
+            conn.row_factory = named_row
+            conn.create_collation("turkish", turkish_collation)
+            return conn
+    return get_conn()
+
+
+def list_season_archives():
+    """Arşiv klasöründeki sezon dosyalarını [(sezon_etiketi, yol), ...] olarak döner."""
+    archive_dir = current_app.config["ARCHIVE_DIR"]
+    if not os.path.isdir(archive_dir):
+        return []
+    archives = []
+    for fname in sorted(os.listdir(archive_dir)):
+        if fname.startswith("season_") and fname.endswith(".db"):
+            archives.append((fname[len("season_"):-len(".db")], os.path.join(archive_dir, fname)))
+    return archives
+
+
+# Arşive taşınan tablolar ve kalıcı sütunları. Üretilmiş ay sütunları
+# (pay_ym / exp_ym) burada yoktur: arşivde ve eski arşiv dosyalarında
+# ifadeden hesaplanır, canlı DB'de indeksli sütundan okunur.
+ARCHIVED_COLUMNS = {
+    "payments": "id, student_id, pay_date, amount, description",
+    "expenses": "id, vehicle_id, exp_date, category, amount, description",
+    "student_vehicle": "id, student_id, vehicle_id, start_date, end_date",
+}
+
+# Tablo -> (üretilmiş yıl-ay sütunu, kaynak tarih sütunu)
+MONTH_KEY_COLUMNS = {
+    "payments": ("pay_ym", "pay_date"),
+    "expenses": ("exp_ym", "exp_date"),
+}
+
+
+def get_history_conn(replica=False):
+    """
+    Canlı DB + tüm sezon arşivleri (salt okunur) bağlantısı.
+    all_payments, all_expenses ve all_student_vehicle geçici görünümleri
+    canlı tablo ile arşivlerin birleşimidir; geçmiş raporlar bunları kullanır.
+    replica=True ise canlı DB yerine get_read_conn() kullanılır.
+    """
+    conn = get_read_conn() if replica else get_conn()
+
+    def select(table, schema, live):
+        columns = ARCHIVED_COLUMNS[table]
+        if table in MONTH_KEY_COLUMNS:
+            ym_col, date_col = MONTH_KEY_COLUMNS[table]
+            columns += f", {ym_col}" if live else f", substr({date_col}, 1, 7) AS {ym_col}"
+        if live:
+            return f"SELECT {columns} FROM {schema}.{table}"
+        # Arşivlemenin silme adımı yarıda kaldıysa satır canlıda da durur; iki kez sayılmaz
+        return (f"SELECT {columns} FROM {schema}.{table} AS a "
+                f"WHERE NOT EXISTS (SELECT 1 FROM main.{table} WHERE id = a.id)")
+
+    unions = {table: [select(table, "main", True)] for table in ARCHIVED_COLUMNS}
+
+    for i, (_, path) in enumerate(list_season_archives()):
+        alias = f"season{i}"
+        conn.execute(
+            "ATTACH DATABASE ? AS " + alias,
+            (f"file:{os.path.abspath(path)}?mode=ro",),
+        )
+        for table, parts in unions.items():
+            parts.append(select(table, alias, False))
+
+    for table, parts in unions.items():
+        conn.execute(f"CREATE TEMP VIEW all_{table} AS {' UNION ALL '.join(parts)}")
+    return conn
+
+
+# Öğrencinin ömür boyu ödeme toplamı: canlı ödemeler + arşive taşınmış sezon toplamları.
+# Aidat hesapları bunu kullanır; yoksa sezon arşivlenince ödemeler "yapılmamış" görünür.
+STUDENT_TOTAL_PAID_SQL = """
+    ((SELECT COALESCE(SUM(p.amount), 0) FROM payments p WHERE p.student_id = s.id)
+     + (SELECT COALESCE(SUM(ap.amount), 0) FROM archived_payment_totals ap
+        WHERE ap.student_id = s.id))
+"""
+
+
+def refresh_dues_allocation(conn, student_ids=None):
+    """
+    Aylık aidat dağıtımını (dues_allocation) küme bazlı yeniden hesaplar.
+    Her öğrencinin ödeme toplamı, 9 aylık dönemin aylarına eskiden yeniye
+    sırayla dağıtılır. student_ids verilirse yalnızca o öğrenciler yenilenir
+    (ödeme/öğrenci yazmalarında artımlı güncelleme). Commit çağırana aittir.
+    """
+    c = conn.cursor()
+    if student_ids is None:
+        c.execute("DELETE FROM dues_allocation")
+        where, params = "", []
+    else:
+        params = [int(sid) for sid in student_ids]
+        marks = ",".join("?" * len(params))
+        c.execute(f"DELETE FROM dues_allocation WHERE student_id IN ({marks})", params)
+        where = f"AND s.id IN ({marks})"
+
+    c.execute(f"""
+    INSERT INTO dues_allocation (student_id, period, due_year, due_month, due_date,
+                                 amount_due, amount_paid)
+    WITH RECURSIVE months(k) AS (
+        SELECT 0 UNION ALL SELECT k + 1 FROM months WHERE k < 8
+    ),
+    base AS (
+        SELECT s.id AS student_id,
+               s.monthly_fee AS fee,
+               s.start_year * 12 + s.start_month AS first_period,
+               {STUDENT_TOTAL_PAID_SQL} AS paid
+        FROM students s
+        WHERE s.is_active = 1
+          AND s.monthly_fee > 0
+          AND s.start_year AND s.start_month
+          {where}
+    )
+    SELECT b.student_id,
+           b.first_period + m.k,
+           (b.first_period + m.k - 1) / 12,
+           (b.first_period + m.k - 1) % 12 + 1,
+           printf('%04d-%02d-01', (b.first_period + m.k - 1) / 12,
+                  (b.first_period + m.k - 1) % 12 + 1),
+           b.fee,
+           MAX(0, MIN(b.fee, b.paid - b.fee * m.k))
+    FROM base b CROSS JOIN months m
+    """, params)
+
+
+def rebuild_dues_allocation(conn):
+    """
+    Dağıtımı tüm öğrenciler için baştan kurar ve tarihini meta'ya
+    (dues_allocation_built) yazar. Commit çağırana aittir.
+    """
+    refresh_dues_allocation(conn)
+    conn.execute("""
+        INSERT INTO meta (key, value) VALUES ('dues_allocation_built', ?)
+        ON CONFLICT(key) DO UPDATE SET value = excluded.value
+    """, (date.today().isoformat(),))
+
+
+# İlk kurulumda eklenen kullanıcılar
+DEFAULT_USERS = [
+    ("admin", "1234", "Yönetici", "admin"),
+    ("muhlis", "1234", "Muhlis Öztürk", "user"),
+    ("kullanici1", "1234", "Kullanıcı 1", "user"),
+    ("kullanici2", "1234", "Kullanıcı 2", "user"),
+]
+
+def hash_password(password):
+    """PASSWORD_HASH_METHOD ayarıyla şifre özeti üretir."""
+    return generate_password_hash(
+        password,
+        method=current_app.config["PASSWORD_HASH_METHOD"],
+        salt_length=16
+    )
+
+
+# change_log tetikleyicilerinin kurulduğu tablolar
+CHANGE_LOG_TABLES = ("students", "payments", "expenses", "vehicles", "student_vehicle")
 
 
 def create_tables():
     conn = get_conn()
     c = conn.cursor()
 
+    # WAL kalıcıdır: rapor işleri uzun okumalar sürerken ilerleme yazar,
+    # WAL'de açık okuma yazarı bekletmez (bellek içi DB WAL'e geçemez)
+    if "mode=memory" not in current_app.config["DATABASE"]:
+        c.execute("PRAGMA journal_mode = WAL")
+
     # ÖĞRENCİLER
     c.execute("""
     CREATE TABLE IF NOT EXISTS students (
@@ -124,6 +413,18 @@ def create_tables():
     )
     """)
 
+    # VELİ EKSTRESİ İLERLEMESİ (süresi dolan kayıtlar yeni üretimde silinir)
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS statement_progress (
+        token TEXT PRIMARY KEY,
+        done INTEGER NOT NULL,
+        total INTEGER NOT NULL,
+        expires_at TEXT NOT NULL
+    )
+    """)
+    # Eski sürümün meta'ya bıraktığı ilerleme kayıtları
+    c.execute("DELETE FROM meta WHERE key LIKE 'statement_progress:%'")
+
     # KULLANICILAR
     c.execute("""
     CREATE TABLE IF NOT EXISTS users (
@@ -139,17 +440,10 @@ def create_tables():
     c.execute("SELECT COUNT(*) FROM users")
     count_users = c.fetchone()[0]
     if count_users == 0:
-        default_users = [
-            ("admin", "1234", "Yönetici", "admin"),
-            ("muhlis", "1234", "Muhlis Öztürk", "user"),
-            ("kullanici1", "1234", "Kullanıcı 1", "user"),
-            ("kullanici2", "1234", "Kullanıcı 2", "user"),
-        ]
-
-        for uname, pwd, fname, role in default_users:
+        for uname, pwd, fname, role in DEFAULT_USERS:
             c.execute(
                 "INSERT INTO users (username, password_hash, full_name, role) VALUES (?, ?, ?, ?)",
-                (uname, generate_password_hash(pwd, method="pbkdf2:sha256", salt_length=16), fname, role),
+                (uname, hash_password(pwd), fname, role),
             )
 
     # ÖĞRENCİ–ARAÇ
@@ -165,16 +459,253 @@ def create_tables():
     )
     """)
 
+    # MOBİL UYGULAMA API ANAHTARLARI (yalnızca sha256 özeti saklanır)
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS api_tokens (
+        token_hash TEXT PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        created_at TEXT NOT NULL,
+        FOREIGN KEY(user_id) REFERENCES users(id)
+    )
+    """)
+
+    # DEĞİŞİKLİK GÜNLÜĞÜ (artımlı senkron için, yalnızca ekleme yapılır)
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS change_log (
+        version INTEGER PRIMARY KEY AUTOINCREMENT,
+        entity TEXT NOT NULL,
+        entity_id INTEGER NOT NULL,
+        op TEXT NOT NULL,
+        changed_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+
+    # Her yazma işlemini tetikleyiciyle günlüğe düş; route'ların bilmesi gerekmez
+    for table in CHANGE_LOG_TABLES:
+        for op, row in (("insert", "NEW"), ("update", "NEW"), ("delete", "OLD")):
+            c.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_{op}
+            AFTER {op.upper()} ON {table}
+            BEGIN
+                INSERT INTO change_log (entity, entity_id, op)
+                VALUES ('{table}', {row}.id, '{op}');
+            END
+            """)
+
+    c.execute("CREATE INDEX IF NOT EXISTS idx_payments_student ON payments(student_id)")
+
+    # Öğrenci listeleri Türkçe sırayla doğrudan indeksten okunur, sıralama adımı olmaz.
+    # Sorgular da ORDER BY ... COLLATE turkish yazmalıdır, yoksa indeks kullanılmaz.
+    c.execute("CREATE INDEX IF NOT EXISTS idx_students_name ON students(name COLLATE turkish)")
+    c.execute("""
+    CREATE INDEX IF NOT EXISTS idx_students_school_name
+        ON students(school COLLATE turkish, name COLLATE turkish)
+    """)
+
+    # ATAMA GEÇMİŞİ: aralıklar yarı açıktır [start_date, end_date); açık atamada
+    # end_date yalnızca NULL'dır. Eski kayıtlardaki '' bir kez NULL'a çevrilir,
+    # sonrasında tetikleyici '' yazılmasını reddeder.
+    c.execute("UPDATE student_vehicle SET end_date = NULL WHERE end_date = ''")
+    for name, event in (("trg_student_vehicle_end_insert", "BEFORE INSERT"),
+                        ("trg_student_vehicle_end_update", "BEFORE UPDATE OF end_date")):
+        c.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {name} {event} ON student_vehicle
+        WHEN NEW.end_date = ''
+        BEGIN SELECT RAISE(ABORT, 'Açık atamada end_date NULL olmalıdır.'); END
+        """)
+    # "Şu tarihte araçta kim vardı": araç + başlangıç aralığında arama, bitiş ve
+    # öğrenci indeksten okunur. Öğrenci zaman çizelgesi ikinci indeksten gelir.
+    c.execute("""
+    CREATE INDEX IF NOT EXISTS idx_student_vehicle_interval
+        ON student_vehicle(vehicle_id, start_date, end_date, student_id)
+    """)
+    c.execute("DROP INDEX IF EXISTS idx_student_vehicle_student")
+    c.execute("""
+    CREATE INDEX IF NOT EXISTS idx_student_vehicle_timeline
+        ON student_vehicle(student_id, start_date)
+    """)
+
+    # ARAÇ LİSTESİ SÜRÜMLERİ (liste önbelleğinin geçersiz kılınması için)
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS vehicle_roster_version (
+        vehicle_id INTEGER PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0
+    )
+    """)
+
+    # Yalnızca listesi gerçekten değişen araçların sürümü artar
+    bump = """
+        INSERT OR IGNORE INTO vehicle_roster_version (vehicle_id, version)
+        SELECT {ids}, 0 {src};
+        UPDATE vehicle_roster_version SET version = version + 1
+        WHERE vehicle_id IN (SELECT {ids} {src});
+    """
+    open_assignments = ("FROM student_vehicle WHERE student_id = {row}.id "
+                        "AND end_date IS NULL")
+    roster_triggers = {
+        "trg_roster_sv_insert": ("AFTER INSERT ON student_vehicle",
+                                 [("NEW.vehicle_id", "")]),
+        "trg_roster_sv_update": ("AFTER UPDATE ON student_vehicle",
+                                 [("OLD.vehicle_id", ""), ("NEW.vehicle_id", "")]),
+        "trg_roster_sv_delete": ("AFTER DELETE ON student_vehicle",
+                                 [("OLD.vehicle_id", "")]),
+        "trg_roster_students_update": ("AFTER UPDATE ON students",
+                                       [("vehicle_id", open_assignments.format(row="NEW"))]),
+        "trg_roster_students_delete": ("AFTER DELETE ON students",
+                                       [("vehicle_id", open_assignments.format(row="OLD"))]),
+        "trg_roster_vehicles_insert": ("AFTER INSERT ON vehicles", [("NEW.id", "")]),
+        "trg_roster_vehicles_update": ("AFTER UPDATE ON vehicles", [("NEW.id", "")]),
+    }
+    for name, (event, targets) in roster_triggers.items():
+        body = "".join(bump.format(ids=ids, src=src) for ids, src in targets)
+        c.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {body} END")
+
+    # TOPLU SMS KAMPANYALARI (gecikme hatırlatmaları)
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS sms_campaigns (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        created_at TEXT NOT NULL,
+        created_by TEXT,
+        template TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        total INTEGER NOT NULL DEFAULT 0,
+        sent INTEGER NOT NULL DEFAULT 0,
+        failed INTEGER NOT NULL DEFAULT 0,
+        finished_at TEXT
+    )
+    """)
+
+    # Kampanya başına telefon tekildir: kardeşlerin velisine tek mesaj gider
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS sms_campaign_messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        campaign_id INTEGER NOT NULL,
+        phone TEXT NOT NULL,
+        parent_name TEXT,
+        message TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        error TEXT,
+        sent_at TEXT,
+        UNIQUE (campaign_id, phone),
+        FOREIGN KEY(campaign_id) REFERENCES sms_campaigns(id)
+    )
+    """)
+
+    # ARKA PLAN RAPOR İŞLERİ (kuyruk; tüm gunicorn worker'ları aynı tabloyu görür)
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS report_jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        params TEXT NOT NULL,
+        title TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'queued',
+        created_at TEXT NOT NULL,
+        created_by TEXT,
+        started_at TEXT,
+        heartbeat_at TEXT,
+        finished_at TEXT,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        done INTEGER NOT NULL DEFAULT 0,
+        total INTEGER NOT NULL DEFAULT 0,
+        file_path TEXT,
+        filename TEXT,
+        mimetype TEXT,
+        error TEXT,
+        expires_at TEXT
+    )
+    """)
+    c.execute("""
+    CREATE INDEX IF NOT EXISTS idx_report_jobs_status
+        ON report_jobs(status, id)
+    """)
+
+    # ARŞİVLENMİŞ ÖDEME TOPLAMLARI: sezon arşivine taşınan ödemelerin öğrenci ve
+    # sezon başına toplamı. Aidat hesapları ömür boyu ödemeyi bu tabloyla tamamlar.
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS archived_payment_totals (
+        student_id INTEGER NOT NULL,
+        season TEXT NOT NULL,
+        paid_until TEXT NOT NULL,
+        amount REAL NOT NULL,
+        PRIMARY KEY (student_id, season)
+    ) WITHOUT ROWID
+    """)
+    c.execute("SELECT value FROM meta WHERE key='archived_payment_totals_built'")
+    if c.fetchone() is None:
+        # Tablodan önce arşivlenmiş sezonlar dosyalarından bir kez toplanır
+        for label, path in list_season_archives():
+            c.execute("ATTACH DATABASE ? AS archive", (f"file:{os.path.abspath(path)}?mode=ro",))
+            c.execute("""
+                INSERT OR REPLACE INTO archived_payment_totals
+                    (student_id, season, paid_until, amount)
+                SELECT student_id, ?, MAX(pay_date), SUM(amount)
+                FROM archive.payments
+                GROUP BY student_id
+            """, (label,))
+            conn.commit()
+            c.execute("DETACH DATABASE archive")
+        c.execute(
+            "INSERT INTO meta (key, value) VALUES (?, ?)",
+            ("archived_payment_totals_built", date.today().isoformat()),
+        )
+
+    # AYLIK AİDAT DAĞITIMI (ödemelerin aylara dağıtılmış, önceden hesaplanmış hali)
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS dues_allocation (
+        student_id INTEGER NOT NULL,
+        period INTEGER NOT NULL,
+        due_year INTEGER NOT NULL,
+        due_month INTEGER NOT NULL,
+        due_date TEXT NOT NULL,
+        amount_due REAL NOT NULL,
+        amount_paid REAL NOT NULL,
+        PRIMARY KEY (student_id, period)
+    ) WITHOUT ROWID
+    """)
+
+    c.execute("SELECT value FROM meta WHERE key='dues_allocation_built'")
+    if c.fetchone() is None:
+        rebuild_dues_allocation(conn)
+
+    # AY ANAHTARLARI (gider/ödeme pivotları ay bazında indeksten gruplanır)
+    for table, (ym_col, date_col) in MONTH_KEY_COLUMNS.items():
+        c.execute(f"PRAGMA table_xinfo({table})")
+        if ym_col not in [row[1] for row in c.fetchall()]:
+            c.execute(f"""
+            ALTER TABLE {table} ADD COLUMN {ym_col} TEXT
+                GENERATED ALWAYS AS (substr({date_col}, 1, 7)) VIRTUAL
+            """)
+    c.execute("""
+    CREATE INDEX IF NOT EXISTS idx_expenses_month
+        ON expenses(exp_ym, vehicle_id, category, amount)
+    """)
+    c.execute("""
+    CREATE INDEX IF NOT EXISTS idx_payments_month
+        ON payments(pay_ym, student_id, amount)
+    """)
+
     conn.commit()
     conn.close()
-    
-register_pdf_fonts()
-create_tables()
+
+
+def app_state():
+    """Uygulamaya ait çalışma zamanı durumu (önbellek, rapor worker'ı)."""
+    return current_app.extensions["servis"]
+
+
+def run_in_app_context(app, func, *args):
+    """Thread hedefi: func'ı verilen uygulamanın bağlamında çalıştırır."""
+    with app.app_context():
+        return func(*args)
 
 
 # ----------------- GÜNLÜK YEDEK -----------------
 def ensure_daily_backup():
-    """Her gün ilk girişte db'nin kopyasını backups klasörüne alır."""
+    """Her gün ilk girişte db'nin kopyasını BACKUP_DIR klasörüne alır."""
+    backup_dir = current_app.config["BACKUP_DIR"]
+    if not backup_dir:
+        return
+
     today_str = date.today().isoformat()
 
     conn = get_conn()
@@ -185,9 +716,12 @@ def ensure_daily_backup():
     last_backup = row[0] if row else None
 
     if last_backup != today_str:
-        os.makedirs("backups", exist_ok=True)
-        backup_path = os.path.join("backups", f"servis_takip_{today_str}.db")
-        shutil.copyfile(DB_NAME, backup_path)
+        os.makedirs(backup_dir, exist_ok=True)
+        backup_path = os.path.join(backup_dir, f"servis_takip_{today_str}.db")
+        # Dosya kopyası yerine backup API: bellek içi DB'de de tutarlı kopya alır
+        backup = sqlite3.connect(backup_path)
+        conn.backup(backup)
+        backup.close()
 
         if row:
             c.execute(
@@ -204,7 +738,458 @@ def ensure_daily_backup():
     conn.close()
 
 
-# ----------------- SMS (MOCK) -----------------
+# ----------------- SÜREKLİ YEDEK (WAL KOPYASI) -----------------
+# Günlük yedek bir günlük veri kaybettirebilir. REPLICA_DIR verilirse DB WAL
+# kipine alınır ve commit edilen WAL çerçeveleri saniyeler içinde o klasöre
+# (tercihen başka bir diske) kopyalanır:
+#   generations/<ms>/snapshot.db                 neslin başındaki tam kopya
+#   generations/<ms>/<tur>-<ilk>-<son>-<ms>.wal  sonrasında commit edilen çerçeveler
+#   position.json                                gönderilen son çerçeve
+#   read/<nesil>-<tur>-<çerçeve>.db              raporlar için okuma kopyası
+# Geri yüklemede snapshot kopyalanır, parçalar istenen zamana kadar SQLite'ın
+# kendi WAL kurtarmasıyla (checksum doğrulamalı) uygulanır.
+REPLICA_SHIP_SECONDS = 1.0
+REPLICA_CHECKPOINT_FRAMES = 1000  # WAL bu kadar çerçeveyi geçince gönderici checkpoint eder
+REPLICA_GENERATION_HOURS = 24  # bu süreden eski nesil yerine yeni tam kopya alınır
+REPLICA_RETENTION_DAYS = 7  # bu süreden eski zamanlara geri dönülemez
+REPLICA_READ_REFRESH_SECONDS = 60  # okuma kopyası en fazla bu sıklıkta yenilenir
+REPLICA_STALE_MINUTES = 10  # position.json bu süre dokunulmazsa gönderici durmuş sayılır
+
+# WAL başlığı: magic, sürüm, sayfa boyu, checkpoint sırası, salt1, salt2, checksum1-2
+WAL_HEADER = struct.Struct(">8I")
+# Çerçeve başlığı: sayfa no, commit ise DB'nin sayfa sayısı, salt1, salt2, checksum1-2
+WAL_FRAME_HEADER = struct.Struct(">6I")
+
+replica_cli = AppGroup("replica", help="Sürekli WAL kopyası komutları.")
+bp.cli.add_command(replica_cli)
+
+_replica_shipper_lock = threading.Lock()
+
+
+def replica_path(*parts):
+    return os.path.join(current_app.config["REPLICA_DIR"], *parts)
+
+
+def enable_wal_shipping():
+    """DB'yi WAL kipine alır (dosyada kalıcıdır) ve kopya klasörünü hazırlar."""
+    if "mode=memory" in current_app.config["DATABASE"]:
+        raise RuntimeError("Bellek içi DB için WAL kopyası kurulamaz (REPLICA_DIR boş olmalı).")
+    os.makedirs(replica_path("generations"), exist_ok=True)
+    conn = get_conn()
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.close()
+
+
+def write_replica_file(path, data):
+    """Yarım dosya görünmesin diye .part'a yazar, diske indirir ve yerine taşır."""
+    part = path + ".part"
+    with open(part, "wb" if isinstance(data, bytes) else "w") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(part, path)
+
+
+def read_replica_position():
+    try:
+        with open(replica_path("position.json")) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def replica_shipper_alive():
+    """Gönderici (herhangi bir süreçte) son REPLICA_STALE_MINUTES içinde çalıştıysa True."""
+    try:
+        age = time.time() - os.path.getmtime(replica_path("position.json"))
+    except OSError:
+        return False
+    return age < REPLICA_STALE_MINUTES * 60
+
+
+def read_wal_header():
+    """WAL başlığını sözlük olarak döner; WAL yoksa ya da boşsa None."""
+    try:
+        with open(current_app.config["DATABASE"] + "-wal", "rb") as f:
+            raw = f.read(WAL_HEADER.size)
+    except FileNotFoundError:
+        return None
+    if len(raw) < WAL_HEADER.size:
+        return None
+    _, _, page_size, _, salt1, salt2, _, _ = WAL_HEADER.unpack(raw)
+    return {"page_size": page_size, "salt": [salt1, salt2], "raw": raw}
+
+
+def list_replica_generations():
+    """Tamamlanmış nesilleri eskiden yeniye [(başlangıç_ms, klasör), ...] döner."""
+    root = replica_path("generations")
+    if not os.path.isdir(root):
+        return []
+    generations = []
+    for name in sorted(os.listdir(root)):
+        path = os.path.join(root, name)
+        if name.isdigit() and os.path.exists(os.path.join(path, "snapshot.db")):
+            generations.append((int(name), path))
+    return generations
+
+
+def list_replica_segments(gen_dir):
+    """Neslin WAL parçalarını gönderim sırasıyla [(tur, ilk, son, ms, yol), ...] döner."""
+    segments = []
+    for fname in os.listdir(gen_dir):
+        if fname.endswith(".wal"):
+            run, first, last, shipped_ms = (int(x) for x in fname[:-len(".wal")].split("-"))
+            segments.append((run, first, last, shipped_ms, os.path.join(gen_dir, fname)))
+    return sorted(segments)
+
+
+def prune_replica_generations():
+    """Saklama süresi içindeki hiçbir anı geri yüklemek için gerekmeyen nesilleri siler."""
+    cutoff = (time.time() - REPLICA_RETENTION_DAYS * 86400) * 1000
+    generations = list_replica_generations()
+    for (_, path), (next_started, _) in zip(generations, generations[1:]):
+        if next_started <= cutoff:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def start_replica_generation(header):
+    """
+    Yeni nesil açar: DB'nin tutarlı tam kopyasını alır. Çağıran yazma kilidini
+    tuttuğu için kopya WAL'deki tüm commit'leri içerir; güncel WAL turu yine de
+    1. çerçeveden gönderilir (geri yüklemede aynı sayfaları tekrar yazmak zararsızdır).
+    """
+    started = int(time.time() * 1000)
+    gen_dir = replica_path("generations", f"{started:013d}")
+    os.makedirs(gen_dir, exist_ok=True)
+
+    part = os.path.join(gen_dir, "snapshot.db.part")
+    source = get_conn()
+    snapshot = sqlite3.connect(part)
+    source.backup(snapshot)
+    snapshot.close()
+    source.close()
+    os.replace(part, os.path.join(gen_dir, "snapshot.db"))
+
+    prune_replica_generations()
+    return {
+        "generation": started,
+        "run": 0,
+        "page_size": header["page_size"] if header else None,
+        "salt": header["salt"] if header else None,
+        "frame": 0,
+        "checkpointed": False,
+        "shipped_at": started,
+    }
+
+
+def wal_continues(pos, header):
+    """Bu WAL turu, gönderilen son çerçeveden kesintisiz mi devam ediyor?"""
+    if pos["salt"] is None:
+        return True  # nesil boş WAL ile başladı; bu tur tümüyle yeni
+    # WAL ancak tamamen checkpoint edildikten sonra baştan başlar ve her seferinde
+    # salt1 bir artar. Checkpoint'i gönderici yaptıysa önceki turun tüm çerçeveleri
+    # gönderilmiştir; başka türlü (ya da birden çok kez) başladıysa arada kayıp olabilir.
+    return (pos["checkpointed"]
+            and header["page_size"] == pos["page_size"]
+            and header["salt"][0] == (pos["salt"][0] + 1) & 0xFFFFFFFF)
+
+
+def ship_wal(conn, resume=True):
+    """
+    Gönderilmemiş commit'li WAL çerçevelerini kopya klasörüne yazar; yazılan
+    çerçeve sayısını döner. conn üzerinde yazma kilidi (BEGIN IMMEDIATE) alınır:
+    kilit boyunca yarım yazılmış çerçeve olamaz ve WAL baştan başlayamaz. Kilit
+    yalnızca yeni çerçevelerin kopyası (ve gerekirse checkpoint) kadar sürer.
+    resume=False (gönderici yeni başladı) iken WAL başka turdaysa yeni nesil açılır.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        saved = read_replica_position()
+        pos = dict(saved) if saved else None
+        header = read_wal_header()
+        if (pos is None
+                or not os.path.isdir(replica_path("generations", f"{pos['generation']:013d}"))
+                or time.time() * 1000 - pos["generation"] > REPLICA_GENERATION_HOURS * 3600 * 1000):
+            pos = start_replica_generation(header)
+        elif header and header["salt"] != pos["salt"]:
+            if resume and wal_continues(pos, header):
+                pos = dict(pos, run=pos["run"] + 1 if pos["salt"] else pos["run"],
+                           page_size=header["page_size"], salt=header["salt"],
+                           frame=0, checkpointed=False)
+            else:
+                pos = start_replica_generation(header)
+        if header is None:
+            if pos != saved:
+                write_replica_file(replica_path("position.json"), json.dumps(pos))
+            return 0
+
+        frame_size = WAL_FRAME_HEADER.size + header["page_size"]
+        frames, committed = [], 0
+        with open(current_app.config["DATABASE"] + "-wal", "rb") as f:
+            f.seek(WAL_HEADER.size + pos["frame"] * frame_size)
+            while True:
+                frame = f.read(frame_size)
+                if len(frame) < frame_size:
+                    break
+                _, commit_size, salt1, salt2, _, _ = WAL_FRAME_HEADER.unpack_from(frame)
+                if [salt1, salt2] != header["salt"]:
+                    break  # önceki turdan kalmış eski çerçeve: WAL'in geçerli sonu
+                frames.append(frame)
+                if commit_size:
+                    committed = len(frames)  # yalnızca tamamlanmış işlemler gönderilir
+
+        if committed:
+            first, last = pos["frame"] + 1, pos["frame"] + committed
+            body = b"".join(frames[:committed])
+            if first == 1:
+                body = header["raw"] + body  # turun ilk parçası WAL başlığıyla başlar
+            shipped_at = int(time.time() * 1000)
+            gen_dir = replica_path("generations", f"{pos['generation']:013d}")
+            write_replica_file(
+                os.path.join(gen_dir, f"{pos['run']:06d}-{first:08d}-{last:08d}-{shipped_at}.wal"),
+                body,
+            )
+            pos.update(frame=last, checkpointed=False, shipped_at=shipped_at)
+
+        if not pos["checkpointed"] and pos["frame"] >= REPLICA_CHECKPOINT_FRAMES:
+            # Kilit hâlâ bizde: checkpoint yalnızca gönderilmiş çerçeveleri DB'ye
+            # yazar. Tamamlanırsa sonraki yazan WAL'i baştan başlatır.
+            checkpointer = get_conn()
+            _, wal_frames, backfilled = checkpointer.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone()
+            checkpointer.close()
+            pos["checkpointed"] = wal_frames == backfilled == pos["frame"]
+
+        if pos != saved:
+            write_replica_file(replica_path("position.json"), json.dumps(pos))
+        return committed
+    finally:
+        conn.rollback()
+
+
+def restore_replica(target, until_ms=None, base=None):
+    """
+    WAL kopyasını target dosyasına geri yükler: until_ms (epoch ms) anına kadar
+    gönderilmiş son duruma, verilmezse en güncel duruma. Anın düştüğü neslin
+    snapshot'ı kopyalanır, parçalar tur tur -wal dosyası olarak yazılıp
+    checkpoint ile uygulanır. base=(yol, nesil, tur, çerçeve) aynı nesildeyse
+    snapshot yerine o DB'den başlanır ve yalnızca o turdan itibaren uygulanır.
+    (nesil, tur, çerçeve, gönderim_ms) döner.
+    """
+    generations = [g for g in list_replica_generations() if until_ms is None or g[0] <= until_ms]
+    if not generations:
+        raise ValueError("Bu zamana ait WAL kopyası bulunamadı.")
+    generation, gen_dir = generations[-1]
+
+    source, start_run, start_frame = os.path.join(gen_dir, "snapshot.db"), 0, 0
+    if base and base[1] == generation:
+        source, _, start_run, start_frame = base
+    segments = [
+        s for s in list_replica_segments(gen_dir)
+        if s[0] >= start_run and (until_ms is None or s[3] <= until_ms)
+    ]
+
+    part = target + ".part"
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(part + suffix):
+            os.remove(part + suffix)
+    shutil.copyfile(source, part)
+    db = sqlite3.connect(part)
+    db.execute("PRAGMA journal_mode = WAL")
+    db.close()
+
+    restored = (generation, start_run, start_frame, generation)
+    for run, run_segments in groupby(segments, key=lambda s: s[0]):
+        run_segments = list(run_segments)
+        expected_first = 1
+        with open(part + "-wal", "wb") as wal:
+            for _, first, last, _, path in run_segments:
+                if first != expected_first:
+                    raise ValueError(f"WAL kopyasında boşluk var (tur {run}, çerçeve {expected_first}).")
+                with open(path, "rb") as f:
+                    shutil.copyfileobj(f, wal)
+                expected_first = last + 1
+
+        db = sqlite3.connect(part)
+        _, wal_frames, backfilled = db.execute("PRAGMA wal_checkpoint(FULL)").fetchone()
+        db.close()  # son bağlantı: uygulanmış -wal dosyası silinir
+        _, _, last, shipped_ms, _ = run_segments[-1]
+        if not wal_frames == backfilled == last:
+            raise ValueError(f"WAL parçası bozuk (tur {run}: {backfilled}/{last} çerçeve uygulandı).")
+        restored = (generation, run, last, shipped_ms)
+
+    db = sqlite3.connect(part)
+    db.execute("PRAGMA journal_mode = DELETE")  # tek dosya: taşınabilir, immutable okunabilir
+    db.close()
+    os.replace(part, target)
+    return restored
+
+
+def latest_read_replica():
+    """En güncel okuma kopyası: (yol, nesil, tur, çerçeve) ya da None."""
+    read_dir = replica_path("read")
+    if not os.path.isdir(read_dir):
+        return None
+    names = sorted(f for f in os.listdir(read_dir) if f.endswith(".db") and f[0].isdigit())
+    if not names:
+        return None
+    generation, run, frame = (int(x) for x in names[-1][:-len(".db")].split("-"))
+    return os.path.join(read_dir, names[-1]), generation, run, frame
+
+
+def refresh_read_replica():
+    """
+    Okuma kopyasını son gönderime getirir. Yeni kopya ayrı dosyada kurulup
+    adıyla yayımlanır; açık rapor bağlantıları eski dosyayı okumaya devam eder.
+    """
+    pos = read_replica_position()
+    current = latest_read_replica()
+    if pos is None or (current and current[1:] == (pos["generation"], pos["run"], pos["frame"])):
+        return
+
+    read_dir = replica_path("read")
+    os.makedirs(read_dir, exist_ok=True)
+    tmp = os.path.join(read_dir, f"tmp-{secrets.token_hex(8)}.db")
+    generation, run, frame, _ = restore_replica(tmp, base=current)
+    os.replace(tmp, os.path.join(read_dir, f"{generation:013d}-{run:06d}-{frame:08d}.db"))
+
+    latest = latest_read_replica()[0]
+    for fname in os.listdir(read_dir):
+        path = os.path.join(read_dir, fname)
+        if fname.endswith(".db") and fname[0].isdigit() and path != latest:
+            os.remove(path)
+
+
+def replica_shipper_loop():
+    """
+    WAL'i REPLICA_SHIP_SECONDS aralıkla gönderir. Bağlantı döngü boyunca açık
+    kalır: SQLite son bağlantı kapanırken WAL'i checkpoint edip siler, bu da
+    gönderilmemiş çerçeveleri kaybettirirdi.
+    """
+    conn = get_conn()
+    resume = False
+    refreshed_at = 0
+    while True:
+        try:
+            ship_wal(conn, resume)
+            resume = True
+            # Konum değişmese de dokunulur: diğer süreçler göndericinin yaşadığını buradan bilir
+            os.utime(replica_path("position.json"))
+            if (current_app.config["REPORTS_FROM_REPLICA"]
+                    and time.time() - refreshed_at >= REPLICA_READ_REFRESH_SECONDS):
+                refresh_read_replica()
+                refreshed_at = time.time()
+        except Exception as e:
+            print(f"[WAL KOPYASI HATASI] {e}")
+        time.sleep(REPLICA_SHIP_SECONDS)
+
+
+def start_replica_shipper(app):
+    """REPLICA_DIR verildiyse bu süreçte gönderici thread'i başlatır (REPLICA_SHIPPER=external hariç)."""
+    config = app.config
+    if not config["REPLICA_DIR"] or config["REPLICA_SHIPPER"] != "thread":
+        return
+    state = app.extensions["servis"]
+    with _replica_shipper_lock:
+        shipper = state["replica_shipper"]
+        if shipper is None or not shipper.is_alive():
+            shipper = threading.Thread(
+                target=run_in_app_context,
+                args=(app, replica_shipper_loop),
+                name="replica-shipper", daemon=True,
+            )
+            shipper.start()
+            state["replica_shipper"] = shipper
+
+
+@bp.before_app_request
+def ensure_replica_shipper():
+    """Gönderici create_app() içinde başlar; thread ölmüşse ilk istekte yeniden başlatılır."""
+    start_replica_shipper(current_app._get_current_object())
+
+
+def format_epoch_ms(ms):
+    return datetime.fromtimestamp(ms / 1000).strftime("%Y-%m-%d %H:%M:%S")
+
+
+@replica_cli.command("run")
+def replica_run_command():
+    """WAL'i sürekli gönderir (REPLICA_SHIPPER=external iken web süreçleri yerine)."""
+    if not current_app.config["REPLICA_DIR"]:
+        raise click.ClickException("REPLICA_DIR ayarlı değil.")
+    click.echo(f"WAL kopyası gönderiliyor: {current_app.config['REPLICA_DIR']}")
+    replica_shipper_loop()
+
+
+@replica_cli.command("status")
+def replica_status_command():
+    """Gönderim konumunu, nesilleri ve okuma kopyasını listeler."""
+    if not current_app.config["REPLICA_DIR"]:
+        raise click.ClickException("REPLICA_DIR ayarlı değil.")
+    pos = read_replica_position()
+    if pos is None:
+        click.echo("Henüz gönderim yapılmadı.")
+    else:
+        click.echo(f"Son gönderim: {format_epoch_ms(pos['shipped_at'])} "
+                   f"(nesil {pos['generation']}, tur {pos['run']}, çerçeve {pos['frame']})")
+        if not replica_shipper_alive():
+            click.echo(f"UYARI: gönderici {REPLICA_STALE_MINUTES} dakikadır çalışmıyor; "
+                       "WAL otomatik checkpoint ediliyor, kopyada boşluk oluşabilir.")
+    for started, gen_dir in list_replica_generations():
+        segments = list_replica_segments(gen_dir)
+        size = sum(os.path.getsize(os.path.join(gen_dir, f)) for f in os.listdir(gen_dir))
+        click.echo(f"Nesil {started}: {format_epoch_ms(started)} itibarıyla, "
+                   f"{len(segments)} parça, {size / 1024:.1f} KB")
+    replica = latest_read_replica()
+    if replica:
+        click.echo(f"Okuma kopyası: {replica[0]}")
+
+
+@replica_cli.command("restore")
+@click.argument("target")
+@click.option("--until", default=None,
+              help='Bu ana kadarki hâl, ör. "2026-10-19 14:30" (verilmezse en güncel hâl).')
+def replica_restore_command(target, until):
+    """WAL kopyasını TARGET dosyasına geri yükler; canlı DB'ye dokunmaz."""
+    if not current_app.config["REPLICA_DIR"]:
+        raise click.ClickException("REPLICA_DIR ayarlı değil.")
+    if os.path.exists(target):
+        raise click.ClickException(f"{target} zaten var; başka bir hedef verin.")
+
+    until_ms = None
+    if until:
+        try:
+            until_ms = int(datetime.fromisoformat(until).timestamp() * 1000)
+        except ValueError:
+            raise click.ClickException("Tarih biçimi: YYYY-MM-DD SS:DD[:ss]")
+
+    try:
+        generation, run, frame, shipped_ms = restore_replica(target, until_ms)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"{target} geri yüklendi: {format_epoch_ms(shipped_ms)} itibarıyla "
+               f"(nesil {generation}, tur {run}, çerçeve {frame}).")
+
+
+# ----------------- SMS -----------------
+def mock_sms_gateway(messages):
+    """SMS_GATEWAY ayarlanmamışsa kullanılır; mesajları sadece konsola yazar."""
+    results = []
+    for phone, message in messages:
+        print(f"[SMS MOCK] {phone} -> {message}")
+        results.append((True, None))
+    return results
+
+
+def send_sms_batch(messages):
+    """
+    [(telefon, mesaj), ...] listesini SMS_GATEWAY ayarındaki servise tek
+    istekte gönderir, her mesaj için (başarılı_mı, hata) döner. Gerçek servis
+    (NetGSM, İleti Merkezi vs.) toplu gönderimi destekler.
+    """
+    gateway = current_app.config["SMS_GATEWAY"] or mock_sms_gateway
+    return gateway(messages)
+
+
 def send_sms_to_parent(student_id, amount, pay_date, description):
     """
     Burada gerçek SMS servisi (NetGSM, İleti Merkezi vs.) ile entegrasyon yapılabilir.
@@ -219,7 +1204,7 @@ def send_sms_to_parent(student_id, amount, pay_date, description):
     if not row:
         return
 
-    parent_name, phone, student_name = row[0], row[1], row[2]
+    parent_name, phone, student_name = row
     if not phone:
         return
 
@@ -228,8 +1213,7 @@ def send_sms_to_parent(student_id, amount, pay_date, description):
         f"{pay_date} tarihinde {amount:.2f} TL ödeme alınmıştır. "
         "Öz Ceylan Turizm teşekkür eder."
     )
-    # Şimdilik sadece log:
-    print(f"[SMS MOCK] {phone} -> {message}")
+    send_sms_batch([(phone, message)])
 
 
 # ----------------- LOGIN KONTROL DECORATOR -----------------
@@ -237,13 +1221,106 @@ def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
         if not session.get("user_id"):
-            return redirect(url_for("login"))
+            return redirect(url_for("servis.login"))
         return f(*args, **kwargs)
     return decorated_function
 
 
+def api_login_required(f):
+    """
+    API uçları için: oturum (login_required ile aynı session) veya
+    'Authorization: Bearer <token>' başlığı ile gelen anahtar kabul edilir.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if session.get("user_id"):
+            return f(*args, **kwargs)
+
+        auth = request.headers.get("Authorization", "")
+        if auth.startswith("Bearer "):
+            token_hash = hashlib.sha256(auth[7:].strip().encode()).hexdigest()
+            conn = get_conn()
+            c = conn.cursor()
+            c.execute("SELECT user_id FROM api_tokens WHERE token_hash=?", (token_hash,))
+            row = c.fetchone()
+            conn.close()
+            if row:
+                return f(*args, **kwargs)
+
+        return jsonify({"error": "Yetkisiz erişim."}), 401
+    return decorated_function
+
+
+# ----------------- YAZMA YANITLARI -----------------
+# Panel tablolarındaki satırlar; sütun sırası index() sorgularıyla aynıdır
+DASHBOARD_ROW_QUERIES = {
+    "students": """
+        SELECT id, name, school, parent_name, phone, monthly_fee,
+               start_year, start_month, is_active
+        FROM students WHERE id = ?
+    """,
+    "payments": """
+        SELECT p.id, s.name AS student_name, p.pay_date, p.amount, p.description
+        FROM payments p
+        JOIN students s ON s.id = p.student_id
+        WHERE p.id = ?
+    """,
+    "expenses": """
+        SELECT e.id, e.exp_date, e.category, e.amount, e.description,
+               v.plate, v.name AS vehicle_name
+        FROM expenses e
+        LEFT JOIN vehicles v ON v.id = e.vehicle_id
+        WHERE e.id = ?
+    """,
+    "vehicles": """
+        SELECT id, plate, name, capacity, route, is_active
+        FROM vehicles WHERE id = ?
+    """,
+    "student_vehicle": """
+        SELECT id, student_id, vehicle_id, start_date, end_date
+        FROM student_vehicle WHERE id = ?
+    """,
+}
+
+
+def fetch_dashboard_row(c, entity, entity_id):
+    c.execute(DASHBOARD_ROW_QUERIES[entity], (entity_id,))
+    return c.fetchone()
+
+
+def wants_fragment():
+    """Sayfadaki JS, formları fetch ile gönderirken bu başlığı ekler."""
+    return request.headers.get("X-Requested-With") == "fetch"
+
+
+def write_response(tab, message, category, row=None, row_macro=None, modal_macro=None):
+    """
+    Yazma route'larının ortak dönüşü. Sayfadan (fetch) çağrıldıysa mesaj,
+    _rows.html makrolarıyla çizilmiş satır parçası ve güncel özet JSON olarak
+    döner; aksi halde eskisi gibi flash + index'e yönlendirme (PRG) yapılır.
+    """
+    if not wants_fragment():
+        flash(message, category)
+        return redirect(url_for("servis.index", tab=tab))
+
+    ok = category != "danger"
+    payload = {"ok": ok, "message": message, "category": category}
+
+    if ok:
+        if row is not None and row_macro:
+            payload["html"] = get_template_attribute("_rows.html", row_macro)(row)
+        if row is not None and modal_macro:
+            payload["modal"] = get_template_attribute("_rows.html", modal_macro)(row)
+
+        conn = get_conn()
+        payload["summary"] = load_dashboard_summary(conn.cursor())
+        conn.close()
+
+    return jsonify(payload), (200 if ok else 400)
+
+
 # ----------------- LOGIN / LOGOUT -----------------
-@app.route("/login", methods=["GET", "POST"])
+@bp.route("/login", methods=["GET", "POST"])
 def login():
     if request.method == "POST":
         username = request.form.get("username", "").strip()
@@ -258,27 +1335,27 @@ def login():
         row = c.fetchone()
         conn.close()
 
-        if row and check_password_hash(row[2], password):
-            session["user_id"] = row[0]
-            session["username"] = row[1]
-            session["full_name"] = row[3]
-            session["role"] = row[4]
+        if row and check_password_hash(row.password_hash, password):
+            session["user_id"] = row.id
+            session["username"] = row.username
+            session["full_name"] = row.full_name
+            session["role"] = row.role
             flash("Giriş başarılı.", "success")
-            return redirect(url_for("index"))
+            return redirect(url_for("servis.index"))
         else:
             flash("Kullanıcı adı veya şifre hatalı.", "danger")
 
     return render_template("login.html")
 
 
-@app.route("/logout")
+@bp.route("/logout")
 def logout():
     session.clear()
     flash("Oturum kapatıldı.", "info")
-    return redirect(url_for("login"))
+    return redirect(url_for("servis.login"))
 
 
-@app.route("/change_password", methods=["GET", "POST"])
+@bp.route("/change_password", methods=["GET", "POST"])
 @login_required
 def change_password():
     if request.method == "POST":
@@ -288,11 +1365,11 @@ def change_password():
 
         if not current_password or not new_password or not new_password2:
             flash("Tüm alanlar zorunludur.", "danger")
-            return redirect(url_for("change_password"))
+            return redirect(url_for("servis.change_password"))
 
         if new_password != new_password2:
             flash("Yeni şifre ve tekrarı aynı olmalıdır.", "danger")
-            return redirect(url_for("change_password"))
+            return redirect(url_for("servis.change_password"))
 
         conn = get_conn()
         c = conn.cursor()
@@ -305,18 +1382,14 @@ def change_password():
         if not row:
             conn.close()
             flash("Kullanıcı bulunamadı.", "danger")
-            return redirect(url_for("logout"))
+            return redirect(url_for("servis.logout"))
 
-        if not check_password_hash(row[0], current_password):
+        if not check_password_hash(row.password_hash, current_password):
             conn.close()
             flash("Mevcut şifre hatalı.", "danger")
-            return redirect(url_for("change_password"))
+            return redirect(url_for("servis.change_password"))
 
-        new_hash = generate_password_hash(
-            new_password,
-            method="pbkdf2:sha256",
-            salt_length=16
-        )
+        new_hash = hash_password(new_password)
         c.execute(
             "UPDATE users SET password_hash=? WHERE id=?",
             (new_hash, session["user_id"])
@@ -325,13 +1398,67 @@ def change_password():
         conn.close()
 
         flash("Şifreniz başarıyla güncellendi.", "success")
-        return redirect(url_for("index"))
+        return redirect(url_for("servis.index"))
 
     return render_template("change_password.html")
 
 
+# ----------------- AİDAT HESABI -----------------
+def load_overdue_dues(c, today, after=None, limit=None):
+    """
+    dues_allocation üzerinden gecikmiş öğrencileri (adlandırılmış satırlar),
+    ödenmemiş ayları ve 0-30 / 31-60 / 61-90 / 90+ gün yaşlandırma kovalarıyla döner.
+    Aidat kuralı yalnızca refresh_dues_allocation()'dadır; burası hazır satırları okur.
+    after verilirse student_id > after olanlar id sırasıyla en fazla limit
+    kadar döner (API keyset sayfalama); verilmezse tümü ada göre sıralanır.
+    """
+    today_period = today.year * 12 + today.month
+    params = [today_period, today.isoformat()]
+    keyset, order = "", "ORDER BY s.name COLLATE turkish"
+    if after is not None:
+        keyset, order = "WHERE student_id > ?", "ORDER BY s.id LIMIT ?"
+        params.append(after)
+    c.execute(f"""
+        WITH a AS (
+            SELECT student_id, due_year, due_month, amount_due,
+                   amount_due - amount_paid AS unpaid,
+                   period <= ? AS is_due,
+                   CAST(julianday(?) - julianday(due_date) AS INTEGER) AS age
+            FROM dues_allocation
+            {keyset}
+        ),
+        agg AS (
+            SELECT student_id,
+                   SUM(amount_due) AS annual_total,
+                   SUM(CASE WHEN is_due THEN amount_due ELSE 0 END) AS expected_so_far,
+                   SUM(CASE WHEN is_due THEN unpaid ELSE 0 END) AS overdue_amount,
+                   SUM(unpaid) AS remaining_year,
+                   SUM(CASE WHEN is_due AND age <= 30 THEN unpaid ELSE 0 END) AS aging_0_30,
+                   SUM(CASE WHEN is_due AND age BETWEEN 31 AND 60 THEN unpaid ELSE 0 END) AS aging_31_60,
+                   SUM(CASE WHEN is_due AND age BETWEEN 61 AND 90 THEN unpaid ELSE 0 END) AS aging_61_90,
+                   SUM(CASE WHEN is_due AND age > 90 THEN unpaid ELSE 0 END) AS aging_90_plus,
+                   GROUP_CONCAT(CASE WHEN is_due AND unpaid > 0
+                                     THEN printf('%d/%02d', due_year, due_month) END, ', ')
+                       AS unpaid_months
+            FROM a
+            GROUP BY student_id
+            HAVING overdue_amount > 1
+        )
+        SELECT s.id AS student_id, s.name AS student_name, s.school, s.parent_name,
+               s.phone, s.monthly_fee, s.start_year, s.start_month,
+               {STUDENT_TOTAL_PAID_SQL} AS total_paid,
+               agg.annual_total, agg.expected_so_far, agg.overdue_amount, agg.remaining_year,
+               agg.aging_0_30, agg.aging_31_60, agg.aging_61_90, agg.aging_90_plus,
+               agg.unpaid_months
+        FROM agg
+        JOIN students s ON s.id = agg.student_id
+        {order}
+    """, params + ([limit] if after is not None else []))
+    return c.fetchall()
+
+
 # --- ANA SAYFA ---
-@app.route("/")
+@bp.route("/")
 @login_required
 def index():
     # Her gün ilk girişte yedek al
@@ -345,7 +1472,7 @@ def index():
         SELECT id, name, school, parent_name, phone, monthly_fee,
                start_year, start_month, is_active
         FROM students
-        ORDER BY name
+        ORDER BY name COLLATE turkish
     """)
     students_rows = c.fetchall()
 
@@ -359,11 +1486,11 @@ def index():
 
     # Okullar (distinct + sayım)
     c.execute("""
-        SELECT school, COUNT(*) as cnt
+        SELECT school, COUNT(*) AS cnt
         FROM students
         WHERE is_active = 1
-        GROUP BY school
-        ORDER BY school
+        GROUP BY school COLLATE turkish
+        ORDER BY school COLLATE turkish
     """)
     schools_stats = c.fetchall()
 
@@ -371,7 +1498,7 @@ def index():
     c.execute("""
         SELECT id, name, school, parent_name, phone, monthly_fee, is_active
         FROM students
-        ORDER BY school, name
+        ORDER BY school COLLATE turkish, name COLLATE turkish
     """)
     school_students = c.fetchall()
 
@@ -380,13 +1507,13 @@ def index():
         SELECT id, name
         FROM students
         WHERE is_active = 1
-        ORDER BY name
+        ORDER BY name COLLATE turkish
     """)
     students_for_select = c.fetchall()
 
     # Ödemeler (son 50)
     c.execute("""
-        SELECT p.id, s.name, p.pay_date, p.amount, p.description
+        SELECT p.id, s.name AS student_name, p.pay_date, p.amount, p.description
         FROM payments p
         JOIN students s ON s.id = p.student_id
         ORDER BY p.pay_date DESC, p.id DESC
@@ -394,18 +1521,10 @@ def index():
     """)
     payments_rows = c.fetchall()
 
-    # Tüm ödemelerden öğrenci bazlı toplam (aidat hesabı için)
-    c.execute("""
-        SELECT student_id, COALESCE(SUM(amount), 0)
-        FROM payments
-        GROUP BY student_id
-    """)
-    payment_totals_rows = c.fetchall()
-
     # Giderler (son 50)
     c.execute("""
         SELECT e.id, e.exp_date, e.category, e.amount, e.description,
-               v.plate, v.name
+               v.plate, v.name AS vehicle_name
         FROM expenses e
         LEFT JOIN vehicles v ON v.id = e.vehicle_id
         ORDER BY e.exp_date DESC, e.id DESC
@@ -413,75 +1532,17 @@ def index():
     """)
     expenses_rows = c.fetchall()
 
-    conn.close()
-
-    # Ödemelerden sözlük: {student_id: toplam_odeme}
-    payment_totals = {row[0]: row[1] for row in payment_totals_rows}
-
-    # >>> AİDAT GECİKME LİSTESİ HESABI <<<
-    today = date.today()
-    current_year = today.year
-    current_month = today.month
-
-    overdue_dues = []
-
-    for s in students_rows:
-        sid = s[0]
-        name = s[1]
-        school = s[2]
-        parent_name = s[3]
-        phone = s[4]
-        monthly_fee = s[5] or 0
-        start_year = s[6]
-        start_month = s[7]
-        is_active = s[8]
-
-        if is_active != 1:
-            continue
-        if monthly_fee <= 0:
-            continue
-        if not start_year or not start_month:
-            continue
+    # Aidat gecikme listesi
+    overdue_dues = load_overdue_dues(c, date.today())
 
-        # Kaç ay geçmiş? (maks 9 ay - okul dönemi)
-        start_index = start_year * 12 + start_month
-        today_index = current_year * 12 + current_month
-        months_passed = today_index - start_index + 1
-        if months_passed < 0:
-            months_passed = 0
-        if months_passed > 9:
-            months_passed = 9
-
-        # Yıllık toplam ve bugüne kadar ödenmesi gereken
-        annual_total = monthly_fee * 9
-        expected_so_far = monthly_fee * months_passed
-
-        total_paid = payment_totals.get(sid, 0.0)
-        overdue_amount = max(expected_so_far - total_paid, 0.0)
-        remaining_year = max(annual_total - total_paid, 0.0)
-
-        if overdue_amount > 1:
-            overdue_dues.append({
-                "student_id": sid,
-                "student_name": name,
-                "school": school,
-                "parent_name": parent_name,
-                "phone": phone,
-                "monthly_fee": monthly_fee,
-                "start_year": start_year,
-                "start_month": start_month,
-                "total_paid": total_paid,
-                "annual_total": annual_total,
-                "expected_so_far": expected_so_far,
-                "overdue_amount": overdue_amount,
-                "remaining_year": remaining_year,
-            })
+    sms_campaigns = load_sms_campaigns(c)
+    conn.close()
 
     # ÜST KARTLAR İÇİN ÖZET
-    total_income = sum(p[3] for p in payments_rows) if payments_rows else 0.0
-    total_expense = sum(e[3] for e in expenses_rows) if expenses_rows else 0.0
+    total_income = sum(p.amount for p in payments_rows)
+    total_expense = sum(e.amount for e in expenses_rows)
 
-    active_student_count = len([s for s in students_rows if s[8] == 1])
+    active_student_count = sum(1 for s in students_rows if s.is_active == 1)
 
     summary = {
         "student_count": active_student_count,
@@ -503,11 +1564,13 @@ def index():
         expenses=expenses_rows,
         summary=summary,
         overdue_dues=overdue_dues,
+        sms_campaigns=sms_campaigns,
+        default_reminder_template=DEFAULT_REMINDER_TEMPLATE,
         active_tab=active_tab
     )
 
 # ----------------- ÖĞRENCİ İŞLEMLERİ -----------------
-@app.route("/add_student", methods=["POST"])
+@bp.route("/add_student", methods=["POST"])
 @login_required
 def add_student():
     name = request.form.get("name", "").strip()
@@ -520,8 +1583,7 @@ def add_student():
     start_month = request.form.get("start_month", "").strip()
 
     if not name or (not monthly_fee and not annual_fee):
-        flash("Öğrenci adı ve (aylık veya yıllık) ücret zorunludur.", "danger")
-        return redirect(url_for("index", tab="students"))
+        return write_response("students", "Öğrenci adı ve (aylık veya yıllık) ücret zorunludur.", "danger")
 
     monthly_fee_val = None
     annual_fee_val = None
@@ -531,20 +1593,17 @@ def add_student():
         try:
             annual_fee_val = float(annual_fee.replace(",", "."))
         except ValueError:
-            flash("Yıllık ücret sayısal olmalıdır.", "danger")
-            return redirect(url_for("index", tab="students"))
+            return write_response("students", "Yıllık ücret sayısal olmalıdır.", "danger")
 
     # Aylık ücret varsa
     if monthly_fee:
         try:
             monthly_fee_val = float(monthly_fee.replace(",", "."))
         except ValueError:
-            flash("Aylık ücret sayısal olmalıdır.", "danger")
-            return redirect(url_for("index", tab="students"))
+            return write_response("students", "Aylık ücret sayısal olmalıdır.", "danger")
 
     if annual_fee_val is None and monthly_fee_val is None:
-        flash("En az aylık veya yıllık ücretten birini giriniz.", "danger")
-        return redirect(url_for("index", tab="students"))
+        return write_response("students", "En az aylık veya yıllık ücretten birini giriniz.", "danger")
 
     if annual_fee_val is not None and monthly_fee_val is None:
         monthly_fee_val = annual_fee_val / 9.0  # 9 aylık eğitim yılı
@@ -561,17 +1620,21 @@ def add_student():
     conn = get_conn()
     c = conn.cursor()
     c.execute("""
-    INSERT INTO students (name, school, parent_name, phone, monthly_fee, start_year, start_month, is_active)
-    VALUES (?, ?, ?, ?, ?, ?, ?, 1)
+        INSERT INTO students (name, school, parent_name, phone, monthly_fee,
+                              start_year, start_month, is_active)
+        VALUES (?, ?, ?, ?, ?, ?, ?, 1)
     """, (name, school, parent_name, phone, monthly_fee_val, sy, sm))
+    student_id = c.lastrowid
+    refresh_dues_allocation(conn, [student_id])
     conn.commit()
+    row = fetch_dashboard_row(c, "students", student_id) if wants_fragment() else None
     conn.close()
 
-    flash("Öğrenci eklendi.", "success")
-    return redirect(url_for("index", tab="students"))
+    return write_response("students", "Öğrenci eklendi.", "success",
+                          row, "student_row", "student_modal")
 
 
-@app.route("/update_student/<int:student_id>", methods=["POST"])
+@bp.route("/update_student/<int:student_id>", methods=["POST"])
 @login_required
 def update_student(student_id):
     name = request.form.get("name", "").strip()
@@ -585,8 +1648,7 @@ def update_student(student_id):
     is_active = request.form.get("is_active", "1")
 
     if not name or (not monthly_fee and not annual_fee):
-        flash("Öğrenci adı ve (aylık veya yıllık) ücret zorunludur.", "danger")
-        return redirect(url_for("index", tab="students"))
+        return write_response("students", "Öğrenci adı ve (aylık veya yıllık) ücret zorunludur.", "danger")
 
     monthly_fee_val = None
     annual_fee_val = None
@@ -595,19 +1657,16 @@ def update_student(student_id):
         try:
             annual_fee_val = float(annual_fee.replace(",", "."))
         except ValueError:
-            flash("Yıllık ücret sayısal olmalıdır.", "danger")
-            return redirect(url_for("index", tab="students"))
+            return write_response("students", "Yıllık ücret sayısal olmalıdır.", "danger")
 
     if monthly_fee:
         try:
             monthly_fee_val = float(monthly_fee.replace(",", "."))
         except ValueError:
-            flash("Aylık ücret sayısal olmalıdır.", "danger")
-            return redirect(url_for("index", tab="students"))
+            return write_response("students", "Aylık ücret sayısal olmalıdır.", "danger")
 
     if annual_fee_val is None and monthly_fee_val is None:
-        flash("En az aylık veya yıllık ücretten birini giriniz.", "danger")
-        return redirect(url_for("index", tab="students"))
+        return write_response("students", "En az aylık veya yıllık ücretten birini giriniz.", "danger")
 
     if annual_fee_val is not None and monthly_fee_val is None:
         monthly_fee_val = annual_fee_val / 9.0
@@ -626,122 +1685,416 @@ def update_student(student_id):
     conn = get_conn()
     c = conn.cursor()
     c.execute("""
-    UPDATE students
-    SET name=?, school=?, parent_name=?, phone=?, monthly_fee=?,
-        start_year=?, start_month=?, is_active=?
-    WHERE id=?
-    """, (name, school, parent_name, phone, monthly_fee_val, sy, sm, is_active_val, student_id))
+        UPDATE students
+        SET name=?, school=?, parent_name=?, phone=?, monthly_fee=?,
+            start_year=?, start_month=?, is_active=?
+        WHERE id=?
+    """, (name, school, parent_name, phone, monthly_fee_val,
+          sy, sm, is_active_val, student_id))
+    refresh_dues_allocation(conn, [student_id])
     conn.commit()
+    row = fetch_dashboard_row(c, "students", student_id) if wants_fragment() else None
     conn.close()
 
-    flash("Öğrenci güncellendi.", "success")
-    return redirect(url_for("index", tab="students"))
+    return write_response("students", "Öğrenci güncellendi.", "success",
+                          row, "student_row", "student_modal")
 
 
-@app.route("/delete_student/<int:student_id>", methods=["POST"])
+@bp.route("/delete_student/<int:student_id>", methods=["POST"])
 @login_required
 def delete_student(student_id):
     conn = get_conn()
     c = conn.cursor()
     c.execute("UPDATE students SET is_active=0 WHERE id=?", (student_id,))
+    refresh_dues_allocation(conn, [student_id])
     conn.commit()
+    row = fetch_dashboard_row(c, "students", student_id) if wants_fragment() else None
     conn.close()
 
-    flash("Öğrenci pasife alındı.", "info")
-    return redirect(url_for("index", tab="students"))
+    return write_response("students", "Öğrenci pasife alındı.", "info",
+                          row, "student_row", "student_modal")
+
+
+# ----------------- RAPOR MOTORU -----------------
+# Bir rapor bir kez sözlük olarak tanımlanır, CSV / PDF / HTML'e aynı yapıdan çizilir:
+#   {
+#     "title": "...", "filename": "dosya_adi",
+#     "info": [("Plaka", "06 ABC 123"), ...],          # başlık altı bilgi satırları
+#     "sections": [{
+#         "title": "Ödemeler",
+#         "columns": [("Öğrenci", "text", 3), ("Tutar (TL)", "money", 1), ...],
+#         "rows": [...],                                   # sütun sırasıyla tuple'lar
+#                                                          # (liste ya da cursor; tek kez okunur)
+#         "count": 42,                                     # cursor ise satır sayısı (rapor işi ilerlemesi)
+#         "empty": "Kayıt yok.",                           # opsiyonel
+#     }],
+#     "totals": [("Toplam Gelir", 123.0, "money"), ...],
+#   }
+# Sütun tipi: text | money | int | date; üçüncü eleman PDF/XLSX'teki göreli sütun genişliğidir.
+REPORT_SPOOL_BYTES = 1024 * 1024  # bundan büyük PDF/XLSX çıktıları diske taşar
+REPORT_PDF_CHUNK_ROWS = 200  # uzun bölümler bu kadar satırlık tablolara bölünür
+
+XLSX_MIMETYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+REPORT_FORMATS = {
+    "excel": ("xlsx", XLSX_MIMETYPE) if xlsxwriter else ("csv", "text/csv"),
+    "csv": ("csv", "text/csv"),
+    "pdf": ("pdf", "application/pdf"),
+    "html": ("html", "text/html"),
+}
+
+
+def format_report_value(value, kind):
+    if kind == "money":
+        return f"{(value or 0):.2f}"
+    if value is None:
+        return ""
+    return str(value)
+
+
+def render_report_csv(report):
+    """Excel'in Türkçe ayarlarıyla açılan ';' ayraçlı, BOM'lu CSV (bytes)."""
+    output = io.StringIO()
+    writer = csv.writer(output, delimiter=';')
+
+    writer.writerow([report["title"]])
+    writer.writerow([])
+    if report.get("info"):
+        for label, value in report["info"]:
+            writer.writerow([label, format_report_value(value, "text")])
+        writer.writerow([])
 
+    for section in report.get("sections", []):
+        if section.get("title"):
+            writer.writerow([section["title"]])
+        columns = section["columns"]
+        writer.writerow([col[0] for col in columns])
+        for row in section["rows"]:
+            writer.writerow([format_report_value(v, col[1]) for v, col in zip(row, columns)])
+        writer.writerow([])
 
-# ----------------- ÖDEME İŞLEMLERİ -----------------
-@app.route("/add_payment", methods=["POST"])
-@login_required
-def add_payment():
-    student_id = request.form.get("student_id")
-    amount_str = request.form.get("amount", "").strip()
-    pay_date = request.form.get("pay_date", "").strip()
-    description = request.form.get("description", "").strip()
+    for label, value, kind in report.get("totals", []):
+        suffix = " TL" if kind == "money" else ""
+        writer.writerow([label, format_report_value(value, kind) + suffix])
 
-    if not student_id or not amount_str or not pay_date:
-        flash("Öğrenci, tutar ve tarih zorunlu alanlardır.", "danger")
-        return redirect(url_for("index", tab="payments"))
+    return output.getvalue().encode("utf-8-sig")
 
-    try:
-        amount = float(amount_str.replace(",", "."))
-    except ValueError:
-        flash("Tutar sayısal olmalıdır.", "danger")
-        return redirect(url_for("index", tab="payments"))
 
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("""
-    INSERT INTO payments (student_id, pay_date, amount, description)
-    VALUES (?, ?, ?, ?)
-    """, (student_id, pay_date, amount, description))
-    conn.commit()
-    conn.close()
+class LazyStory(list):
+    """
+    reportlab'ın build() döngüsüne verilen akış listesi; elemanları bir
+    üreteçten, baştakiler çizilip silindikçe birkaç adım önden çeker. Böylece
+    bellekte tüm rapor değil, yalnızca sıradaki birkaç LongTable parçası durur.
+    """
 
-    # Ödeme sonrası veliye SMS (mock)
+    AHEAD = 3
+
+    def __init__(self, flowables):
+        super().__init__()
+        self._source = iter(flowables)
+        self._fill()
+
+    def _fill(self):
+        while super().__len__() < self.AHEAD:
+            flowable = next(self._source, None)
+            if flowable is None:
+                self._source = iter(())
+                return
+            self.append(flowable)
+
+    def __delitem__(self, index):
+        super().__delitem__(index)
+        self._fill()
+
+
+def render_report_pdf(reports):
+    """
+    Bir veya birden çok raporu (her biri yeni sayfadan) tablo düzeninde PDF'e
+    çizer. Hücreler kesilmez, sütun genişliğine göre satır kaydırılır; tablo
+    sayfaya sığmazsa başlık satırı tekrarlanarak bölünür. Akış LazyStory ile
+    parça parça üretilir; çizilen parçalar hemen bırakılır. Çıktı, büyükse diske
+    taşan SpooledTemporaryFile olarak (başa sarılmış) döner.
+    """
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import ParagraphStyle
+    from reportlab.lib.enums import TA_RIGHT
+    from reportlab.platypus import (
+        SimpleDocTemplate, Paragraph, Spacer, LongTable, TableStyle, PageBreak
+    )
+    from xml.sax.saxutils import escape
+
+    register_pdf_fonts()
+
+    if isinstance(reports, dict):
+        reports = [reports]
+
+    title_style = ParagraphStyle("title", fontName="DejaVu-Bold", fontSize=14, leading=18,
+                                 spaceAfter=10)
+    section_style = ParagraphStyle("section", fontName="DejaVu-Bold", fontSize=11, leading=14,
+                                   spaceBefore=10, spaceAfter=6)
+    info_style = ParagraphStyle("info", fontName="DejaVu", fontSize=10, leading=13)
+    cell_style = ParagraphStyle("cell", fontName="DejaVu", fontSize=8.5, leading=10.5)
+    money_style = ParagraphStyle("money", parent=cell_style, alignment=TA_RIGHT)
+    head_style = ParagraphStyle("head", parent=cell_style, fontName="DejaVu-Bold")
+    total_style = ParagraphStyle("total", fontName="DejaVu-Bold", fontSize=10, leading=13)
+
+    out = tempfile.SpooledTemporaryFile(max_size=REPORT_SPOOL_BYTES)
+    doc = SimpleDocTemplate(out, pagesize=A4, leftMargin=40, rightMargin=40,
+                            topMargin=40, bottomMargin=40)
+    table_style = TableStyle([
+        ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#eef1f7")),
+        ("LINEBELOW", (0, 0), (-1, -1), 0.25, colors.HexColor("#c8cfdc")),
+        ("VALIGN", (0, 0), (-1, -1), "TOP"),
+        ("LEFTPADDING", (0, 0), (-1, -1), 3),
+        ("RIGHTPADDING", (0, 0), (-1, -1), 3),
+    ])
+
+    def cell(value, kind):
+        text = escape(format_report_value(value, kind))
+        return Paragraph(text, money_style if kind == "money" else cell_style)
+
+    def story():
+        for i, report in enumerate(reports):
+            if i:
+                yield PageBreak()
+            yield Paragraph(escape(report["title"]), title_style)
+            for label, value in report.get("info", []):
+                yield Paragraph(
+                    f"<b>{escape(label)}:</b> {escape(format_report_value(value, 'text'))}", info_style
+                )
+
+            for section in report.get("sections", []):
+                columns = section["columns"]
+                if section.get("title"):
+                    yield Paragraph(escape(section["title"]), section_style)
+
+                weights = [col[2] if len(col) > 2 else 1 for col in columns]
+                col_widths = [doc.width * w / sum(weights) for w in weights]
+                header = [Paragraph(escape(col[0]), head_style) for col in columns]
+
+                chunk = []
+                for row in section["rows"]:
+                    chunk.append([cell(v, col[1]) for v, col in zip(row, columns)])
+                    if len(chunk) == REPORT_PDF_CHUNK_ROWS:
+                        yield LongTable([header] + chunk, colWidths=col_widths,
+                                        repeatRows=1, style=table_style)
+                        chunk = []
+                if chunk:
+                    yield LongTable([header] + chunk, colWidths=col_widths,
+                                    repeatRows=1, style=table_style)
+                elif section.get("empty"):
+                    yield Paragraph(escape(section["empty"]), cell_style)
+
+            if report.get("totals"):
+                yield Spacer(1, 12)
+            for label, value, kind in report.get("totals", []):
+                suffix = " TL" if kind == "money" else ""
+                yield Paragraph(
+                    escape(f"{label}: {format_report_value(value, kind)}{suffix}"), total_style
+                )
+
+    doc.build(LazyStory(story()))
+    out.seek(0)
+    return out
+
+
+def render_report_xlsx(report):
+    """
+    Raporu gerçek .xlsx olarak yazar: tutarlar sayı ("#,##0.00"), tarihler tarih
+    hücresi, başlıklar kalın; toplamlar formül değil hesaplanmış değerdir.
+    constant_memory modunda her satır okunduğu anda geçici dosyaya akıtılır;
+    cursor verilen bölümlerde bellekte yalnızca o anki satır bulunur.
+    """
+    out = tempfile.SpooledTemporaryFile(max_size=REPORT_SPOOL_BYTES)
+    wb = xlsxwriter.Workbook(out, {"constant_memory": True})
+    ws = wb.add_worksheet("Rapor")
+
+    title_fmt = wb.add_format({"bold": True, "font_size": 14})
+    bold_fmt = wb.add_format({"bold": True})
+    head_fmt = wb.add_format({"bold": True, "bg_color": "#EEF1F7", "bottom": 1})
+    cell_fmts = {
+        "money": wb.add_format({"num_format": "#,##0.00"}),
+        "int": wb.add_format({"num_format": "0"}),
+        "date": wb.add_format({"num_format": "dd.mm.yyyy", "align": "left"}),
+    }
+    total_fmts = {
+        "money": wb.add_format({"bold": True, "num_format": "#,##0.00"}),
+        "int": wb.add_format({"bold": True, "num_format": "0"}),
+    }
+
+    # constant_memory'de satırlar geri dönülemez; genişlikler baştan verilir
+    widths = {}
+    for section in report.get("sections", []):
+        for i, col in enumerate(section["columns"]):
+            weight = col[2] if len(col) > 2 else 1
+            widths[i] = max(widths.get(i, 12), weight * 6)
+    for i, width in widths.items():
+        ws.set_column(i, i, width)
+
+    def write_cell(r, ci, value, kind, fmts):
+        if kind == "money":
+            ws.write_number(r, ci, value or 0, fmts["money"])
+        elif value is None:
+            return
+        elif kind == "int" and isinstance(value, (int, float)):
+            ws.write_number(r, ci, value, fmts["int"])
+        elif kind == "date":
+            try:
+                ws.write_datetime(r, ci, date.fromisoformat(str(value)[:10]), cell_fmts["date"])
+            except ValueError:
+                ws.write_string(r, ci, str(value))
+        else:
+            ws.write_string(r, ci, str(value))
+
+    r = 0
+    ws.write_string(r, 0, report["title"], title_fmt)
+    r += 2
+    if report.get("info"):
+        for label, value in report["info"]:
+            ws.write_string(r, 0, label, bold_fmt)
+            write_cell(r, 1, value, "text", cell_fmts)
+            r += 1
+        r += 1
+
+    for section in report.get("sections", []):
+        columns = section["columns"]
+        if section.get("title"):
+            ws.write_string(r, 0, section["title"], bold_fmt)
+            r += 1
+        for ci, col in enumerate(columns):
+            ws.write_string(r, ci, col[0], head_fmt)
+        r += 1
+
+        first_row = r
+        for row in section["rows"]:
+            for ci, (value, col) in enumerate(zip(row, columns)):
+                write_cell(r, ci, value, col[1], cell_fmts)
+            r += 1
+        if r == first_row and section.get("empty"):
+            ws.write_string(r, 0, section["empty"])
+            r += 1
+        r += 1
+
+    for label, value, kind in report.get("totals", []):
+        ws.write_string(r, 0, label, bold_fmt)
+        write_cell(r, 1, value, kind, total_fmts)
+        r += 1
+
+    wb.close()
+    out.seek(0)
+    return out
+
+
+def render_report_html(report):
+    return render_template("report.html", report=report, format_value=format_report_value)
+
+
+def render_report_file(report, ext):
+    """Raporu XLSX / CSV / PDF dosyası olarak çizer; başa sarılmış dosya nesnesi döner."""
+    if ext == "csv":
+        return io.BytesIO(render_report_csv(report))
+    if ext == "xlsx":
+        return render_report_xlsx(report)
+    return render_report_pdf(report)
+
+
+def send_report(report, report_format):
+    """Raporu istenen formatta indirme (XLSX/CSV/PDF) veya sayfa (HTML) olarak döner."""
+    ext, mimetype = REPORT_FORMATS[report_format]
+    if ext == "html":
+        return render_report_html(report)
+
+    return send_file(
+        render_report_file(report, ext),
+        as_attachment=True,
+        download_name=f"{report['filename']}.{ext}",
+        mimetype=mimetype,
+    )
+
+
+# ----------------- ÖDEME İŞLEMLERİ -----------------
+@bp.route("/add_payment", methods=["POST"])
+@login_required
+def add_payment():
+    student_id = request.form.get("student_id")
+    amount_str = request.form.get("amount", "").strip()
+    pay_date = request.form.get("pay_date", "").strip()
+    description = request.form.get("description", "").strip()
+
+    if not student_id or not amount_str or not pay_date:
+        return write_response("payments", "Öğrenci, tutar ve tarih zorunlu alanlardır.", "danger")
+
+    try:
+        amount = float(amount_str.replace(",", "."))
+    except ValueError:
+        return write_response("payments", "Tutar sayısal olmalıdır.", "danger")
+
+    conn = get_conn()
+    c = conn.cursor()
+    c.execute("""
+        INSERT INTO payments (student_id, pay_date, amount, description)
+        VALUES (?, ?, ?, ?)
+    """, (student_id, pay_date, amount, description))
+    payment_id = c.lastrowid
+    refresh_dues_allocation(conn, [student_id])
+    conn.commit()
+    row = fetch_dashboard_row(c, "payments", payment_id) if wants_fragment() else None
+    conn.close()
+
+    # Ödeme sonrası veliye SMS (mock)
     try:
         send_sms_to_parent(int(student_id), amount, pay_date, description)
     except Exception as e:
         print(f"[SMS HATASI] {e}")
 
-    flash("Ödeme eklendi.", "success")
-    return redirect(url_for("index", tab="payments"))
+    return write_response("payments", "Ödeme eklendi.", "success", row, "payment_row")
 
 
-@app.route("/payments_by_date", methods=["POST"])
+@bp.route("/payments_by_date", methods=["POST"])
 @login_required
 def payments_by_date():
     filter_date = request.form.get("filter_date", "").strip()
 
     if not filter_date:
         flash("Lütfen tarih seçiniz.", "danger")
-        return redirect(url_for("index", tab="payments"))
+        return redirect(url_for("servis.index", tab="payments"))
 
     conn = get_conn()
     c = conn.cursor()
     c.execute("""
-    SELECT p.id, s.name, p.pay_date, p.amount, p.description
-    FROM payments p
-    JOIN students s ON s.id = p.student_id
-    WHERE p.pay_date=?
-    ORDER BY s.name
+        SELECT p.id, s.name AS student_name, p.pay_date, p.amount, p.description
+        FROM payments p
+        JOIN students s ON s.id = p.student_id
+        WHERE p.pay_date=?
+        ORDER BY s.name COLLATE turkish
     """, (filter_date,))
     rows = c.fetchall()
-
     conn.close()
 
-    total_amount = sum(r[3] for r in rows) if rows else 0.0
+    total_amount = sum(r.amount for r in rows)
 
     flash(f"{filter_date} tarihinde {len(rows)} ödeme var. Toplam: {total_amount:.2f} TL", "info")
-    return redirect(url_for("index", tab="payments"))
+    return redirect(url_for("servis.index", tab="payments"))
 
 
-@app.route("/daily_report", methods=["POST"])
-@login_required
-def daily_report():
-    report_date = request.form.get("report_date", "").strip()
-    report_format = request.form.get("report_format", "excel")
-
-    if not report_date:
-        flash("Rapor tarihi seçiniz.", "danger")
-        return redirect(url_for("index", tab="payments"))
-
-    conn = get_conn()
-    c = conn.cursor()
-
+def build_daily_report(conn, report_date):
+    """
+    Günlük rapor. Satırlar cursor olarak bırakılır, çizici okudukça akar;
+    bu yüzden bağlantı rapor çizilene kadar açık tutulmalıdır. Toplamlar ve
+    satır sayıları satırlardan değil ayrı COUNT/SUM sorgularından gelir.
+    """
     # Ödemeler
-    c.execute("""
+    pay_rows = conn.execute("""
     SELECT s.name, s.school, p.amount, p.description
     FROM payments p
     JOIN students s ON s.id = p.student_id
     WHERE p.pay_date=?
-    ORDER BY s.name
+    ORDER BY s.name COLLATE turkish
     """, (report_date,))
-    pay_rows = c.fetchall()
 
     # Giderler
-    c.execute("""
+    exp_rows = conn.execute("""
     SELECT e.exp_date, e.category, e.amount, e.description,
            v.plate, v.name
     FROM expenses e
@@ -749,127 +2102,79 @@ def daily_report():
     WHERE e.exp_date=?
     ORDER BY e.id
     """, (report_date,))
-    exp_rows = c.fetchall()
-
-    conn.close()
-
-    total_income = sum(r[2] for r in pay_rows) if pay_rows else 0.0
-    total_expense = sum(r[2] for r in exp_rows) if exp_rows else 0.0
-    profit = total_income - total_expense
 
-    if report_format == "excel":
-        output = io.StringIO()
-        writer = csv.writer(output, delimiter=';')
-
-        writer.writerow([f"Günlük Rapor - {report_date}"])
-        writer.writerow([])
+    pay_count, total_income = conn.execute(
+        "SELECT COUNT(*), COALESCE(SUM(amount), 0) FROM payments WHERE pay_date=?", (report_date,)
+    ).fetchone()
+    exp_count, total_expense = conn.execute(
+        "SELECT COUNT(*), COALESCE(SUM(amount), 0) FROM expenses WHERE exp_date=?", (report_date,)
+    ).fetchone()
+
+    return {
+        "title": f"Günlük Rapor - {report_date}",
+        "filename": f"gunluk_rapor_{report_date}",
+        "sections": [
+            {
+                "title": "ÖDEMELER",
+                "columns": [("Öğrenci", "text", 3), ("Okul", "text", 3),
+                            ("Tutar (TL)", "money", 1.5), ("Açıklama", "text", 4)],
+                "rows": pay_rows,
+                "count": pay_count,
+                "empty": "Bu tarihte ödeme yok.",
+            },
+            {
+                "title": "GİDERLER",
+                "columns": [("Tarih", "date", 2), ("Kategori", "text", 2),
+                            ("Tutar (TL)", "money", 1.5), ("Açıklama", "text", 3),
+                            ("Araç Plaka", "text", 1.5), ("Araç Adı", "text", 2)],
+                "rows": exp_rows,
+                "count": exp_count,
+                "empty": "Bu tarihte gider yok.",
+            },
+        ],
+        "totals": [
+            ("Toplam Gelir", total_income, "money"),
+            ("Toplam Gider", total_expense, "money"),
+            ("Kâr/Zarar", total_income - total_expense, "money"),
+        ],
+    }
 
-        writer.writerow(["ÖDEMELER"])
-        writer.writerow(["Öğrenci", "Okul", "Tutar (TL)", "Açıklama"])
-        for r in pay_rows:
-            writer.writerow([r[0], r[1] or "", f"{r[2]:.2f}", r[3] or ""])
 
-        writer.writerow([])
-        writer.writerow(["GİDERLER"])
-        writer.writerow(["Tarih", "Kategori", "Tutar (TL)", "Açıklama", "Araç Plaka", "Araç Adı"])
-        for e in exp_rows:
-            writer.writerow([
-                e[0],
-                e[1] or "",
-                f"{e[2]:.2f}",
-                e[3] or "",
-                e[4] or "",
-                e[5] or "",
-            ])
+@bp.route("/daily_report", methods=["POST"])
+@login_required
+def daily_report():
+    report_date = request.form.get("report_date", "").strip()
+    report_format = request.form.get("report_format", "excel")
 
-        writer.writerow([])
-        writer.writerow(["GENEL ÖZET"])
-        writer.writerow(["Toplam Gelir", f"{total_income:.2f} TL"])
-        writer.writerow(["Toplam Gider", f"{total_expense:.2f} TL"])
-        writer.writerow(["Kâr/Zarar", f"{profit:.2f} TL"])
+    if not report_date:
+        flash("Rapor tarihi seçiniz.", "danger")
+        return redirect(url_for("servis.index", tab="payments"))
 
-        data = io.BytesIO(output.getvalue().encode("utf-8-sig"))
-        filename = f"gunluk_rapor_{report_date}.csv"
+    if report_format not in REPORT_FORMATS:
+        report_format = "pdf"
 
-        return send_file(
-            data,
-            as_attachment=True,
-            download_name=filename,
-            mimetype="text/csv",
-        )
+    if report_format == "pdf" and pdfmetrics is None:
+        flash("PDF oluşturmak için 'reportlab' kütüphanesini kurmalısınız.", "danger")
+        return redirect(url_for("servis.index", tab="payments"))
 
-    else:
+    if report_format == "html":
+        conn = get_conn()
         try:
-            from reportlab.pdfgen import canvas
-            from reportlab.lib.pagesizes import A4
-        except ImportError:
-            flash("PDF oluşturmak için 'reportlab' kütüphanesini kurmalısınız.", "danger")
-            return redirect(url_for("index", tab="payments"))
-
-        # Türkçe karakter için fontları kaydet
-        register_pdf_fonts()
+            return send_report(build_daily_report(conn, report_date), report_format)
+        finally:
+            conn.close()
 
-        buffer = io.BytesIO()
-        cpdf = canvas.Canvas(buffer, pagesize=A4)
-        width, height = A4
-
-        y = height - 40
-        cpdf.setFont("DejaVu-Bold", 14)
-        cpdf.drawString(40, y, f"Günlük Rapor - {report_date}")
-        y -= 25
-
-        cpdf.setFont("DejaVu-Bold", 11)
-        cpdf.drawString(40, y, "Ödemeler")
-        y -= 18
-        cpdf.setFont("DejaVu", 9)
-
-        for r in pay_rows:
-            line = f"{r[0]} | {r[1] or ''} | {r[2]:.2f} TL | {r[3] or ''}"
-            cpdf.drawString(40, y, line[:110])
-            y -= 12
-            if y < 60:
-                cpdf.showPage()
-                y = height - 40
-                cpdf.setFont("DejaVu", 9)
-
-        y -= 16
-        cpdf.setFont("DejaVu-Bold", 11)
-        cpdf.drawString(40, y, "Giderler")
-        y -= 18
-        cpdf.setFont("DejaVu", 9)
-
-        for e in exp_rows:
-            line = f"{e[0]} | {e[1] or ''} | {e[2]:.2f} TL | {e[3] or ''} | {e[4] or ''} | {e[5] or ''}"
-            cpdf.drawString(40, y, line[:120])
-            y -= 12
-            if y < 60:
-                cpdf.showPage()
-                y = height - 40
-                cpdf.setFont("DejaVu", 9)
-
-        y -= 16
-        cpdf.setFont("DejaVu-Bold", 10)
-        cpdf.drawString(40, y, f"Toplam Gelir   : {total_income:.2f} TL")
-        y -= 12
-        cpdf.drawString(40, y, f"Toplam Gider   : {total_expense:.2f} TL")
-        y -= 12
-        cpdf.drawString(40, y, f"Kâr / Zarar    : {profit:.2f} TL")
-
-        cpdf.showPage()
-        cpdf.save()
-        buffer.seek(0)
-
-        filename = f"gunluk_rapor_{report_date}.pdf"
-        return send_file(
-            buffer,
-            as_attachment=True,
-            download_name=filename,
-            mimetype="application/pdf",
-        )
+    job_id = enqueue_report_job(
+        "daily_report",
+        {"report_date": report_date, "report_format": report_format},
+        f"Günlük Rapor {report_date} ({REPORT_FORMATS[report_format][0].upper()})",
+        session.get("username"),
+    )
+    return queued_report_response(job_id)
 
 
 # ----------------- ARAÇ / HAT İŞLEMLERİ -----------------
-@app.route("/add_vehicle", methods=["POST"])
+@bp.route("/add_vehicle", methods=["POST"])
 @login_required
 def add_vehicle():
     plate = request.form.get("plate", "").strip()
@@ -878,8 +2183,7 @@ def add_vehicle():
     route = request.form.get("route", "").strip()
 
     if not plate:
-        flash("Araç plakası zorunludur.", "danger")
-        return redirect(url_for("index", tab="vehicles"))
+        return write_response("vehicles", "Araç plakası zorunludur.", "danger")
 
     try:
         capacity_val = int(capacity) if capacity else None
@@ -889,21 +2193,22 @@ def add_vehicle():
     conn = get_conn()
     c = conn.cursor()
     c.execute("""
-    INSERT INTO vehicles (plate, name, capacity, route, is_active)
-    VALUES (?, ?, ?, ?, 1)
+        INSERT INTO vehicles (plate, name, capacity, route, is_active)
+        VALUES (?, ?, ?, ?, 1)
     """, (plate, driver_name, capacity_val, route))
+    vehicle_id = c.lastrowid
     conn.commit()
+    row = fetch_dashboard_row(c, "vehicles", vehicle_id) if wants_fragment() else None
     conn.close()
 
-    flash("Araç eklendi.", "success")
-    return redirect(url_for("index", tab="vehicles"))
+    return write_response("vehicles", "Araç eklendi.", "success", row, "vehicle_row")
 
 
-@app.route("/update_vehicle/<int:vehicle_id>", methods=["POST", "GET"])
+@bp.route("/update_vehicle/<int:vehicle_id>", methods=["POST", "GET"])
 @login_required
 def update_vehicle(vehicle_id):
     if request.method == "GET":
-        return redirect(url_for("index", tab="vehicles"))
+        return redirect(url_for("servis.index", tab="vehicles"))
 
     plate = request.form.get("plate", "").strip()
     driver_name = request.form.get("driver_name", "").strip()
@@ -912,8 +2217,7 @@ def update_vehicle(vehicle_id):
     is_active = request.form.get("is_active", "1")
 
     if not plate:
-        flash("Araç plakası zorunludur.", "danger")
-        return redirect(url_for("index", tab="vehicles"))
+        return write_response("vehicles", "Araç plakası zorunludur.", "danger")
 
     try:
         capacity_val = int(capacity) if capacity else None
@@ -925,171 +2229,376 @@ def update_vehicle(vehicle_id):
     conn = get_conn()
     c = conn.cursor()
     c.execute("""
-    UPDATE vehicles
-    SET plate=?, name=?, capacity=?, route=?, is_active=?
-    WHERE id=?
+        UPDATE vehicles
+        SET plate=?, name=?, capacity=?, route=?, is_active=?
+        WHERE id=?
     """, (plate, driver_name, capacity_val, route, is_active_val, vehicle_id))
     conn.commit()
+    row = fetch_dashboard_row(c, "vehicles", vehicle_id) if wants_fragment() else None
     conn.close()
 
-    flash("Araç güncellendi.", "success")
-    return redirect(url_for("index", tab="vehicles"))
+    return write_response("vehicles", "Araç güncellendi.", "success", row, "vehicle_row")
 
 
-@app.route("/assign_vehicle", methods=["POST"])
+@bp.route("/assign_vehicle", methods=["POST"])
 @login_required
 def assign_vehicle():
     student_id = request.form.get("student_id_assign")
     vehicle_id = request.form.get("vehicle_id_assign")
 
     if not student_id or not vehicle_id:
-        flash("Öğrenci ve araç seçmelisiniz.", "danger")
-        return redirect(url_for("index", tab="vehicles"))
+        return write_response("vehicles", "Öğrenci ve araç seçmelisiniz.", "danger")
+
+    today_str = date.today().isoformat()
 
     conn = get_conn()
     c = conn.cursor()
 
-    today = date.today().isoformat()
-
+    # Öğrencinin açık atamasını kapat, yenisini aç
     c.execute("""
-    UPDATE student_vehicle
-    SET end_date=?
-    WHERE student_id=? AND (end_date IS NULL OR end_date='')
-    """, (today, student_id))
-
+        UPDATE student_vehicle
+        SET end_date=?
+        WHERE student_id=? AND end_date IS NULL
+    """, (today_str, student_id))
     c.execute("""
-    INSERT INTO student_vehicle (student_id, vehicle_id, start_date)
-    VALUES (?, ?, ?)
-    """, (student_id, vehicle_id, today))
+        INSERT INTO student_vehicle (student_id, vehicle_id, start_date)
+        VALUES (?, ?, ?)
+    """, (student_id, vehicle_id, today_str))
 
     conn.commit()
     conn.close()
 
-    flash("Öğrenci araca atandı.", "success")
-    return redirect(url_for("index", tab="vehicles"))
+    return write_response("vehicles", "Öğrenci araca atandı.", "success")
 
 
-@app.route("/vehicle_report/<int:vehicle_id>/<string:report_format>")
-@login_required
-def vehicle_report(vehicle_id, report_format):
+# ----------------- OTOMATİK ARAÇ ATAMA -----------------
+NO_SCHOOL = "(Okul Yok)"
+
+
+def load_assignment_inputs(c):
+    """
+    Otomatik atama girdileri: aracı olmayan aktif öğrenciler, aktif araçların
+    kapasite ve mevcut doluluğu, araçların şu an taşıdığı okul dağılımı.
+    Kapasitesi girilmemiş araçların capacity'si NULL döner; planlayıcı onları ayırır.
+    """
+    open_assignment = "sv.end_date IS NULL"
+    students = c.execute(f"""
+        SELECT s.id, s.name, COALESCE(NULLIF(s.school, ''), ?) AS school
+        FROM students s
+        WHERE s.is_active = 1
+          AND NOT EXISTS (SELECT 1 FROM student_vehicle sv
+                          WHERE sv.student_id = s.id AND {open_assignment})
+        ORDER BY school COLLATE turkish, s.name COLLATE turkish
+    """, (NO_SCHOOL,)).fetchall()
+
+    vehicles = c.execute(f"""
+        SELECT v.id, v.plate, v.name, v.route, v.capacity,
+               COUNT(s.id) AS load
+        FROM vehicles v
+        LEFT JOIN student_vehicle sv ON sv.vehicle_id = v.id AND {open_assignment}
+        LEFT JOIN students s ON s.id = sv.student_id AND s.is_active = 1
+        WHERE v.is_active = 1
+        GROUP BY v.id
+        ORDER BY v.plate
+    """).fetchall()
+
+    vehicle_schools = c.execute(f"""
+        SELECT sv.vehicle_id, COALESCE(NULLIF(s.school, ''), ?) AS school, COUNT(*) AS cnt
+        FROM student_vehicle sv
+        JOIN students s ON s.id = sv.student_id AND s.is_active = 1
+        WHERE {open_assignment}
+        GROUP BY sv.vehicle_id, school
+    """, (NO_SCHOOL,)).fetchall()
+
+    return students, vehicles, vehicle_schools
+
+
+def plan_vehicle_assignment(students, vehicles, vehicle_schools=()):
+    """
+    Açıkta kalan öğrencileri okul grupları halinde araçlara yerleştirir
+    (büyük gruptan küçüğe, First Fit Decreasing). Kapasite hiçbir araçta
+    aşılmaz; koltuk kalmazsa öğrenci 'unplaced' listesinde kalır.
+
+    Araç tercihi: okulu zaten taşıyan araç, güzergahında okul adı geçen araç,
+    dolu/bu planda açılmış araç (yeni araç açmamak için). Grup tek araca
+    sığıyorsa en az koltuk artıran araç seçilir (best fit); sığmıyorsa en
+    çok boş koltuğu olandan başlanarak grup en az parçaya bölünür.
+
+    Kapasitesi girilmemiş (NULL / 0) araçlara öğrenci önerilmez; önizlemede
+    uyarı olarak 'no_capacity' listesinde gösterilirler.
+    """
+    no_capacity = [v for v in vehicles if not v.capacity or v.capacity <= 0]
+    vehicles = [v for v in vehicles if v.capacity and v.capacity > 0]
+    free = {v.id: max(v.capacity - v.load, 0) for v in vehicles}
+    used = {v.id for v in vehicles if v.load}
+    routes = {v.id: (v.route or "").casefold() for v in vehicles}
+    affinity = {(r.vehicle_id, r.school): r.cnt for r in vehicle_schools}
+
+    groups = {}
+    for st in students:
+        groups.setdefault(st.school, []).append(st)
+
+    pairs = []
+    unplaced = []
+    for school, members in sorted(groups.items(), key=lambda g: (-len(g[1]), g[0])):
+        school_key = school.casefold()
+
+        def preference(vid):
+            on_route = school != NO_SCHOOL and school_key in routes[vid]
+            return (-affinity.get((vid, school), 0), not on_route, vid not in used)
+
+        candidates = [vid for vid, seats in free.items() if seats > 0]
+        whole = [vid for vid in candidates if free[vid] >= len(members)]
+        if whole:
+            order = [min(whole, key=lambda vid: preference(vid) + (free[vid],))]
+        else:
+            order = sorted(candidates, key=lambda vid: preference(vid) + (-free[vid],))
+
+        placed = 0
+        for vid in order:
+            if placed == len(members):
+                break
+            chunk = members[placed:placed + free[vid]]
+            pairs.extend((st, vid) for st in chunk)
+            free[vid] -= len(chunk)
+            used.add(vid)
+            affinity[(vid, school)] = affinity.get((vid, school), 0) + len(chunk)
+            placed += len(chunk)
+        unplaced.extend(members[placed:])
+
+    added = {}
+    school_vehicles = {}
+    for st, vid in pairs:
+        added.setdefault(vid, []).append(st)
+        school_vehicles.setdefault(st.school, set()).add(vid)
+    summary = [
+        {
+            "vehicle": v,
+            "added": added[v.id],
+            "schools": sorted({st.school for st in added[v.id]}, key=turkish_sort_key),
+            "load_after": v.load + len(added[v.id]),
+        }
+        for v in vehicles if v.id in added
+    ]
+    return {
+        "pairs": pairs,
+        "unplaced": unplaced,
+        "no_capacity": no_capacity,
+        "vehicles": summary,
+        "vehicles_used": len(used),
+        "split_schools": sum(1 for vids in school_vehicles.values() if len(vids) > 1),
+    }
+
+
+def apply_vehicle_assignment(pairs):
+    """
+    Önizlenen (öğrenci_id, araç_id) çiftlerini tek transaction'da
+    student_vehicle'a yazar. Önizlemeden sonra başka yoldan atanan öğrenciler
+    ve bu arada dolan koltuklar atlanır. (eklenen, atlanan) döner.
+    """
+    today = date.today().isoformat()
     conn = get_conn()
     c = conn.cursor()
+    try:
+        c.execute("BEGIN IMMEDIATE")
+        students, vehicles, _ = load_assignment_inputs(c)
+        open_ids = {st.id for st in students}
+        free = {v.id: max((v.capacity or 0) - v.load, 0) for v in vehicles}
+
+        rows = []
+        for student_id, vehicle_id in pairs:
+            if student_id in open_ids and free.get(vehicle_id, 0) > 0:
+                open_ids.discard(student_id)
+                free[vehicle_id] -= 1
+                rows.append((student_id, vehicle_id, today))
+
+        c.executemany("""
+            INSERT INTO student_vehicle (student_id, vehicle_id, start_date)
+            VALUES (?, ?, ?)
+        """, rows)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    return len(rows), len(pairs) - len(rows)
+
+
+@bp.route("/auto_assign", methods=["GET", "POST"])
+@login_required
+def auto_assign():
+    """GET: atama önerisini gösterir; POST: önizlenen öneriyi uygular."""
+    if request.method == "POST":
+        pairs = []
+        for value in request.form.getlist("pair"):
+            try:
+                student_id, vehicle_id = (int(x) for x in value.split(":"))
+            except ValueError:
+                continue
+            pairs.append((student_id, vehicle_id))
+
+        if not pairs:
+            flash("Uygulanacak atama yok.", "info")
+            return redirect(url_for("servis.index", tab="vehicles"))
+
+        applied, skipped = apply_vehicle_assignment(pairs)
+        message = f"{applied} öğrenci araçlara atandı."
+        if skipped:
+            message += f" {skipped} öneri önizlemeden sonra değişen kayıtlar nedeniyle atlandı."
+        flash(message, "success" if applied else "warning")
+        return redirect(url_for("servis.index", tab="vehicles"))
+
+    conn = get_conn()
+    plan = plan_vehicle_assignment(*load_assignment_inputs(conn.cursor()))
+    conn.close()
 
+    return render_template("auto_assign.html", plan=plan)
+
+
+def build_vehicle_roster_report(vh, students_rows):
+    total_fee = sum((r.monthly_fee or 0) for r in students_rows)
+    return {
+        "title": f"Araç Öğrenci Listesi - {vh.plate}",
+        "filename": f"arac_{vh.plate}_ogrenci_listesi",
+        "info": [("Plaka", vh.plate), ("Şoför", vh.name), ("Kapasite", vh.capacity),
+                 ("Güzergah", vh.route)],
+        "sections": [{
+            "title": "Öğrenci Listesi",
+            "columns": [("Öğrenci", "text", 3), ("Okul", "text", 3), ("Veli", "text", 3),
+                        ("Telefon", "text", 2), ("Aylık Ücret (TL)", "money", 1.5)],
+            "rows": students_rows,
+            "empty": "Bu araca atanmış öğrenci yok.",
+        }],
+        "totals": [
+            ("Toplam Öğrenci", len(students_rows), "int"),
+            ("Toplam Aylık Ücret", total_fee, "money"),
+        ],
+    }
+
+
+def vehicle_roster_csv(vh, students_rows):
+    """Tek aracın öğrenci listesini CSV (Excel uyumlu, BOM'lu) byte olarak döner."""
+    return render_report_csv(build_vehicle_roster_report(vh, students_rows))
+
+
+def vehicle_roster_xlsx(vh, students_rows):
+    """Tek aracın öğrenci listesini .xlsx byte olarak döner."""
+    with render_report_xlsx(build_vehicle_roster_report(vh, students_rows)) as xlsx:
+        return xlsx.read()
+
+
+def render_vehicle_roster_pdf(vh, students_rows):
+    """Tek aracın öğrenci listesini ayrı bir PDF dosyası olarak (bytes) üretir."""
+    with render_report_pdf(build_vehicle_roster_report(vh, students_rows)) as pdf:
+        return pdf.read()
+
+
+# ----------------- ARAÇ LİSTESİ ÖNBELLEĞİ -----------------
+# Araç başına liste satırları ve üretilmiş CSV/PDF dosyaları, aracın
+# vehicle_roster_version sürümüyle birlikte saklanır. Sürümü atama, öğrenci
+# ve araç yazmalarında tetikleyiciler artırır; sürüm değişmedikçe sabah
+# indirmeleri sorgu ve PDF üretimi yapmadan önbellekten karşılanır.
+ROSTER_CACHE_SIZE = 512
+
+_roster_cache_lock = threading.Lock()
+
+
+def roster_version(c, vehicle_id):
+    c.execute("SELECT version FROM vehicle_roster_version WHERE vehicle_id=?", (vehicle_id,))
+    row = c.fetchone()
+    return row[0] if row else 0
+
+
+def cached_roster(key, version, build):
+    """key için önbellekteki değer aynı sürümdense onu, değilse build() sonucunu döner."""
+    roster_cache = app_state()["roster_cache"]
+    with _roster_cache_lock:
+        hit = roster_cache.get(key)
+        if hit is not None and hit[0] == version:
+            roster_cache.move_to_end(key)
+            return hit[1]
+
+    value = build()
+
+    with _roster_cache_lock:
+        roster_cache[key] = (version, value)
+        roster_cache.move_to_end(key)
+        while len(roster_cache) > ROSTER_CACHE_SIZE:
+            roster_cache.popitem(last=False)
+    return value
+
+
+def load_vehicle_roster(c, vehicle_id):
+    """(vh, students_rows) döner; araç yoksa None."""
     c.execute(
         "SELECT id, plate, name, capacity, route FROM vehicles WHERE id=?",
         (vehicle_id,),
     )
     vh = c.fetchone()
     if not vh:
-        conn.close()
-        flash("Araç bulunamadı.", "danger")
-        return redirect(url_for("index", tab="vehicles"))
+        return None
 
     c.execute("""
     SELECT s.name, s.school, s.parent_name, s.phone, s.monthly_fee
     FROM student_vehicle sv
     JOIN students s ON s.id = sv.student_id
     WHERE sv.vehicle_id = ?
-      AND (sv.end_date IS NULL OR sv.end_date = '')
+      AND sv.end_date IS NULL
       AND s.is_active = 1
-    ORDER BY s.name
+    ORDER BY s.name COLLATE turkish
     """, (vehicle_id,))
-    students_rows = c.fetchall()
-    conn.close()
+    return vh, c.fetchall()
 
-    total_fee = sum((r[4] or 0) for r in students_rows)
 
-    if report_format.lower() == "excel":
-        output = io.StringIO()
-        writer = csv.writer(output, delimiter=';')
+@bp.route("/vehicle_report/<int:vehicle_id>/<string:report_format>")
+@login_required
+def vehicle_report(vehicle_id, report_format):
+    conn = get_conn()
+    c = conn.cursor()
+    # Sürüm satırlardan ÖNCE okunur: arada yazma olursa bir sonraki istek yeniden üretir
+    version = roster_version(c, vehicle_id)
+    roster = cached_roster(("rows", vehicle_id), version,
+                           lambda: load_vehicle_roster(c, vehicle_id))
+    conn.close()
 
-        writer.writerow([f"Araç Öğrenci Listesi - {vh[1]}"])
-        writer.writerow([])
-        writer.writerow(["Plaka", vh[1]])
-        writer.writerow(["Şoför", vh[2] or ""])
-        writer.writerow(["Kapasite", vh[3] or ""])
-        writer.writerow(["Güzergah", vh[4] or ""])
-        writer.writerow([])
-        writer.writerow(["Öğrenci", "Okul", "Veli", "Telefon", "Aylık Ücret (TL)"])
+    if roster is None:
+        flash("Araç bulunamadı.", "danger")
+        return redirect(url_for("servis.index", tab="vehicles"))
 
-        for r in students_rows:
-            writer.writerow([
-                r[0],
-                r[1] or "",
-                r[2] or "",
-                r[3] or "",
-                "%.2f" % (r[4] or 0),
-            ])
+    vh, students_rows = roster
+    report_format = report_format.lower()
 
-        writer.writerow([])
-        writer.writerow(["Toplam Öğrenci", len(students_rows)])
-        writer.writerow(["Toplam Aylık Ücret", "%.2f TL" % total_fee])
+    if report_format == "html":
+        return render_report_html(build_vehicle_roster_report(vh, students_rows))
 
-        data = io.BytesIO(output.getvalue().encode("utf-8-sig"))
-        filename = f"arac_{vh[1]}_ogrenci_listesi.csv"
+    if report_format in ("excel", "csv"):
+        ext, mimetype = REPORT_FORMATS[report_format]
+        render = vehicle_roster_xlsx if ext == "xlsx" else vehicle_roster_csv
+        data = io.BytesIO(cached_roster((ext, vehicle_id), version,
+                                        lambda: render(vh, students_rows)))
+        filename = f"arac_{vh.plate}_ogrenci_listesi.{ext}"
 
         return send_file(
             data,
             as_attachment=True,
             download_name=filename,
-            mimetype="text/csv",
+            mimetype=mimetype,
         )
 
     else:
-        try:
-            from reportlab.pdfgen import canvas
-            from reportlab.lib.pagesizes import A4
-        except ImportError:
+        if pdfmetrics is None:
             flash("PDF için 'reportlab' kütüphanesini kurmalısınız: pip install reportlab", "danger")
-            return redirect(url_for("index", tab="vehicles"))
+            return redirect(url_for("servis.index", tab="vehicles"))
 
         # Türkçe karakter için fontları kaydet
         register_pdf_fonts()
 
-        buffer = io.BytesIO()
-        cpdf = canvas.Canvas(buffer, pagesize=A4)
-        width, height = A4
-
-        y = height - 40
-        cpdf.setFont("DejaVu-Bold", 14)
-        cpdf.drawString(40, y, f"Araç Öğrenci Listesi - {vh[1]}")
-        y -= 25
-
-        cpdf.setFont("DejaVu", 10)
-        cpdf.drawString(40, y, f"Plaka   : {vh[1]}")
-        y -= 14
-        cpdf.drawString(40, y, f"Şoför   : {vh[2] or ''}")
-        y -= 14
-        cpdf.drawString(40, y, f"Kapasite: {vh[3] or ''}")
-        y -= 14
-        cpdf.drawString(40, y, f"Güzergah: {vh[4] or ''}")
-        y -= 24
-
-        cpdf.setFont("DejaVu-Bold", 11)
-        cpdf.drawString(40, y, "Öğrenci Listesi")
-        y -= 18
-        cpdf.setFont("DejaVu", 9)
-
-        for r in students_rows:
-            line = f"{r[0]} | {r[1] or ''} | {r[2] or ''} | {r[3] or ''} | { (r[4] or 0):.2f} TL"
-            cpdf.drawString(40, y, line[:110])
-            y -= 14
-            if y < 60:
-                cpdf.showPage()
-                y = height - 40
-                cpdf.setFont("DejaVu", 9)
-
-        y -= 16
-        cpdf.setFont("DejaVu-Bold", 10)
-        cpdf.drawString(40, y, f"Toplam Öğrenci : {len(students_rows)}")
-        y -= 14
-        cpdf.drawString(40, y, f"Toplam Aylık Ücret : {total_fee:.2f} TL")
-
-        cpdf.showPage()
-        cpdf.save()
-        buffer.seek(0)
-
-        filename = f"arac_{vh[1]}_ogrenci_listesi.pdf"
+        buffer = io.BytesIO(cached_roster(("pdf", vehicle_id), version,
+                                          lambda: render_vehicle_roster_pdf(vh, students_rows)))
+
+        filename = f"arac_{vh.plate}_ogrenci_listesi.pdf"
         return send_file(
             buffer,
             as_attachment=True,
@@ -1098,8 +2607,280 @@ def vehicle_report(vehicle_id, report_format):
         )
 
 
+def load_fleet_rosters():
+    """
+    Tüm aktif araçları ve güncel öğrenci listelerini TEK sorguyla yükler.
+    [(vh, students_rows, version), ...] döner; vh ve satırlar vehicle_report ile
+    aynı yapıdadır, version araç listesi önbelleği içindir.
+    """
+    conn = get_read_conn()
+    c = conn.cursor()
+    c.execute("""
+    SELECT v.id, v.plate, v.name, v.capacity, v.route,
+           s.name AS student_name, s.school, s.parent_name, s.phone, s.monthly_fee,
+           COALESCE(rv.version, 0) AS version
+    FROM vehicles v
+    LEFT JOIN vehicle_roster_version rv ON rv.vehicle_id = v.id
+    LEFT JOIN student_vehicle sv
+           ON sv.vehicle_id = v.id
+          AND sv.end_date IS NULL
+    LEFT JOIN students s
+           ON s.id = sv.student_id
+          AND s.is_active = 1
+    WHERE v.is_active = 1
+    ORDER BY v.plate, v.id, s.name COLLATE turkish
+    """)
+    rows = c.fetchall()
+    conn.close()
+
+    # load_vehicle_roster ile aynı satır tipleri (aynı sütun adları -> aynı tip)
+    vehicle_type = row_type(("id", "plate", "name", "capacity", "route"))
+    student_type = row_type(("name", "school", "parent_name", "phone", "monthly_fee"))
+
+    rosters = []
+    for _, group in groupby(rows, key=lambda r: r.id):
+        group = list(group)
+        vh = vehicle_type._make(group[0][:5])
+        students_rows = [student_type._make(r[5:10]) for r in group
+                         if r.student_name is not None]
+        rosters.append((vh, students_rows, group[0].version))
+    return rosters
+
+
+class _ZipStream(io.RawIOBase):
+    """zipfile'ın yazdığı baytları biriktirir; parça parça istemciye akıtmak için."""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def pop(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+@bp.route("/fleet_report/<string:report_format>")
+@login_required
+def fleet_report(report_format):
+    """
+    Tüm aktif araçların sabah listeleri tek seferde (arka plan işi olarak):
+      - pdf : her araç ayrı bölüm olacak şekilde tek PDF
+      - zip : her araç için PDF + CSV içeren ZIP
+    """
+    report_format = report_format.lower()
+    if report_format not in ("pdf", "zip"):
+        flash("Geçersiz rapor formatı.", "danger")
+        return redirect(url_for("servis.index", tab="vehicles"))
+
+    if pdfmetrics is None:
+        flash("PDF için 'reportlab' kütüphanesini kurmalısınız: pip install reportlab", "danger")
+        return redirect(url_for("servis.index", tab="vehicles"))
+
+    job_id = enqueue_report_job(
+        "fleet_report",
+        {"report_format": report_format},
+        f"Tüm Araçlar Öğrenci Listesi ({report_format.upper()})",
+        session.get("username"),
+    )
+    return queued_report_response(job_id)
+
+
+# ----------------- ATAMA GEÇMİŞİ -----------------
+# student_vehicle aralıkları yarı açıktır: start_date dahil, end_date hariç,
+# açık atamada end_date NULL. Araç değiştirilen gün yeni araca sayılır; bu
+# yüzden bir gün için her öğrenci en fazla bir araçta görünür. Sorgular
+# arşivlenmiş sezonları da kapsar (get_history_conn).
+OPEN_ASSIGNMENT_LABEL = "Devam ediyor"
+
+
+def assignment_period(day, month):
+    """
+    ?date=YYYY-MM-DD ya da ?month=YYYY-MM'den (ilk_gün, son_gün, etiket) üretir;
+    ikisi de yoksa bugün, geçersizse None.
+    """
+    if month:
+        if not YEAR_MONTH_RE.match(month):
+            return None
+        year, mon = (int(x) for x in month.split("-"))
+        last = calendar.monthrange(year, mon)[1]
+        return f"{month}-01", f"{month}-{last:02d}", month
+
+    try:
+        day = date.fromisoformat(day).isoformat() if day else date.today().isoformat()
+    except ValueError:
+        return None
+    return day, day, day
+
+
+def load_roster_history(conn, first_day, last_day, vehicle_id=None):
+    """
+    [first_day, last_day] aralığının herhangi bir gününde araçta olan
+    öğrenciler, atama başlangıç / bitişleriyle. Aracı verilirse yalnızca o
+    araç; sorgu idx_student_vehicle_interval üzerinden araç + başlangıç
+    aralığında ilerler, geçmiş bir tarih bugünkü kadar hızlıdır.
+    """
+    vehicle_filter = "AND sv.vehicle_id = ?" if vehicle_id else ""
+    params = [last_day, first_day] + ([vehicle_id] if vehicle_id else [])
+    return conn.execute(f"""
+        SELECT v.plate, s.name AS student_name, s.school, s.parent_name, s.phone,
+               sv.start_date, COALESCE(sv.end_date, ?) AS end_date
+        FROM all_student_vehicle sv
+        JOIN vehicles v ON v.id = sv.vehicle_id
+        JOIN students s ON s.id = sv.student_id
+        WHERE sv.start_date <= ?
+          AND (sv.end_date IS NULL OR sv.end_date > ?)
+          {vehicle_filter}
+        ORDER BY v.plate, s.name COLLATE turkish, sv.start_date
+    """, [OPEN_ASSIGNMENT_LABEL] + params).fetchall()
+
+
+def build_roster_history_report(rows, label, vh=None):
+    title = f"Araç Listesi ({label})" + (f" - {vh.plate}" if vh else "")
+    return {
+        "title": title,
+        "filename": f"arac_listesi_{label}" + (f"_{vh.plate}" if vh else ""),
+        "info": [("Dönem", label)] + ([("Plaka", vh.plate), ("Şoför", vh.name)] if vh else []),
+        "sections": [{
+            "title": "Araçtaki Öğrenciler",
+            "columns": [("Plaka", "text", 1.5), ("Öğrenci", "text", 3), ("Okul", "text", 3),
+                        ("Veli", "text", 3), ("Telefon", "text", 2),
+                        ("Biniş", "date", 1.5), ("Ayrılış", "date", 1.5)],
+            "rows": rows,
+            "empty": "Bu dönemde araçta öğrenci yok.",
+        }],
+        "totals": [("Toplam Atama", len(rows), "int")],
+    }
+
+
+def load_student_timeline(conn, student_id):
+    """Öğrencinin tüm araç atamaları (arşiv dahil), eskiden yeniye, gün sayısıyla."""
+    today = date.today().isoformat()
+    return conn.execute("""
+        SELECT v.plate, v.name AS vehicle_name, sv.start_date,
+               COALESCE(sv.end_date, ?) AS end_date,
+               CAST(julianday(COALESCE(sv.end_date, ?)) - julianday(sv.start_date) AS INTEGER)
+                   AS days
+        FROM all_student_vehicle sv
+        JOIN vehicles v ON v.id = sv.vehicle_id
+        WHERE sv.student_id = ?
+        ORDER BY sv.start_date, sv.id
+    """, (OPEN_ASSIGNMENT_LABEL, today, student_id)).fetchall()
+
+
+def build_student_timeline_report(st, rows):
+    return {
+        "title": f"Araç Geçmişi - {st.name}",
+        "filename": f"arac_gecmisi_{st.id}_{st.name}",
+        "info": [("Öğrenci", st.name), ("Okul", st.school), ("Veli", st.parent_name)],
+        "sections": [{
+            "title": "Atamalar",
+            "columns": [("Plaka", "text", 1.5), ("Araç", "text", 2), ("Biniş", "date", 1.5),
+                        ("Ayrılış", "date", 1.5), ("Gün", "int", 1)],
+            "rows": rows,
+            "empty": "Bu öğrencinin araç ataması yok.",
+        }],
+        "totals": [("Toplam Atama", len(rows), "int")],
+    }
+
+
+@bp.route("/roster_history")
+@login_required
+def roster_history():
+    """Seçilen gün ya da ayda araç(lar)da kimlerin olduğu; itirazlarda kullanılır."""
+    period = assignment_period(request.args.get("date", "").strip(),
+                               request.args.get("month", "").strip())
+    report_format = request.args.get("report_format", "html")
+    vehicle_id = request.args.get("vehicle_id", type=int)
+
+    if period is None:
+        flash("Geçerli bir tarih ya da ay seçiniz.", "danger")
+        return redirect(url_for("servis.index", tab="vehicles"))
+
+    if report_format not in REPORT_FORMATS:
+        report_format = "html"
+
+    if report_format == "pdf" and pdfmetrics is None:
+        flash("PDF oluşturmak için 'reportlab' kütüphanesini kurmalısınız.", "danger")
+        return redirect(url_for("servis.index", tab="vehicles"))
+
+    first_day, last_day, label = period
+    if report_format != "html":
+        if vehicle_id:
+            conn = get_conn()
+            found = conn.execute("SELECT 1 FROM vehicles WHERE id=?", (vehicle_id,)).fetchone()
+            conn.close()
+            if not found:
+                flash("Araç bulunamadı.", "danger")
+                return redirect(url_for("servis.index", tab="vehicles"))
+
+        job_id = enqueue_report_job(
+            "roster_history",
+            {"first_day": first_day, "last_day": last_day, "label": label,
+             "vehicle_id": vehicle_id, "report_format": report_format},
+            f"Araç Listesi {label} ({REPORT_FORMATS[report_format][0].upper()})",
+            session.get("username"),
+        )
+        return queued_report_response(job_id)
+
+    conn = get_history_conn()
+    try:
+        vh = None
+        if vehicle_id:
+            vh = conn.execute("SELECT id, plate, name FROM vehicles WHERE id=?",
+                              (vehicle_id,)).fetchone()
+            if not vh:
+                flash("Araç bulunamadı.", "danger")
+                return redirect(url_for("servis.index", tab="vehicles"))
+        rows = load_roster_history(conn, first_day, last_day, vehicle_id)
+    finally:
+        conn.close()
+
+    return send_report(build_roster_history_report(rows, label, vh), report_format)
+
+
+@bp.route("/student_timeline/<int:student_id>")
+@login_required
+def student_timeline(student_id):
+    report_format = request.args.get("report_format", "html")
+    if report_format not in REPORT_FORMATS:
+        report_format = "html"
+
+    if report_format == "pdf" and pdfmetrics is None:
+        flash("PDF oluşturmak için 'reportlab' kütüphanesini kurmalısınız.", "danger")
+        return redirect(url_for("servis.index", tab="students"))
+
+    conn = get_history_conn()
+    try:
+        st = conn.execute("SELECT id, name, school, parent_name FROM students WHERE id=?",
+                          (student_id,)).fetchone()
+        if not st:
+            flash("Öğrenci bulunamadı.", "danger")
+            return redirect(url_for("servis.index", tab="students"))
+        if report_format == "html":
+            rows = load_student_timeline(conn, student_id)
+            return send_report(build_student_timeline_report(st, rows), report_format)
+    finally:
+        conn.close()
+
+    job_id = enqueue_report_job(
+        "student_timeline",
+        {"student_id": student_id, "report_format": report_format},
+        f"Araç Geçmişi - {st.name} ({REPORT_FORMATS[report_format][0].upper()})",
+        session.get("username"),
+    )
+    return queued_report_response(job_id)
+
+
 # ----------------- GİDER İŞLEMLERİ -----------------
-@app.route("/add_expense", methods=["POST"])
+@bp.route("/add_expense", methods=["POST"])
 @login_required
 def add_expense():
     vehicle_id = request.form.get("vehicle_id_exp", "")
@@ -1109,31 +2890,30 @@ def add_expense():
     description = request.form.get("description_exp", "").strip()
 
     if not exp_date or not category or not amount_str:
-        flash("Tarih, kategori ve tutar zorunlu alanlardır.", "danger")
-        return redirect(url_for("index", tab="expenses"))
+        return write_response("expenses", "Tarih, kategori ve tutar zorunlu alanlardır.", "danger")
 
     try:
         amount = float(amount_str.replace(",", "."))
     except ValueError:
-        flash("Tutar sayısal olmalıdır.", "danger")
-        return redirect(url_for("index", tab="expenses"))
+        return write_response("expenses", "Tutar sayısal olmalıdır.", "danger")
 
     vehicle_id_val = int(vehicle_id) if vehicle_id else None
 
     conn = get_conn()
     c = conn.cursor()
     c.execute("""
-    INSERT INTO expenses (vehicle_id, exp_date, category, amount, description)
-    VALUES (?, ?, ?, ?, ?)
+        INSERT INTO expenses (vehicle_id, exp_date, category, amount, description)
+        VALUES (?, ?, ?, ?, ?)
     """, (vehicle_id_val, exp_date, category, amount, description))
+    expense_id = c.lastrowid
     conn.commit()
+    row = fetch_dashboard_row(c, "expenses", expense_id) if wants_fragment() else None
     conn.close()
 
-    flash("Gider eklendi.", "success")
-    return redirect(url_for("index", tab="expenses"))
+    return write_response("expenses", "Gider eklendi.", "success", row, "expense_row")
 
 
-@app.route("/profit", methods=["POST"])
+@bp.route("/profit", methods=["POST"])
 @login_required
 def profit():
     start = request.form.get("start_date_profit", "")
@@ -1141,21 +2921,22 @@ def profit():
 
     if not start or not end:
         flash("Başlangıç ve bitiş tarihlerini giriniz.", "danger")
-        return redirect(url_for("index", tab="expenses"))
+        return redirect(url_for("servis.index", tab="expenses"))
 
-    conn = get_conn()
+    # Dönem kapanmış sezonlara uzanabileceği için arşivler de dahil edilir
+    conn = get_history_conn()
     c = conn.cursor()
 
     c.execute("""
     SELECT COALESCE(SUM(amount), 0)
-    FROM payments
+    FROM all_payments
     WHERE pay_date BETWEEN ? AND ?
     """, (start, end))
     income = c.fetchone()[0] or 0.0
 
     c.execute("""
     SELECT COALESCE(SUM(amount), 0)
-    FROM expenses
+    FROM all_expenses
     WHERE exp_date BETWEEN ? AND ?
     """, (start, end))
     expense = c.fetchone()[0] or 0.0
@@ -1168,12 +2949,1818 @@ def profit():
         f"Gider: {expense:.2f} TL | Kâr/Zarar: {profit_val:.2f} TL",
         "info",
     )
-    return redirect(url_for("index", tab="expenses"))
+    return redirect(url_for("servis.index", tab="expenses"))
 
 
-# ----------------- MAIN -----------------
-if __name__ == "__main__":
-    # Lokal çalıştırırken de tablo + fontları garanti et
-    register_pdf_fonts()
-    create_tables()
-    app.run(debug=True)
\ No newline at end of file
+# ----------------- GİDER ANALİZİ -----------------
+EXPENSE_PIVOT_MAX_MONTHS = 24
+
+YEAR_MONTH_RE = re.compile(r"^\d{4}-(0[1-9]|1[0-2])$")
+
+
+def month_keys(start_ym, end_ym):
+    """'YYYY-MM' aralığındaki ay anahtarlarını sırayla döner."""
+    year, month = int(start_ym[:4]), int(start_ym[5:])
+    keys = []
+    while f"{year:04d}-{month:02d}" <= end_ym:
+        keys.append(f"{year:04d}-{month:02d}")
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return keys
+
+
+def build_expense_pivot_report(conn, start_ym, end_ym):
+    """
+    Araç x kategori x ay gider pivotu ve araç bazında öğrenci-ay, tahakkuk,
+    tahsilat, gider, marj ve öğrenci-ay başına maliyet. Tüm toplamalar
+    exp_ym / pay_ym indeksleri üzerinden SQL'de gruplanır; Python'a yalnızca
+    pivot ve araç özet satırları gelir. Arşivlenmiş sezonlar dahildir.
+    """
+    months = month_keys(start_ym, end_ym)
+    month_sums = ",\n           ".join(
+        "SUM(CASE WHEN e.exp_ym = ? THEN e.amount END)" for _ in months
+    )
+
+    pivot_rows = conn.execute(f"""
+    SELECT COALESCE(v.plate, 'Genel Gider'), e.category,
+           {month_sums},
+           SUM(e.amount)
+    FROM all_expenses e
+    LEFT JOIN vehicles v ON v.id = e.vehicle_id
+    WHERE e.exp_ym BETWEEN ? AND ?
+    GROUP BY e.vehicle_id, e.category
+    ORDER BY e.vehicle_id IS NULL, v.plate, e.category
+    """, months + [start_ym, end_ym])
+
+    pivot_count = conn.execute("""
+    SELECT COUNT(*) FROM (
+        SELECT 1 FROM all_expenses
+        WHERE exp_ym BETWEEN ? AND ?
+        GROUP BY vehicle_id, category
+    )
+    """, (start_ym, end_ym)).fetchone()[0]
+
+    # Bir atama, ayın herhangi bir gününe değiyorsa o ay o aracın öğrencisidir
+    # (aralık yarı açık: araç değiştirilen gün yeni araca sayılır). Öğrenci-ay
+    # ve tahakkuk yalnızca aktif öğrencinin dues_allocation'daki 9 aidat ayında
+    # sayılır: pasife alınanlar ve yaz ayları marjı şişirmez.
+    vehicle_rows = conn.execute("""
+    WITH RECURSIVE months(ym, period, first_day, last_day) AS (
+        SELECT ?, CAST(substr(?, 1, 4) AS INTEGER) * 12 + CAST(substr(?, 6, 2) AS INTEGER),
+               ? || '-01', date(? || '-01', '+1 month', '-1 day')
+        UNION ALL
+        SELECT strftime('%Y-%m', first_day, '+1 month'),
+               period + 1,
+               date(first_day, '+1 month'),
+               date(first_day, '+2 month', '-1 day')
+        FROM months
+        WHERE ym < ?
+    ),
+    riders AS (
+        SELECT sv.vehicle_id, COUNT(*) AS rider_months, SUM(da.amount_due) AS fees
+        FROM months m
+        JOIN all_student_vehicle sv
+          ON sv.start_date <= m.last_day
+         AND (sv.end_date IS NULL OR sv.end_date > m.first_day)
+        JOIN students s ON s.id = sv.student_id AND s.is_active = 1
+        JOIN dues_allocation da ON da.student_id = sv.student_id AND da.period = m.period
+        GROUP BY sv.vehicle_id
+    ),
+    collected AS (
+        SELECT sv.vehicle_id, SUM(p.amount) AS amount
+        FROM all_payments p
+        JOIN all_student_vehicle sv
+          ON sv.student_id = p.student_id
+         AND sv.start_date <= p.pay_date
+         AND (sv.end_date IS NULL OR sv.end_date > p.pay_date)
+        WHERE p.pay_ym BETWEEN ? AND ?
+        GROUP BY sv.vehicle_id
+    ),
+    spent AS (
+        SELECT vehicle_id, SUM(amount) AS amount
+        FROM all_expenses
+        WHERE exp_ym BETWEEN ? AND ? AND vehicle_id IS NOT NULL
+        GROUP BY vehicle_id
+    )
+    SELECT v.plate, v.name,
+           COALESCE(r.rider_months, 0) AS rider_months,
+           COALESCE(r.fees, 0) AS fees,
+           COALESCE(col.amount, 0) AS collected,
+           COALESCE(sp.amount, 0) AS expense,
+           COALESCE(r.fees, 0) - COALESCE(sp.amount, 0) AS margin,
+           COALESCE(sp.amount, 0) / NULLIF(r.rider_months, 0) AS cost_per_rider_month
+    FROM vehicles v
+    LEFT JOIN riders r ON r.vehicle_id = v.id
+    LEFT JOIN collected col ON col.vehicle_id = v.id
+    LEFT JOIN spent sp ON sp.vehicle_id = v.id
+    WHERE v.is_active = 1 OR r.vehicle_id IS NOT NULL OR sp.vehicle_id IS NOT NULL
+    ORDER BY v.plate
+    """, (start_ym, start_ym, start_ym, start_ym, start_ym, end_ym,
+          start_ym, end_ym, start_ym, end_ym)).fetchall()
+
+    general_expense = conn.execute("""
+    SELECT COALESCE(SUM(amount), 0)
+    FROM all_expenses
+    WHERE exp_ym BETWEEN ? AND ? AND vehicle_id IS NULL
+    """, (start_ym, end_ym)).fetchone()[0]
+
+    rider_months = sum(r.rider_months for r in vehicle_rows)
+    total_fees = sum(r.fees for r in vehicle_rows)
+    total_expense = sum(r.expense for r in vehicle_rows) + general_expense
+
+    return {
+        "title": f"Gider Analizi - {start_ym} / {end_ym}",
+        "filename": f"gider_analizi_{start_ym}_{end_ym}",
+        "sections": [
+            {
+                "title": "Araç x Kategori x Ay",
+                "columns": [("Araç", "text", 2), ("Kategori", "text", 2)]
+                           + [(ym, "money", 1.2) for ym in months]
+                           + [("Toplam", "money", 1.5)],
+                "rows": pivot_rows,
+                "count": pivot_count,
+                "empty": "Bu dönemde gider yok.",
+            },
+            {
+                "title": "Araç Bazında Özet",
+                "columns": [("Plaka", "text", 1.5), ("Araç", "text", 2),
+                            ("Öğrenci-Ay", "int", 1), ("Tahakkuk (TL)", "money", 1.5),
+                            ("Tahsilat (TL)", "money", 1.5), ("Gider (TL)", "money", 1.5),
+                            ("Marj (TL)", "money", 1.5), ("Öğrenci-Ay Başı Gider", "money", 1.5)],
+                "rows": vehicle_rows,
+                "empty": "Araç kaydı yok.",
+            },
+        ],
+        "totals": [
+            ("Toplam Gider", total_expense, "money"),
+            ("Araca Bağlı Olmayan Gider", general_expense, "money"),
+            ("Toplam Tahakkuk", total_fees, "money"),
+            ("Marj", total_fees - total_expense, "money"),
+            ("Öğrenci-Ay Başı Gider", total_expense / rider_months if rider_months else 0, "money"),
+        ],
+    }
+
+
+@bp.route("/expense_pivot", methods=["POST"])
+@login_required
+def expense_pivot():
+    start_ym = request.form.get("start_month", "").strip()
+    end_ym = request.form.get("end_month", "").strip()
+    report_format = request.form.get("report_format", "html")
+
+    if not (YEAR_MONTH_RE.match(start_ym) and YEAR_MONTH_RE.match(end_ym)) or start_ym > end_ym:
+        flash("Geçerli bir başlangıç ve bitiş ayı seçiniz.", "danger")
+        return redirect(url_for("servis.index", tab="expenses"))
+
+    if len(month_keys(start_ym, end_ym)) > EXPENSE_PIVOT_MAX_MONTHS:
+        flash(f"Gider analizi en fazla {EXPENSE_PIVOT_MAX_MONTHS} ay için alınabilir.", "danger")
+        return redirect(url_for("servis.index", tab="expenses"))
+
+    if report_format not in REPORT_FORMATS:
+        report_format = "html"
+
+    if report_format == "pdf" and pdfmetrics is None:
+        flash("PDF oluşturmak için 'reportlab' kütüphanesini kurmalısınız.", "danger")
+        return redirect(url_for("servis.index", tab="expenses"))
+
+    if report_format == "html":
+        conn = get_history_conn()
+        try:
+            return send_report(build_expense_pivot_report(conn, start_ym, end_ym), report_format)
+        finally:
+            conn.close()
+
+    job_id = enqueue_report_job(
+        "expense_pivot",
+        {"start_month": start_ym, "end_month": end_ym, "report_format": report_format},
+        f"Gider Analizi {start_ym} / {end_ym} ({REPORT_FORMATS[report_format][0].upper()})",
+        session.get("username"),
+    )
+    return queued_report_response(job_id)
+
+
+# ----------------- VELİ AYLIK EKSTRELERİ -----------------
+def load_parent_statements(year, month):
+    """
+    Tüm aktif öğrenciler için verilen ayın ekstre verisini küme bazlı (2 sorgu) hazırlar.
+    Aidat takvimi (aylık tutarlar) dues_allocation'dan okunur, ödemeler ise ay
+    sonuna kadar olanlarla sınırlanır; geçmiş bir ayın ekstresi sonraki
+    ödemeleri görmez.
+    """
+    month_start = date(year, month, 1).isoformat()
+    month_end = date(year, month, calendar.monthrange(year, month)[1]).isoformat()
+
+    conn = get_conn()
+    c = conn.cursor()
+
+    # Arşive taşınmış sezonların toplamları da ay sonundan önceyse sayılır
+    c.execute("""
+        WITH paid AS (
+            SELECT student_id, SUM(amount) AS amount
+            FROM (
+                SELECT student_id, amount FROM payments WHERE pay_date <= ?
+                UNION ALL
+                SELECT student_id, amount FROM archived_payment_totals WHERE paid_until <= ?
+            )
+            GROUP BY student_id
+        ),
+        schedule AS (
+            SELECT student_id,
+                   SUM(amount_due) AS annual_total,
+                   SUM(CASE WHEN period <= ? THEN amount_due ELSE 0.0 END) AS expected_so_far
+            FROM dues_allocation
+            GROUP BY student_id
+        )
+        SELECT s.id, s.name, s.school, s.parent_name, s.phone, s.monthly_fee,
+               COALESCE(p.amount, 0.0) AS total_paid,
+               d.expected_so_far,
+               MAX(d.expected_so_far - COALESCE(p.amount, 0.0), 0.0) AS overdue_amount,
+               MAX(d.annual_total - COALESCE(p.amount, 0.0), 0.0) AS remaining_year
+        FROM schedule d
+        JOIN students s ON s.id = d.student_id
+        LEFT JOIN paid p ON p.student_id = s.id
+        WHERE s.is_active = 1
+        ORDER BY s.name COLLATE turkish
+    """, (month_end, month_end, year * 12 + month))
+    students_rows = c.fetchall()
+
+    c.execute("""
+        SELECT student_id, pay_date, amount, description
+        FROM payments
+        WHERE pay_date BETWEEN ? AND ?
+        ORDER BY student_id, pay_date, id
+    """, (month_start, month_end))
+    month_payments = {
+        sid: [r[1:] for r in group]
+        for sid, group in groupby(c, key=lambda r: r.student_id)
+    }
+
+    conn.close()
+
+    return [{
+        "student_id": s.id,
+        "student_name": s.name,
+        "school": s.school,
+        "parent_name": s.parent_name,
+        "phone": s.phone,
+        "monthly_fee": s.monthly_fee,
+        "period": f"{year}-{month:02d}",
+        "payments": month_payments.get(s.id, []),
+        "total_paid": s.total_paid,
+        "expected_so_far": s.expected_so_far,
+        "overdue_amount": s.overdue_amount,
+        "remaining_year": s.remaining_year,
+    } for s in students_rows]
+
+
+def build_parent_statement_report(st):
+    return {
+        "title": f"Aylık Servis Ekstresi - {st['period']}",
+        "filename": f"ekstre_{st['period']}_{st['student_id']}_{st['student_name']}",
+        "info": [
+            ("Veli", st["parent_name"]),
+            ("Öğrenci", st["student_name"]),
+            ("Okul", st["school"]),
+            ("Aylık Ücret", f"{st['monthly_fee']:.2f} TL"),
+        ],
+        "sections": [{
+            "title": "Bu Ay Alınan Ödemeler",
+            "columns": [("Tarih", "text", 1), ("Tutar (TL)", "money", 1), ("Açıklama", "text", 3)],
+            "rows": st["payments"],
+            "empty": "Bu ay ödeme kaydı bulunmuyor.",
+        }],
+        "totals": [
+            ("Ödenen Toplam", st["total_paid"], "money"),
+            ("Geciken Tutar", st["overdue_amount"], "money"),
+            ("Kalan Yıllık Tutar", st["remaining_year"], "money"),
+        ],
+    }
+
+
+def render_parent_statement_pdf(st):
+    """
+    Tek öğrencinin aylık ekstresini PDF olarak üretir, (dosya_adı, bytes) döner.
+    Süreç havuzunda çalıştığı için modül seviyesinde ve yalnızca düz veriyle çalışır.
+    """
+    report = build_parent_statement_report(st)
+    with render_report_pdf(report) as pdf:
+        return f"{report['filename']}.pdf", pdf.read()
+
+
+def set_statement_progress(token, done, total):
+    """
+    Ekstre üretim ilerlemesini statement_progress tablosuna yazar (tüm
+    worker'lar görebilsin). Her yazmada süresi dolmuş kayıtlar silinir.
+    """
+    conn = get_conn()
+    conn.execute("DELETE FROM statement_progress WHERE expires_at <= datetime('now')")
+    conn.execute("""
+        INSERT INTO statement_progress (token, done, total, expires_at)
+        VALUES (?, ?, ?, datetime('now', ?))
+        ON CONFLICT(token) DO UPDATE SET done = excluded.done, total = excluded.total
+    """, (token, done, total, f"+{STATEMENT_PROGRESS_TTL_HOURS} hours"))
+    conn.commit()
+    conn.close()
+
+
+_statement_pool_lock = threading.Lock()
+
+
+def statement_pool():
+    """
+    Ekstre PDF'leri için uygulama ömrünce paylaşılan süreç havuzu; her istekte
+    yeni süreçler başlatılmaz. Bozulan havuz drop_statement_pool() ile bırakılır.
+    """
+    state = app_state()
+    with _statement_pool_lock:
+        pool = state["statement_pool"]
+        if pool is None:
+            pool = state["statement_pool"] = ProcessPoolExecutor(
+                max_workers=STATEMENT_WORKERS,
+                mp_context=multiprocessing.get_context(STATEMENT_MP_CONTEXT),
+                initializer=register_pdf_fonts,
+                initargs=(current_app.config["FONT_DIR"],),
+            )
+    return pool
+
+
+def drop_statement_pool(pool):
+    """Bir süreci ölen havuzu bırakır; sonraki istek statement_pool() ile yenisini kurar."""
+    state = app_state()
+    with _statement_pool_lock:
+        if state["statement_pool"] is pool:
+            state["statement_pool"] = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+@bp.route("/parent_statements")
+@login_required
+def parent_statements():
+    """
+    Seçilen ay için tüm aktif öğrencilerin veli ekstrelerini süreç havuzunda
+    üretir ve ZIP olarak akıtır. 'token' verilirse ilerleme
+    /parent_statements/progress/<token> adresinden izlenebilir.
+    """
+    period = request.args.get("month", "").strip()
+    token = "".join(ch for ch in request.args.get("token", "") if ch.isalnum())[:32]
+
+    try:
+        year, month = (int(x) for x in period.split("-"))
+        date(year, month, 1)
+    except ValueError:
+        flash("Ekstre ayı seçiniz.", "danger")
+        return redirect(url_for("servis.index", tab="dues"))
+
+    if pdfmetrics is None:
+        flash("PDF için 'reportlab' kütüphanesini kurmalısınız: pip install reportlab", "danger")
+        return redirect(url_for("servis.index", tab="dues"))
+
+    register_pdf_fonts()
+
+    statements = load_parent_statements(year, month)
+    if not statements:
+        flash("Ekstre oluşturulacak öğrenci bulunamadı.", "info")
+        return redirect(url_for("servis.index", tab="dues"))
+
+    total = len(statements)
+    if token:
+        set_statement_progress(token, 0, total)
+
+    def generate():
+        # Kuyrukta en fazla STATEMENT_WORKERS * STATEMENT_QUEUE_PER_WORKER ekstre
+        # bekler; istemci koparsa finally bekleyenleri iptal eder, çalışanlar biter.
+        pool = statement_pool()
+        todo = iter(statements)
+        pending = deque()
+
+        def submit_next():
+            st = next(todo, None)
+            if st is not None:
+                pending.append(pool.submit(render_parent_statement_pdf, st))
+
+        stream = _ZipStream()
+        try:
+            for _ in range(STATEMENT_WORKERS * STATEMENT_QUEUE_PER_WORKER):
+                submit_next()
+            with zipfile.ZipFile(stream, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+                done = 0
+                while pending:
+                    filename, pdf_bytes = pending.popleft().result()
+                    submit_next()
+                    zf.writestr(filename, pdf_bytes)
+                    done += 1
+                    if token and (done % 50 == 0 or done == total):
+                        set_statement_progress(token, done, total)
+                    yield stream.pop()
+            yield stream.pop()
+        except BrokenProcessPool:
+            drop_statement_pool(pool)
+            raise
+        finally:
+            for future in pending:
+                future.cancel()
+
+    filename = f"veli_ekstreleri_{year}-{month:02d}.zip"
+    return Response(
+        stream_with_context(generate()),
+        mimetype="application/zip",
+        headers={"Content-Disposition": f"attachment; filename={filename}"},
+    )
+
+
+@bp.route("/parent_statements/progress/<string:token>")
+@login_required
+def parent_statements_progress(token):
+    conn = get_conn()
+    c = conn.cursor()
+    c.execute("""
+        SELECT done, total FROM statement_progress
+        WHERE token=? AND expires_at > datetime('now')
+    """, (token,))
+    row = c.fetchone()
+    conn.close()
+
+    if not row:
+        return jsonify({"done": 0, "total": 0})
+
+    return jsonify({"done": row.done, "total": row.total})
+
+
+# ----------------- ARKA PLAN RAPOR İŞLERİ -----------------
+# Büyük PDF / XLSX / CSV çıktıları web isteğinde değil kuyrukta üretilir: istek
+# report_jobs'a bir kayıt ekleyip iş numarasını döner, worker kaydı alır,
+# ilerlemeyi (done / total) yazar ve bitince dosyayı REPORT_JOB_DIR ayarındaki
+# klasöre koyar. Worker varsayılan olarak her web sürecinde bir daemon
+# thread'dir; ayrı süreçte çalıştırmak için REPORT_WORKER=external verilip
+# `flask report-worker` başlatılır. İşi alma BEGIN IMMEDIATE ile yapıldığından birden çok worker
+# aynı işi iki kez üretmez.
+REPORT_JOB_TTL_HOURS = 24  # hazır dosyalar bu süre sonra silinir
+REPORT_JOB_POLL_SECONDS = 2.0
+REPORT_JOB_PROGRESS_SECONDS = 1.0  # ilerleme en fazla bu sıklıkta yazılır
+REPORT_JOB_STALE_SECONDS = 900  # bu süre haber alınamayan iş yeniden kuyruğa alınır
+REPORT_JOB_MAX_ATTEMPTS = 2
+REPORT_JOB_LIST_LIMIT = 20
+
+_report_worker_lock = threading.Lock()
+
+
+def render_report_job(report, report_format, progress):
+    """
+    Rapor sözlüğünü dosyaya çizer, (indirme_adı, mimetype, dosya) döner.
+    Satırlar cursor'dan akarak çizilir; toplam, bölümün "count" değerinden
+    (üreticinin COUNT(*) sorgusu) ya da liste uzunluğundan gelir. Canlı DB
+    WAL kipinde olduğundan açık okuma ilerleme yazmalarını bekletmez.
+    """
+    ext, mimetype = REPORT_FORMATS[report_format]
+    sections = report.get("sections", [])
+    counts = [section["count"] if "count" in section else len(section["rows"])
+              for section in sections]
+    total = sum(counts)
+
+    def tracked(rows, offset):
+        for i, row in enumerate(rows, start=1):
+            yield row
+            progress(offset + i, total)
+
+    offset = 0
+    for section, count in zip(sections, counts):
+        section["rows"] = tracked(section["rows"], offset)
+        offset += count
+
+    return f"{report['filename']}.{ext}", mimetype, render_report_file(report, ext)
+
+
+def run_daily_report_job(params, progress):
+    conn = get_read_conn()
+    try:
+        report = build_daily_report(conn, params["report_date"])
+        return render_report_job(report, params["report_format"], progress)
+    finally:
+        conn.close()
+
+
+def run_expense_pivot_job(params, progress):
+    conn = get_history_conn(replica=True)
+    try:
+        report = build_expense_pivot_report(conn, params["start_month"], params["end_month"])
+        return render_report_job(report, params["report_format"], progress)
+    finally:
+        conn.close()
+
+
+def run_roster_history_job(params, progress):
+    conn = get_history_conn(replica=True)
+    try:
+        vh = None
+        if params["vehicle_id"]:
+            vh = conn.execute("SELECT id, plate, name FROM vehicles WHERE id=?",
+                              (params["vehicle_id"],)).fetchone()
+            if not vh:
+                raise ValueError("Araç bulunamadı.")
+        rows = load_roster_history(conn, params["first_day"], params["last_day"], params["vehicle_id"])
+        report = build_roster_history_report(rows, params["label"], vh)
+        return render_report_job(report, params["report_format"], progress)
+    finally:
+        conn.close()
+
+
+def run_student_timeline_job(params, progress):
+    conn = get_history_conn(replica=True)
+    try:
+        st = conn.execute("SELECT id, name, school, parent_name FROM students WHERE id=?",
+                          (params["student_id"],)).fetchone()
+        if not st:
+            raise ValueError("Öğrenci bulunamadı.")
+        report = build_student_timeline_report(st, load_student_timeline(conn, st.id))
+        return render_report_job(report, params["report_format"], progress)
+    finally:
+        conn.close()
+
+
+def run_fleet_report_job(params, progress):
+    """Tüm aktif araçların listeleri: tek PDF ya da araç başına PDF + CSV içeren ZIP."""
+    register_pdf_fonts()
+
+    rosters = load_fleet_rosters()
+    if not rosters:
+        raise ValueError("Aktif araç bulunamadı.")
+
+    total = len(rosters)
+    today_str = date.today().isoformat()
+
+    if params["report_format"] == "pdf":
+        def reports():
+            for done, (vh, students_rows, _) in enumerate(rosters, start=1):
+                yield build_vehicle_roster_report(vh, students_rows)
+                progress(done, total)
+
+        return (f"tum_araclar_ogrenci_listesi_{today_str}.pdf", "application/pdf",
+                render_report_pdf(reports()))
+
+    out = tempfile.SpooledTemporaryFile(max_size=REPORT_SPOOL_BYTES)
+    with zipfile.ZipFile(out, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for done, (vh, students_rows, version) in enumerate(rosters, start=1):
+            base_name = f"arac_{vh.plate}_ogrenci_listesi"
+            zf.writestr(f"{base_name}.csv", cached_roster(
+                ("csv", vh.id), version, lambda: vehicle_roster_csv(vh, students_rows)))
+            zf.writestr(f"{base_name}.pdf", cached_roster(
+                ("pdf", vh.id), version, lambda: render_vehicle_roster_pdf(vh, students_rows)))
+            progress(done, total)
+    out.seek(0)
+    return f"tum_araclar_ogrenci_listesi_{today_str}.zip", "application/zip", out
+
+
+# İş türü -> üretici. Üretici (params, progress) alır, (indirme_adı, mimetype, dosya) döner.
+REPORT_JOB_KINDS = {
+    "daily_report": run_daily_report_job,
+    "expense_pivot": run_expense_pivot_job,
+    "roster_history": run_roster_history_job,
+    "student_timeline": run_student_timeline_job,
+    "fleet_report": run_fleet_report_job,
+}
+
+
+def enqueue_report_job(kind, params, title, created_by=None):
+    """
+    İşi kuyruğa ekler ve numarasını döner. Aynı rapor zaten kuyrukta ya da
+    üretilmekteyse yeni iş açılmaz, mevcut işin numarası döner.
+    """
+    params_json = json.dumps(params, sort_keys=True)
+
+    conn = get_conn()
+    c = conn.cursor()
+    try:
+        # Kontrol ve ekleme yazma kilidi altında: art arda iki gönderim iki iş açmaz
+        c.execute("BEGIN IMMEDIATE")
+        c.execute("""
+            SELECT id FROM report_jobs
+            WHERE kind=? AND params=? AND status IN ('queued', 'running')
+            ORDER BY id LIMIT 1
+        """, (kind, params_json))
+        row = c.fetchone()
+        if row:
+            job_id = row.id
+        else:
+            c.execute("""
+                INSERT INTO report_jobs (kind, params, title, created_at, created_by)
+                VALUES (?, ?, ?, datetime('now'), ?)
+            """, (kind, params_json, title, created_by))
+            job_id = c.lastrowid
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    app_state()["report_wakeup"].set()
+    ensure_report_worker()
+    return job_id
+
+
+def claim_report_job():
+    """
+    Sıradaki işi 'running' olarak işaretleyip döner; iş yoksa None. Haber
+    alınamayan (worker'ı ölmüş) işler önce yeniden kuyruğa alınır, deneme
+    hakkı bitenler hatalı sayılır.
+    """
+    conn = get_conn()
+    c = conn.cursor()
+    try:
+        c.execute("BEGIN IMMEDIATE")
+        c.execute("""
+            UPDATE report_jobs
+            SET status = CASE WHEN attempts >= ? THEN 'error' ELSE 'queued' END,
+                error = CASE WHEN attempts >= ? THEN 'İşi üreten süreç yanıt vermedi.' END
+            WHERE status = 'running' AND heartbeat_at < datetime('now', ?)
+        """, (REPORT_JOB_MAX_ATTEMPTS, REPORT_JOB_MAX_ATTEMPTS,
+              f"-{REPORT_JOB_STALE_SECONDS} seconds"))
+        c.execute("""
+            SELECT id, kind, params FROM report_jobs
+            WHERE status = 'queued'
+            ORDER BY id LIMIT 1
+        """)
+        job = c.fetchone()
+        if job:
+            c.execute("""
+                UPDATE report_jobs
+                SET status='running', started_at=datetime('now'), heartbeat_at=datetime('now'),
+                    attempts=attempts + 1, done=0, total=0
+                WHERE id=?
+            """, (job.id,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    return job
+
+
+def report_job_progress(job_id):
+    """İlerleme geri çağrısı; en fazla REPORT_JOB_PROGRESS_SECONDS'te bir yazar (heartbeat)."""
+    last_write = [0.0]
+
+    def progress(done, total):
+        now = time.monotonic()
+        if now - last_write[0] < REPORT_JOB_PROGRESS_SECONDS:
+            return
+        last_write[0] = now
+        conn = get_conn()
+        conn.execute("""
+            UPDATE report_jobs SET done=?, total=?, heartbeat_at=datetime('now') WHERE id=?
+        """, (done, total, job_id))
+        conn.commit()
+        conn.close()
+
+    return progress
+
+
+def run_report_job(job):
+    """İşi üretir, dosyayı REPORT_JOB_DIR klasörüne yazar ve sonucu report_jobs'a işler."""
+    try:
+        run = REPORT_JOB_KINDS[job.kind]
+        filename, mimetype, data = run(json.loads(job.params), report_job_progress(job.id))
+
+        job_dir = current_app.config["REPORT_JOB_DIR"]
+        os.makedirs(job_dir, exist_ok=True)
+        path = os.path.abspath(os.path.join(job_dir, f"job_{job.id}"))
+        with data, open(path + ".part", "wb") as f:
+            shutil.copyfileobj(data, f)
+        os.replace(path + ".part", path)
+    except Exception as e:
+        print(f"[RAPOR İŞİ HATASI] #{job.id}: {e}")
+        conn = get_conn()
+        conn.execute("""
+            UPDATE report_jobs SET status='error', error=?, finished_at=datetime('now') WHERE id=?
+        """, (str(e), job.id))
+        conn.commit()
+        conn.close()
+        return
+
+    conn = get_conn()
+    conn.execute("""
+        UPDATE report_jobs
+        SET status='done', done=MAX(done, total), finished_at=datetime('now'),
+            file_path=?, filename=?, mimetype=?, expires_at=datetime('now', ?)
+        WHERE id=?
+    """, (path, filename, mimetype, f"+{REPORT_JOB_TTL_HOURS} hours", job.id))
+    conn.commit()
+    conn.close()
+
+
+def expire_report_jobs():
+    """Süresi dolan iş dosyalarını siler; kayıtlar 'expired' olarak kalır."""
+    conn = get_conn()
+    c = conn.cursor()
+    c.execute("""
+        SELECT id, file_path FROM report_jobs
+        WHERE status = 'done' AND expires_at <= datetime('now')
+    """)
+    expired = c.fetchall()
+    for job in expired:
+        try:
+            os.remove(job.file_path)
+        except (OSError, TypeError):
+            pass
+    if expired:
+        c.executemany(
+            "UPDATE report_jobs SET status='expired', file_path=NULL WHERE id=?",
+            [(job.id,) for job in expired],
+        )
+        conn.commit()
+    conn.close()
+    return len(expired)
+
+
+def report_worker_loop():
+    """Kuyruğu sonsuza dek işler; boşta REPORT_JOB_POLL_SECONDS bekler ya da yeni işle uyanır."""
+    wakeup = app_state()["report_wakeup"]
+    while True:
+        try:
+            expire_report_jobs()
+            job = claim_report_job()
+            if job:
+                run_report_job(job)
+                continue
+        except Exception as e:
+            print(f"[RAPOR KUYRUĞU HATASI] {e}")
+        wakeup.wait(REPORT_JOB_POLL_SECONDS)
+        wakeup.clear()
+
+
+def ensure_report_worker():
+    """Bu süreçte worker thread'i yoksa başlatır (REPORT_WORKER=external ise başlatmaz)."""
+    if current_app.config["REPORT_WORKER"] != "thread":
+        return
+    state = app_state()
+    with _report_worker_lock:
+        worker = state["report_worker"]
+        if worker is None or not worker.is_alive():
+            worker = threading.Thread(
+                target=run_in_app_context,
+                args=(current_app._get_current_object(), report_worker_loop),
+                name="report-worker", daemon=True,
+            )
+            worker.start()
+            state["report_worker"] = worker
+
+
+def report_job_status(job):
+    status = {
+        "id": job.id,
+        "title": job.title,
+        "status": job.status,
+        "done": job.done,
+        "total": job.total,
+        "created_at": job.created_at,
+        "finished_at": job.finished_at,
+        "expires_at": job.expires_at,
+        "error": job.error,
+        "download_url": None,
+    }
+    if job.status == "done":
+        status["download_url"] = url_for("servis.report_job_download", job_id=job.id)
+    return status
+
+
+def queued_report_response(job_id):
+    """fetch isteğine iş numarası + durum adresi (202), normal forma rapor işleri sayfası döner."""
+    if wants_fragment():
+        return jsonify({
+            "id": job_id,
+            "status_url": url_for("servis.report_job", job_id=job_id),
+        }), 202
+
+    flash(f"Rapor #{job_id} hazırlanıyor; hazır olunca bu sayfadan indirebilirsiniz.", "info")
+    return redirect(url_for("servis.report_jobs"))
+
+
+def load_report_job(c, job_id):
+    c.execute("""
+        SELECT id, title, status, created_at, created_by, finished_at, done, total,
+               file_path, filename, mimetype, error, expires_at
+        FROM report_jobs WHERE id=?
+    """, (job_id,))
+    return c.fetchone()
+
+
+@bp.route("/report_jobs")
+@login_required
+def report_jobs():
+    ensure_report_worker()
+
+    conn = get_conn()
+    c = conn.cursor()
+    c.execute("""
+        SELECT id, title, status, created_at, created_by, finished_at, done, total,
+               error, expires_at
+        FROM report_jobs
+        ORDER BY id DESC
+        LIMIT ?
+    """, (REPORT_JOB_LIST_LIMIT,))
+    jobs = c.fetchall()
+    conn.close()
+
+    return render_template("report_jobs.html", jobs=jobs)
+
+
+@bp.route("/report_jobs/<int:job_id>")
+@login_required
+def report_job(job_id):
+    """İşin durumu ve ilerlemesi (JSON); hazırsa download_url dolu gelir."""
+    conn = get_conn()
+    job = load_report_job(conn.cursor(), job_id)
+    conn.close()
+
+    if not job:
+        return jsonify({"error": "Rapor işi bulunamadı."}), 404
+    return jsonify(report_job_status(job))
+
+
+@bp.route("/report_jobs/<int:job_id>/download")
+@login_required
+def report_job_download(job_id):
+    conn = get_conn()
+    job = load_report_job(conn.cursor(), job_id)
+    conn.close()
+
+    if not job or job.status != "done" or not os.path.isfile(job.file_path or ""):
+        flash("Rapor dosyası hazır değil ya da süresi doldu.", "danger")
+        return redirect(url_for("servis.report_jobs"))
+
+    return send_file(
+        job.file_path,
+        as_attachment=True,
+        download_name=job.filename,
+        mimetype=job.mimetype,
+    )
+
+
+@bp.cli.command("report-worker")
+def report_worker_command():
+    """Rapor kuyruğunu bu süreçte işler (REPORT_WORKER=external ile birlikte kullanılır)."""
+    click.echo("Rapor kuyruğu dinleniyor...")
+    report_worker_loop()
+
+
+# ----------------- JSON API (v1) -----------------
+# Mobil uygulama için salt okunur uçlar. Her kaynak için izin verilen alanlar;
+# ?fields= ile bunların alt kümesi seçilebilir (id her zaman döner).
+API_RESOURCES = {
+    "students": {
+        "table": "students",
+        "fields": ["id", "name", "school", "parent_name", "phone", "monthly_fee",
+                   "start_year", "start_month", "is_active"],
+        "filters": ["is_active", "school"],
+    },
+    "vehicles": {
+        "table": "vehicles",
+        "fields": ["id", "plate", "name", "capacity", "route", "is_active"],
+        "filters": ["is_active"],
+    },
+    "payments": {
+        "table": "payments",
+        "fields": ["id", "student_id", "pay_date", "amount", "description"],
+        "filters": ["student_id", "pay_date"],
+    },
+}
+
+API_DEFAULT_LIMIT = 100
+API_MAX_LIMIT = 500
+
+
+class ApiError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+@bp.errorhandler(ApiError)
+def handle_api_error(e):
+    return jsonify({"error": e.message}), e.status
+
+
+def api_page_args():
+    """?after=<id>&limit=<n> anahtar tabanlı sayfalama parametrelerini okur."""
+    try:
+        after = int(request.args.get("after", 0))
+        limit = int(request.args.get("limit", API_DEFAULT_LIMIT))
+    except ValueError:
+        raise ApiError("after ve limit sayısal olmalıdır.")
+    return after, max(1, min(limit, API_MAX_LIMIT))
+
+
+def api_selected_fields(allowed):
+    fields_arg = request.args.get("fields", "").strip()
+    if not fields_arg:
+        return list(allowed)
+
+    fields = [f.strip() for f in fields_arg.split(",") if f.strip()]
+    unknown = [f for f in fields if f not in allowed]
+    if unknown:
+        raise ApiError(f"Bilinmeyen alan: {', '.join(unknown)}")
+    if "id" not in fields:
+        fields.insert(0, "id")
+    return fields
+
+
+def api_response(items, limit):
+    """
+    Sayfa yanıtını üretir. Bir fazla satır okunduysa sonraki sayfa vardır.
+    İçerikten ETag hesaplanır; If-None-Match tutarsa 304 döner.
+    """
+    next_after = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_after = items[-1]["id"]
+
+    resp = jsonify({"items": items, "next_after": next_after})
+    resp.add_etag()
+    return resp.make_conditional(request)
+
+
+@bp.route("/api/v1/token", methods=["POST"])
+def api_token():
+    """Kullanıcı adı/şifre ile mobil uygulama için API anahtarı üretir."""
+    data = request.get_json(silent=True) or request.form
+    username = (data.get("username") or "").strip()
+    password = (data.get("password") or "").strip()
+
+    conn = get_conn()
+    c = conn.cursor()
+    c.execute("SELECT id, password_hash FROM users WHERE username=?", (username,))
+    row = c.fetchone()
+
+    if not row or not check_password_hash(row.password_hash, password):
+        conn.close()
+        return jsonify({"error": "Kullanıcı adı veya şifre hatalı."}), 401
+
+    token = secrets.token_urlsafe(32)
+    c.execute(
+        "INSERT INTO api_tokens (token_hash, user_id, created_at) VALUES (?, ?, ?)",
+        (hashlib.sha256(token.encode()).hexdigest(), row.id, date.today().isoformat()),
+    )
+    conn.commit()
+    conn.close()
+
+    return jsonify({"token": token})
+
+
+@bp.route("/api/v1/<string:resource>")
+@api_login_required
+def api_list(resource):
+    spec = API_RESOURCES.get(resource)
+    if spec is None:
+        raise ApiError("Kaynak bulunamadı.", 404)
+
+    fields = api_selected_fields(spec["fields"])
+    after, limit = api_page_args()
+
+    where = ["id > ?"]
+    params = [after]
+    for name in spec["filters"]:
+        if name in request.args:
+            where.append(f"{name} = ?")
+            params.append(request.args[name])
+
+    conn = get_conn()
+    c = conn.cursor()
+    c.execute(
+        f"SELECT {', '.join(fields)} FROM {spec['table']} "
+        f"WHERE {' AND '.join(where)} ORDER BY id LIMIT ?",
+        params + [limit + 1],
+    )
+    items = [row._asdict() for row in c]
+    conn.close()
+
+    return api_response(items, limit)
+
+
+@bp.route("/api/v1/vehicles/<int:vehicle_id>/roster")
+@api_login_required
+def api_vehicle_roster(vehicle_id):
+    """Aracın güncel listesi; ?date=YYYY-MM-DD verilirse o gün araçta olanlar (arşiv dahil)."""
+    fields = api_selected_fields(API_RESOURCES["students"]["fields"])
+    after, limit = api_page_args()
+
+    as_of = request.args.get("date", "").strip()
+    if as_of:
+        try:
+            as_of = date.fromisoformat(as_of).isoformat()
+        except ValueError:
+            raise ApiError("date YYYY-MM-DD biçiminde olmalıdır.")
+        # Geçmiş tarihte o an pasif olan öğrenciler de listede kalır
+        table = "all_student_vehicle"
+        condition = "sv.start_date <= ? AND (sv.end_date IS NULL OR sv.end_date > ?)"
+        params = (as_of, as_of)
+        conn = get_history_conn()
+    else:
+        table = "student_vehicle"
+        condition = "sv.end_date IS NULL AND s.is_active = 1"
+        params = ()
+        conn = get_conn()
+
+    c = conn.cursor()
+    c.execute("SELECT 1 FROM vehicles WHERE id=?", (vehicle_id,))
+    if not c.fetchone():
+        conn.close()
+        raise ApiError("Araç bulunamadı.", 404)
+
+    c.execute(f"""
+        SELECT {', '.join('s.' + f for f in fields)}
+        FROM {table} sv
+        JOIN students s ON s.id = sv.student_id
+        WHERE sv.vehicle_id = ?
+          AND {condition}
+          AND s.id > ?
+        ORDER BY s.id
+        LIMIT ?
+    """, (vehicle_id,) + params + (after, limit + 1))
+    items = [row._asdict() for row in c]
+    conn.close()
+
+    return api_response(items, limit)
+
+
+@bp.route("/api/v1/dues")
+@api_login_required
+def api_dues():
+    """Gecikmiş aidat listesi; index()'teki listeyle aynı load_overdue_dues() satırları."""
+    fields = api_selected_fields([
+        "id", "name", "school", "parent_name", "phone", "monthly_fee",
+        "total_paid", "expected_so_far", "overdue_amount", "remaining_year",
+    ])
+    after, limit = api_page_args()
+
+    conn = get_conn()
+    rows = load_overdue_dues(conn.cursor(), date.today(), after, limit + 1)
+    conn.close()
+
+    items = []
+    for r in rows:
+        row = r._asdict()
+        row["id"], row["name"] = r.student_id, r.student_name
+        items.append({f: row[f] for f in fields})
+
+    return api_response(items, limit)
+
+
+# ----------------- DEĞİŞİKLİK AKIŞI -----------------
+@bp.route("/changes")
+@api_login_required
+def changes():
+    """
+    ?since=<version> sonrasındaki değişiklikleri döner. İstemci yanıttaki
+    'version' değerini saklayıp bir sonraki sorguda since olarak gönderir.
+    op: insert | update | delete | archive (kayıt sezon arşivine taşındı,
+    silinmedi; canlı tablolarda yok, geçmiş sorgularında durur).
+    """
+    try:
+        since = int(request.args.get("since", 0))
+        limit = int(request.args.get("limit", API_MAX_LIMIT))
+    except ValueError:
+        raise ApiError("since ve limit sayısal olmalıdır.")
+    limit = max(1, min(limit, API_MAX_LIMIT))
+
+    conn = get_conn()
+    c = conn.cursor()
+    c.execute("""
+        SELECT version, entity, entity_id AS id, op, changed_at
+        FROM change_log
+        WHERE version > ?
+        ORDER BY version
+        LIMIT ?
+    """, (since, limit + 1))
+    rows = c.fetchall()
+    conn.close()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    return jsonify({
+        "changes": [r._asdict() for r in rows],
+        "version": rows[-1].version if rows else since,
+        "has_more": has_more,
+    })
+
+
+# ----------------- CANLI PANEL (SSE) -----------------
+# Akış, change_log'u bu aralıkla yoklar; böylece tüm worker'lardaki yazmalar görünür
+SSE_POLL_SECONDS = 1.0
+SSE_KEEPALIVE_SECONDS = 15.0
+# Her akış bir gthread iş parçacığını tutar; bu süre sonunda kapanır ve tarayıcı
+# Last-Event-ID ile yeniden bağlanır. Procfile'daki --threads açık panel
+# sayısından fazla tutulmalıdır.
+SSE_STREAM_SECONDS = 60.0
+
+# change_log varlığı -> (panel tablosu, satır makrosu, modal makrosu); satırlar
+# write_response'takiyle aynı _rows.html makrolarıyla sunucuda çizilir
+DASHBOARD_ROW_MACROS = {
+    "students": ("studentsTable", "student_row", "student_modal"),
+    "payments": ("paymentsTable", "payment_row", None),
+    "expenses": ("expensesTable", "expense_row", None),
+    "vehicles": ("vehiclesTable", "vehicle_row", None),
+}
+
+
+def load_dashboard_summary(c):
+    """index()'teki üst kartlarla aynı özet rakamları SQL ile hesaplar."""
+    c.execute("SELECT COUNT(*) FROM students WHERE is_active = 1")
+    student_count = c.fetchone()[0]
+    c.execute("SELECT COUNT(*) FROM vehicles")
+    vehicle_count = c.fetchone()[0]
+    # Kartlar son 50 ödeme / giderin toplamını gösteriyor
+    c.execute("""
+        SELECT COALESCE(SUM(amount), 0) FROM (
+            SELECT amount FROM payments ORDER BY pay_date DESC, id DESC LIMIT 50
+        )
+    """)
+    total_income = c.fetchone()[0]
+    c.execute("""
+        SELECT COALESCE(SUM(amount), 0) FROM (
+            SELECT amount FROM expenses ORDER BY exp_date DESC, id DESC LIMIT 50
+        )
+    """)
+    total_expense = c.fetchone()[0]
+
+    return {
+        "student_count": student_count,
+        "vehicle_count": vehicle_count,
+        "total_income": total_income,
+        "profit": total_income - total_expense,
+    }
+
+
+def change_event_payload(c, entity, entity_id, op):
+    """Tek bir change_log kaydı için (olay_adı, veri) üretir; panel satırı yerinde günceller."""
+    event = {
+        "payments": "payment",
+        "expenses": "expense",
+        "students": "student",
+        "vehicles": "vehicle",
+        "student_vehicle": "assignment",
+    }[entity]
+    data = {"id": entity_id, "op": op}
+    if op == "delete":
+        return event, data
+
+    row = fetch_dashboard_row(c, entity, entity_id)
+    if row is None:
+        return event, data
+    data.update(row._asdict())
+
+    if entity in DASHBOARD_ROW_MACROS:
+        table, row_macro, modal_macro = DASHBOARD_ROW_MACROS[entity]
+        data["table"] = table
+        data["html"] = get_template_attribute("_rows.html", row_macro)(row)
+        if modal_macro:
+            data["modal"] = get_template_attribute("_rows.html", modal_macro)(row)
+    return event, data
+
+
+def sse_message(event, data, event_id=None):
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append("data: " + json.dumps(data, ensure_ascii=False))
+    return "\n".join(lines) + "\n\n"
+
+
+@bp.route("/events")
+@login_required
+def events():
+    """
+    Açık panellere küçük olaylar iter: payment, expense, student, vehicle,
+    assignment ve ardından güncel 'summary'. Akış SSE_STREAM_SECONDS sonra
+    kapanır; tarayıcı Last-Event-ID ile kaldığı yerden yeniden bağlanır.
+    """
+    try:
+        last_version = int(request.headers.get("Last-Event-ID", ""))
+    except ValueError:
+        conn = get_conn()
+        last_version = conn.execute("SELECT COALESCE(MAX(version), 0) FROM change_log").fetchone()[0]
+        conn.close()
+
+    def generate():
+        version = last_version
+        idle = 0.0
+        deadline = time.monotonic() + SSE_STREAM_SECONDS
+        yield "retry: 3000\n\n"
+
+        while time.monotonic() < deadline:
+            conn = get_conn()
+            c = conn.cursor()
+            c.execute("""
+                SELECT version, entity, entity_id, op
+                FROM change_log
+                WHERE version > ?
+                ORDER BY version
+                LIMIT 200
+            """, (version,))
+            changes = c.fetchall()
+
+            messages = []
+            for v, entity, entity_id, op in changes:
+                version = v
+                if op == "archive":
+                    continue  # sezon arşivi panel satırlarını değiştirmez; özet yine gider
+                event, data = change_event_payload(c, entity, entity_id, op)
+                messages.append(sse_message(event, data, v))
+            if changes:
+                messages.append(sse_message("summary", load_dashboard_summary(c)))
+            conn.close()
+
+            if messages:
+                idle = 0.0
+                yield "".join(messages)
+            else:
+                idle += SSE_POLL_SECONDS
+                if idle >= SSE_KEEPALIVE_SECONDS:
+                    idle = 0.0
+                    yield ": keepalive\n\n"
+                time.sleep(SSE_POLL_SECONDS)
+
+        # Veri taşımayan id satırı yalnızca Last-Event-ID'yi günceller; hiç olay
+        # gelmemiş akışta da yeniden bağlanan panel aradaki kayıtları kaçırmaz
+        yield f"id: {version}\n\n"
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# ----------------- AİDAT DAĞITIMI (GECE) -----------------
+# ----------------- GECİKME HATIRLATMA KAMPANYASI -----------------
+SMS_BATCH_SIZE = 50
+SMS_BATCH_INTERVAL = 1.0  # saniye; servis sağlayıcının hız sınırına göre
+
+DEFAULT_REMINDER_TEMPLATE = (
+    "{parent_name} velimiz, {students} için {overdue_amount} TL gecikmiş servis "
+    "ücreti bulunmaktadır. Öz Ceylan Turizm"
+)
+
+
+class CampaignActiveError(Exception):
+    """Bekleyen ya da gönderilmekte olan kampanya varken yenisi açılamaz."""
+
+    def __init__(self, campaign_id):
+        super().__init__(f"Kampanya #{campaign_id} henüz bitmedi.")
+        self.campaign_id = campaign_id
+
+
+def normalize_phone(phone):
+    """'0 (555) 123 45 67', '+90555...' gibi yazımları son 10 haneye indirger."""
+    digits = re.sub(r"\D", "", phone or "")
+    return digits[-10:] if len(digits) >= 10 else None
+
+
+def create_reminder_campaign(template, created_by=None):
+    """
+    Gecikmiş tüm velileri küme bazlı seçer, telefona göre tekilleştirir
+    (kardeşler tek mesajda toplanır), mesajları şablondan üretip kampanya
+    olarak kaydeder. (kampanya_id, mesaj_sayısı) döner.
+
+    Çift tıklama ya da aynı gün tekrar başlatma veliye ikinci mesaj atmasın:
+    bekleyen/süren kampanya varsa CampaignActiveError verilir, bugün mesajı
+    başarıyla giden telefonlar atlanır. Kontrol ve kayıt aynı yazma kilidi altındadır.
+    """
+    # Şablonu baştan doğrula; hatalı alan adı kampanyayı yarıda kesmesin
+    template.format(parent_name="", students="", overdue_amount="")
+
+    conn = get_conn()
+    c = conn.cursor()
+    try:
+        c.execute("BEGIN IMMEDIATE")
+        c.execute("""
+            SELECT id FROM sms_campaigns
+            WHERE status IN ('pending', 'running')
+            ORDER BY id LIMIT 1
+        """)
+        active = c.fetchone()
+        if active:
+            raise CampaignActiveError(active.id)
+
+        c.execute("""
+            SELECT DISTINCT phone FROM sms_campaign_messages
+            WHERE status = 'sent' AND sent_at >= date('now')
+        """)
+        messaged_today = {r.phone for r in c.fetchall()}
+        overdue = load_overdue_dues(c, date.today())
+    except Exception:
+        conn.rollback()
+        conn.close()
+        raise
+
+    by_phone = {}
+    for d in overdue:
+        phone = normalize_phone(d.phone)
+        if not phone or phone in messaged_today:
+            continue
+        entry = by_phone.setdefault(phone, {
+            "parent_name": d.parent_name or "", "students": [], "overdue_amount": 0.0,
+        })
+        entry["students"].append(d.student_name)
+        entry["overdue_amount"] += d.overdue_amount
+
+    if not by_phone:
+        conn.rollback()
+        conn.close()
+        return None, 0
+
+    c.execute("""
+        INSERT INTO sms_campaigns (created_at, created_by, template, total)
+        VALUES (datetime('now'), ?, ?, ?)
+    """, (created_by, template, len(by_phone)))
+    campaign_id = c.lastrowid
+
+    c.executemany("""
+        INSERT INTO sms_campaign_messages (campaign_id, phone, parent_name, message)
+        VALUES (?, ?, ?, ?)
+    """, [
+        (campaign_id, phone, e["parent_name"], template.format(
+            parent_name=e["parent_name"],
+            students=", ".join(e["students"]),
+            overdue_amount=f"{e['overdue_amount']:.2f}",
+        ))
+        for phone, e in by_phone.items()
+    ])
+    conn.commit()
+    conn.close()
+
+    return campaign_id, len(by_phone)
+
+
+def run_sms_campaign(campaign_id):
+    """
+    Kampanyanın bekleyen mesajlarını SMS_BATCH_SIZE'lık gruplar halinde,
+    gruplar arasında SMS_BATCH_INTERVAL bekleyerek gönderir. Yalnızca
+    'pending' mesajlar gönderildiği için yarıda kalan kampanya tekrar çalıştırılabilir.
+    """
+    conn = get_conn()
+    c = conn.cursor()
+    c.execute("UPDATE sms_campaigns SET status='running' WHERE id=?", (campaign_id,))
+    conn.commit()
+
+    try:
+        while True:
+            c.execute("""
+                SELECT id, phone, message FROM sms_campaign_messages
+                WHERE campaign_id=? AND status='pending'
+                ORDER BY id LIMIT ?
+            """, (campaign_id, SMS_BATCH_SIZE))
+            batch = c.fetchall()
+            if not batch:
+                break
+
+            try:
+                results = send_sms_batch([(m.phone, m.message) for m in batch])
+            except Exception as e:
+                results = [(False, str(e))] * len(batch)
+
+            c.executemany("""
+                UPDATE sms_campaign_messages
+                SET status=?, error=?, sent_at=datetime('now')
+                WHERE id=?
+            """, [("sent" if ok else "failed", error, msg.id)
+                  for msg, (ok, error) in zip(batch, results)])
+            c.execute("""
+                UPDATE sms_campaigns
+                SET sent = (SELECT COUNT(*) FROM sms_campaign_messages
+                            WHERE campaign_id=? AND status='sent'),
+                    failed = (SELECT COUNT(*) FROM sms_campaign_messages
+                              WHERE campaign_id=? AND status='failed')
+                WHERE id=?
+            """, (campaign_id, campaign_id, campaign_id))
+            conn.commit()
+
+            time.sleep(SMS_BATCH_INTERVAL)
+
+        c.execute("""
+            UPDATE sms_campaigns SET status='done', finished_at=datetime('now') WHERE id=?
+        """, (campaign_id,))
+        conn.commit()
+    except Exception as e:
+        print(f"[SMS KAMPANYA HATASI] #{campaign_id}: {e}")
+        conn.rollback()
+        c.execute("UPDATE sms_campaigns SET status='error' WHERE id=?", (campaign_id,))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def load_sms_campaigns(c, limit=5):
+    c.execute("""
+        SELECT id, created_at, created_by, status, total, sent, failed, finished_at
+        FROM sms_campaigns
+        ORDER BY id DESC
+        LIMIT ?
+    """, (limit,))
+    return c.fetchall()
+
+
+@bp.route("/sms_campaign", methods=["POST"])
+@login_required
+def sms_campaign():
+    template = request.form.get("template", "").strip() or DEFAULT_REMINDER_TEMPLATE
+
+    try:
+        campaign_id, count = create_reminder_campaign(template, session.get("username"))
+    except (KeyError, IndexError, ValueError):
+        flash("Şablonda yalnızca {parent_name}, {students} ve {overdue_amount} kullanılabilir.", "danger")
+        return redirect(url_for("servis.index", tab="dues"))
+    except CampaignActiveError as e:
+        flash(f"Kampanya #{e.campaign_id} henüz bitmedi; yeni kampanya açılmadı. Yarıda "
+              f"kaldıysa `flask send-campaign {e.campaign_id}` ile tamamlayabilirsiniz.", "warning")
+        return redirect(url_for("servis.index", tab="dues"))
+
+    if count == 0:
+        flash("Hatırlatma gönderilecek veli bulunamadı (bugün hatırlatma almış veliler atlanır).", "info")
+        return redirect(url_for("servis.index", tab="dues"))
+
+    # Gönderim web isteğini bekletmesin
+    threading.Thread(
+        target=run_in_app_context,
+        args=(current_app._get_current_object(), run_sms_campaign, campaign_id),
+        daemon=True,
+    ).start()
+
+    flash(f"Kampanya #{campaign_id} başlatıldı: {count} veliye hatırlatma gönderilecek.", "success")
+    return redirect(url_for("servis.index", tab="dues"))
+
+
+@bp.route("/sms_campaign/<int:campaign_id>")
+@login_required
+def sms_campaign_report(campaign_id):
+    """Kampanya raporu: sayaçlar ve başarısız mesajlar (JSON)."""
+    conn = get_conn()
+    c = conn.cursor()
+    c.execute("""
+        SELECT id, created_at, created_by, status, total, sent, failed, finished_at
+        FROM sms_campaigns WHERE id=?
+    """, (campaign_id,))
+    row = c.fetchone()
+    if not row:
+        conn.close()
+        return jsonify({"error": "Kampanya bulunamadı."}), 404
+
+    report = row._asdict()
+
+    c.execute("""
+        SELECT phone, parent_name, error FROM sms_campaign_messages
+        WHERE campaign_id=? AND status='failed'
+        ORDER BY id
+    """, (campaign_id,))
+    report["failures"] = [r._asdict() for r in c]
+    conn.close()
+
+    return jsonify(report)
+
+
+@bp.cli.command("send-campaign")
+@click.argument("campaign_id", type=int)
+def send_campaign_command(campaign_id):
+    """Yarıda kalmış bir kampanyanın bekleyen mesajlarını gönderir."""
+    run_sms_campaign(campaign_id)
+    click.echo(f"Kampanya #{campaign_id} işlendi.")
+
+
+# ----------------- SEZON ARŞİVİ -----------------
+# get_history_conn() her arşivi ATTACH eder; SQLite en fazla 10 ekli DB'ye izin verir.
+# Bu sayıyı aşınca en eski iki arşiv tek dosyada birleştirilir (season_2014-2016.db).
+ARCHIVE_MAX_FILES = 8
+
+
+def season_bounds(start_year):
+    """2024 -> ('2024-2025', '2024-09-01', '2025-08-31') gibi sezon etiketi ve tarih aralığı."""
+    first = date(start_year, SEASON_START_MONTH, 1)
+    last = date(start_year + 1, SEASON_START_MONTH, 1) - timedelta(days=1)
+    return f"{start_year}-{start_year + 1}", first.isoformat(), last.isoformat()
+
+
+def archive_season(start_year):
+    """
+    Kapanmış bir sezonun ödeme, gider ve biten öğrenci-araç kayıtlarını
+    archives/season_<etiket>.db dosyasına taşır. Canlı DB WAL kipinde olduğu
+    için iki dosyaya yazan tek bir transaction atomik değildir; bu yüzden önce
+    arşive kopya commit edilir, sonra canlıdan yalnızca arşivde bulunan satırlar
+    ayrı bir transaction'da silinir. İkinci adım yarıda kalırsa satırlar iki
+    yerde birden durur (all_* görünümleri arşivdeki kopyayı saymaz); komut
+    yeniden çalıştırılınca kopyalama atlanır, silme tamamlanır.
+    Taşınan satır sayılarını sözlük olarak döner.
+    """
+    label, first, last = season_bounds(start_year)
+    if last >= date.today().isoformat():
+        raise ValueError(f"{label} sezonu henüz kapanmadı.")
+
+    archive_dir = current_app.config["ARCHIVE_DIR"]
+    os.makedirs(archive_dir, exist_ok=True)
+    archive_path = os.path.join(archive_dir, f"season_{label}.db")
+
+    selections = {
+        "payments": ("pay_date BETWEEN ? AND ?", (first, last)),
+        "expenses": ("exp_date BETWEEN ? AND ?", (first, last)),
+        # Yalnızca sezon içinde kapanmış atamalar; açık atamalar canlıda kalır
+        "student_vehicle": (
+            "end_date IS NOT NULL AND end_date <= ?", (last,)
+        ),
+    }
+
+    conn = get_conn()
+    c = conn.cursor()
+    c.execute("ATTACH DATABASE ? AS archive", (archive_path,))
+
+    moved = {}
+    try:
+        # 1) Arşive kopya: yalnızca arşiv dosyasına yazar
+        c.execute("BEGIN")
+        for table, (where, params) in selections.items():
+            c.execute("SELECT sql FROM main.sqlite_master WHERE type='table' AND name=?", (table,))
+            create_sql = c.fetchone()[0]
+            c.execute(create_sql.replace(
+                f"CREATE TABLE {table}", f"CREATE TABLE IF NOT EXISTS archive.{table}", 1
+            ))
+            # Üretilmiş sütunlara yazılamaz; kalıcı sütunlar adıyla kopyalanır
+            columns = ARCHIVED_COLUMNS[table]
+            c.execute(f"INSERT OR IGNORE INTO archive.{table} ({columns}) "
+                      f"SELECT {columns} FROM main.{table} WHERE {where}", params)
+        # Geçmiş araç listesi sorguları arşivde de indeksten okunur
+        c.execute("""
+            CREATE INDEX IF NOT EXISTS archive.idx_student_vehicle_interval
+                ON student_vehicle(vehicle_id, start_date, end_date, student_id)
+        """)
+        conn.commit()
+
+        # 2) Canlıdan silme: yalnızca canlı DB'ye yazar, arşivde olmayan satıra dokunmaz
+        c.execute("BEGIN")
+        for table, (where, params) in selections.items():
+            where = f"{where} AND id IN (SELECT id FROM archive.{table})"
+            if table == "payments":
+                # Aidat hesapları ömür boyu ödemeyi kullanır: taşınan tutar canlıda toplam olarak kalır
+                c.execute(f"""
+                    INSERT INTO archived_payment_totals (student_id, season, paid_until, amount)
+                    SELECT student_id, ?, MAX(pay_date), SUM(amount) FROM main.payments
+                    WHERE {where}
+                    GROUP BY student_id
+                    ON CONFLICT (student_id, season) DO UPDATE
+                    SET amount = amount + excluded.amount,
+                        paid_until = MAX(paid_until, excluded.paid_until)
+                """, (label,) + params)
+
+            c.execute("SELECT COALESCE(MAX(version), 0) FROM main.change_log")
+            version = c.fetchone()[0]
+            c.execute(f"DELETE FROM main.{table} WHERE {where}", params)
+            moved[table] = c.rowcount
+            # Tetikleyiciler silme yazdı; kayıt silinmedi, arşive taşındı
+            c.execute("""
+                UPDATE main.change_log SET op = 'archive'
+                WHERE version > ? AND entity = ? AND op = 'delete'
+            """, (version, table))
+        # Toplamlar archived_payment_totals'a geçti; dağıtım aynı kalmalı, yine de baştan kurulur
+        refresh_dues_allocation(conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        c.execute("DETACH DATABASE archive")
+        conn.close()
+
+    merge_season_archives()
+    return label, archive_path, moved
+
+
+def merge_season_archives():
+    """
+    Arşiv dosyası sayısı ARCHIVE_MAX_FILES'ı aşarsa en eski ikisini birleştirir.
+    Birleşik dosyanın etiketi ilk sezonun başından son sezonun sonuna uzanır.
+    Yeni dosya .part olarak kurulup yerine taşınır; açık okuyucular eski
+    dosyaları okumaya devam eder.
+    """
+    archives = list_season_archives()
+    while len(archives) > ARCHIVE_MAX_FILES:
+        (first_label, first_path), (last_label, last_path) = archives[:2]
+        label = f"{first_label.split('-')[0]}-{last_label.split('-')[-1]}"
+        merged_path = os.path.join(current_app.config["ARCHIVE_DIR"], f"season_{label}.db")
+
+        part = merged_path + ".part"
+        shutil.copyfile(first_path, part)
+        conn = sqlite3.connect(part)
+        c = conn.cursor()
+        c.execute("ATTACH DATABASE ? AS other", (f"file:{os.path.abspath(last_path)}?mode=ro",))
+        for table, columns in ARCHIVED_COLUMNS.items():
+            c.execute("SELECT sql FROM other.sqlite_master WHERE type='table' AND name=?", (table,))
+            row = c.fetchone()
+            if row is None:
+                continue
+            c.execute(row[0].replace(f"CREATE TABLE {table}", f"CREATE TABLE IF NOT EXISTS {table}", 1))
+            c.execute(f"INSERT OR IGNORE INTO main.{table} ({columns}) "
+                      f"SELECT {columns} FROM other.{table}")
+        c.execute("""
+            CREATE INDEX IF NOT EXISTS idx_student_vehicle_interval
+                ON student_vehicle(vehicle_id, start_date, end_date, student_id)
+        """)
+        conn.commit()
+        c.execute("DETACH DATABASE other")
+        conn.close()
+
+        os.replace(part, merged_path)
+        os.remove(first_path)
+        os.remove(last_path)
+        archives = list_season_archives()
+
+
+@bp.cli.command("archive-season")
+@click.argument("start_year", type=int)
+@click.option("--vacuum", is_flag=True, help="Taşımadan sonra canlı DB'yi küçült.")
+def archive_season_command(start_year, vacuum):
+    """START_YEAR'da başlayan kapanmış sezonu arşiv dosyasına taşır."""
+    try:
+        label, archive_path, moved = archive_season(start_year)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+    for table, count in moved.items():
+        click.echo(f"{table}: {count} satır -> {archive_path}")
+
+    if vacuum:
+        conn = get_conn()
+        conn.execute("VACUUM")
+        conn.close()
+        click.echo("VACUUM tamamlandı.")
+
+    click.echo(f"{label} sezonu arşivlendi.")
+
+
+# ----------------- BAKIM KOMUTLARI -----------------
+db_cli = AppGroup("db", help="Veritabanı bakım komutları.")
+bp.cli.add_command(db_cli)
+
+# Kaynak tablolardan türetilen tablolar ve yeniden kurma fonksiyonları
+DERIVED_TABLE_BUILDERS = {
+    "dues_allocation": rebuild_dues_allocation,
+}
+
+
+@db_cli.command("optimize")
+@click.option("--full", is_flag=True, help="PRAGMA optimize yerine tam ANALYZE çalıştır.")
+def db_optimize_command(full):
+    """Sorgu planlayıcı istatistiklerini günceller (PRAGMA optimize / ANALYZE)."""
+    conn = get_conn()
+    if full:
+        conn.execute("ANALYZE")
+        click.echo("ANALYZE tamamlandı.")
+    else:
+        conn.execute("PRAGMA optimize")
+        click.echo("PRAGMA optimize tamamlandı.")
+    conn.close()
+
+
+@db_cli.command("vacuum")
+@click.option("--pages", type=int, default=0, help="Serbest bırakılacak en fazla sayfa (0 = hepsi).")
+def db_vacuum_command(pages):
+    """
+    Boş sayfaları dosyadan geri verir. İlk çalıştırmada auto_vacuum=INCREMENTAL
+    moduna geçmek için bir kez tam VACUUM yapılır; sonrakiler artımlıdır.
+    """
+    conn = get_conn()
+    auto_vacuum = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    freelist_before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+    if auto_vacuum != 2:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        click.echo("auto_vacuum=INCREMENTAL ayarlandı, tam VACUUM yapıldı.")
+    else:
+        conn.execute(f"PRAGMA incremental_vacuum({int(pages)})")
+        freelist_after = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        click.echo(f"Artımlı VACUUM: {freelist_before - freelist_after} sayfa geri verildi.")
+    conn.close()
+
+
+@db_cli.command("check")
+def db_check_command():
+    """integrity_check ve foreign_key_check çalıştırır; sorun varsa hata koduyla çıkar."""
+    conn = get_conn()
+    integrity = [row[0] for row in conn.execute("PRAGMA integrity_check")]
+    fk_problems = conn.execute("PRAGMA foreign_key_check").fetchall()
+    conn.close()
+
+    ok = integrity == ["ok"] and not fk_problems
+    for line in integrity:
+        click.echo(f"integrity_check: {line}")
+    for table, rowid, parent, _ in fk_problems:
+        click.echo(f"foreign_key_check: {table} rowid={rowid} -> {parent} bulunamadı")
+    if not fk_problems:
+        click.echo("foreign_key_check: ok")
+
+    if not ok:
+        raise click.ClickException("Veritabanında sorun bulundu.")
+
+
+@db_cli.command("rebuild")
+@click.argument("tables", nargs=-1)
+def db_rebuild_command(tables):
+    """Türetilmiş tabloları (varsayılan: hepsi) kaynak tablolardan yeniden kurar."""
+    unknown = [t for t in tables if t not in DERIVED_TABLE_BUILDERS]
+    if unknown:
+        raise click.ClickException(f"Bilinmeyen tablo: {', '.join(unknown)}")
+
+    conn = get_conn()
+    for table in tables or DERIVED_TABLE_BUILDERS:
+        DERIVED_TABLE_BUILDERS[table](conn)
+        conn.commit()
+        count = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        click.echo(f"{table}: {count} satır")
+    conn.close()
+
+
+@bp.cli.command("rebuild-dues")
+@click.pass_context
+def rebuild_dues_command(ctx):
+    """`flask db rebuild dues_allocation` için kısa ad (gece cron'u)."""
+    ctx.invoke(db_rebuild_command, tables=("dues_allocation",))
+
+
+@db_cli.command("stats")
+def db_stats_command():
+    """Tablo/indeks boyutlarını ve tablo satır sayılarını listeler."""
+    conn = get_conn()
+    c = conn.cursor()
+
+    page_size = c.execute("PRAGMA page_size").fetchone()[0]
+    page_count = c.execute("PRAGMA page_count").fetchone()[0]
+    freelist = c.execute("PRAGMA freelist_count").fetchone()[0]
+    click.echo(f"Dosya: {page_count * page_size / 1024:.1f} KB "
+               f"({page_count} sayfa, {freelist} boş)")
+
+    try:
+        sizes = dict(c.execute("SELECT name, SUM(pgsize) FROM dbstat GROUP BY name").fetchall())
+    except sqlite3.OperationalError:
+        sizes = {}  # SQLite dbstat desteği olmadan derlenmiş
+
+    c.execute("""
+        SELECT type, name, tbl_name FROM sqlite_master
+        WHERE type IN ('table', 'index') AND name NOT LIKE 'sqlite_%'
+        ORDER BY tbl_name, type DESC, name
+    """)
+    for obj_type, name, tbl_name in c.fetchall():
+        size = f"{sizes[name] / 1024:.1f} KB" if name in sizes else "-"
+        if obj_type == "table":
+            count = conn.execute(f'SELECT COUNT(*) FROM "{name}"').fetchone()[0]
+            click.echo(f"{name:<28} tablo   {size:>12} {count:>10} satır")
+        else:
+            click.echo(f"  {name:<26} indeks  {size:>12}")
+    conn.close()
+
+
+# ----------------- UYGULAMA FABRİKASI -----------------
+def create_app(config=None):
+    """
+    Uygulamayı kurar ve döner. config, DEFAULT_CONFIG'teki anahtarları ezer;
+    örneğin testler {"DATABASE": ":memory:", "BACKUP_DIR": None,
+    "REPORT_WORKER": "external"} ile birbirinden yalıtılmış uygulamalar açar.
+    Tablolar burada oluşturulur; modül içe aktarılırken dosya/DB işlemi yapılmaz.
+    gunicorn: `gunicorn "app:create_app()"`, flask CLI: `flask --app app ...`
+    """
+    app = Flask(__name__)
+    app.config.update(DEFAULT_CONFIG)
+    app.config.update(config or {})
+
+    state = {
+        "roster_cache": OrderedDict(),
+        "report_worker": None,
+        "report_wakeup": threading.Event(),
+        "replica_shipper": None,
+        "statement_pool": None,
+    }
+    if app.config["DATABASE"] == ":memory:":
+        # Paylaşımlı bellek içi DB: her get_conn() aynı veriyi görür. Son
+        # bağlantı kapanınca DB silindiği için uygulama ömrünce biri açık tutulur.
+        app.config["DATABASE"] = f"file:servis_{secrets.token_hex(8)}?mode=memory&cache=shared"
+        state["memory_db"] = sqlite3.connect(app.config["DATABASE"], uri=True)
+    app.extensions["servis"] = state
+
+    app.register_blueprint(bp)
+
+    with app.app_context():
+        create_tables()
+        if app.config["REPLICA_DIR"]:
+            enable_wal_shipping()
+
+    # İlk isteği beklemez: autocheckpoint kapalıyken WAL'i boşaltan tek şey göndericidir
+    start_replica_shipper(app)
+    return app
+
+
+# ----------------- MAIN -----------------
+if __name__ == "__main__":
+    # Lokal çalıştırırken de tablo + fontları garanti et
+    app = create_app()
+    with app.app_context():
+        register_pdf_fonts()
+    app.run(debug=True)
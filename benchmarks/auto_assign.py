@@ -0,0 +1,72 @@
+"""
+Otomatik araç atama planlayıcısının sentetik filolardaki süresi ve kalitesi.
+
+    python benchmarks/auto_assign.py [araç_sayısı ...]
+
+Öğrenciler toplam kapasitenin %70'i kadardır, okul büyüklükleri Pareto
+dağılımlıdır. "alt sınır", en büyük kapasiteli araçlardan kaç tanesinin tüm
+öğrencileri taşımaya yettiğidir (okul bütünlüğü gözetmeyen iyimser sınır).
+DB'ye dokunmaz; plan_vehicle_assignment() doğrudan çağrılır.
+"""
+import os
+import random
+import sys
+import time
+from collections import namedtuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from app import plan_vehicle_assignment  # noqa: E402
+
+Student = namedtuple("Student", "id name school")
+Vehicle = namedtuple("Vehicle", "id plate name route capacity load")
+
+CAPACITIES = (8, 14, 16, 19, 27)
+FILL_RATIO = 0.7
+
+
+def synthetic_fleet(vehicle_count, seed=1):
+    rng = random.Random(seed)
+    vehicles = [
+        Vehicle(i, f"06 SB {i:04d}", f"Şoför {i}", f"Hat {i}", rng.choice(CAPACITIES), 0)
+        for i in range(1, vehicle_count + 1)
+    ]
+    student_count = int(sum(v.capacity for v in vehicles) * FILL_RATIO)
+
+    students = []
+    school = 0
+    while len(students) < student_count:
+        school += 1
+        size = min(int(rng.paretovariate(1.2) * 5), student_count - len(students))
+        students.extend(
+            Student(len(students) + k + 1, f"Öğrenci {len(students) + k + 1}", f"Okul {school}")
+            for k in range(size)
+        )
+    return students, vehicles
+
+
+def lower_bound(students, vehicles):
+    needed, seats = 0, 0
+    for capacity in sorted((v.capacity for v in vehicles), reverse=True):
+        if seats >= len(students):
+            break
+        seats += capacity
+        needed += 1
+    return needed
+
+
+def main(sizes):
+    print(f"{'araç':>6} {'öğrenci':>8} {'süre':>8} {'kullanılan':>10} {'alt sınır':>9} "
+          f"{'bölünen okul':>12} {'açıkta':>7}")
+    for size in sizes:
+        students, vehicles = synthetic_fleet(size)
+        started = time.perf_counter()
+        plan = plan_vehicle_assignment(students, vehicles)
+        elapsed = (time.perf_counter() - started) * 1000
+        print(f"{size:>6} {len(students):>8} {elapsed:>6.0f} ms {plan['vehicles_used']:>10} "
+              f"{lower_bound(students, vehicles):>9} {plan['split_schools']:>12} "
+              f"{len(plan['unplaced']):>7}")
+
+
+if __name__ == "__main__":
+    main([int(x) for x in sys.argv[1:]] or [100, 300, 800])
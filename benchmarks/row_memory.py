@@ -0,0 +1,73 @@
+"""
+Gecikmiş aidat listesinin bellek maliyeti (tracemalloc).
+
+    python benchmarks/row_memory.py [öğrenci_sayısı]
+
+Bellek içi DB'ye hepsi gecikmiş N öğrenci (varsayılan 20.000) eklenir, sonra:
+  1. load_overdue_dues() satırları: named_row (namedtuple, örnek başına dict yok)
+  2. aynı sorgu, satır başına sözlüğe çevrilmiş hali (eski dict(zip(...)) düzeni)
+  3. aidat sekmesinin tamamı (GET /?tab=dues) için tepe bellek
+1 ve 2, liste bellekte tutulurken ölçülen net artıştır.
+"""
+import os
+import sys
+import tracemalloc
+from datetime import date
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from app import create_app, get_conn, load_overdue_dues, refresh_dues_allocation  # noqa: E402
+
+
+def seed(count):
+    conn = get_conn()
+    conn.executemany(
+        "INSERT INTO students (name, school, parent_name, phone, monthly_fee, start_year, start_month)"
+        " VALUES (?, ?, ?, ?, 1000, 2025, 9)",
+        ((f"Öğrenci {i}", f"Okul {i % 40}", f"Veli {i}", f"0555{i:07d}") for i in range(count)),
+    )
+    refresh_dues_allocation(conn)
+    conn.commit()
+    conn.close()
+
+
+def retained(build):
+    """build() sonucunu tutarken net bellek artışını (MB) ve sonucu döner."""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / 1e6, result
+
+
+def main(count):
+    app = create_app({"DATABASE": ":memory:", "BACKUP_DIR": None, "REPORT_WORKER": "external"})
+    today = date(2026, 6, 15)
+    with app.app_context():
+        seed(count)
+        conn = get_conn()
+
+        named_mb, rows = retained(lambda: load_overdue_dues(conn.cursor(), today))
+        del rows
+        dict_mb, rows = retained(
+            lambda: [dict(zip(r._fields, r)) for r in load_overdue_dues(conn.cursor(), today)]
+        )
+        print(f"{len(rows)} gecikmiş öğrenci")
+        del rows
+        conn.close()
+        print(f"  adlandırılmış satırlar : {named_mb:6.1f} MB")
+        print(f"  satır başına sözlük    : {dict_mb:6.1f} MB")
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["user_id"], session["username"] = 1, "admin"
+    tracemalloc.start()
+    response = client.get("/?tab=dues")
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"  aidat sekmesi tepe     : {peak / 1e6:6.1f} MB (HTTP {response.status_code})")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
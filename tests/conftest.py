@@ -0,0 +1,52 @@
+"""
+Her test kendi bellek içi DB'si olan ayrı bir uygulama açar; testler
+birbirini görmez, pytest-xdist ile paralel koşabilir (`pytest -n auto`).
+"""
+import pytest
+
+from app import create_app, get_conn
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app({
+        "DATABASE": ":memory:",
+        "BACKUP_DIR": None,
+        "REPORT_WORKER": "external",
+        "ARCHIVE_DIR": str(tmp_path / "archives"),
+        "REPORT_JOB_DIR": str(tmp_path / "report_jobs"),
+        "REPLICA_DIR": "",
+        # Varsayılan kullanıcıların özetleri her testte yeniden hesaplanır
+        "PASSWORD_HASH_METHOD": "pbkdf2:sha256:1",
+    })
+    with app.app_context():
+        yield app
+
+
+@pytest.fixture
+def client(app):
+    """Varsayılan admin kullanıcısıyla oturum açmış test istemcisi."""
+    client = app.test_client()
+    response = client.post("/login", data={"username": "admin", "password": "1234"})
+    assert response.status_code == 302
+    return client
+
+
+@pytest.fixture
+def db(app):
+    conn = get_conn()
+    yield conn
+    conn.close()
+
+
+def add_student(db, name, monthly_fee=1000, start_year=2025, start_month=9, **extra):
+    """Doğrudan SQL ile öğrenci ekler, id'sini döner (route'ları atlayan testler için)."""
+    row = dict(school="Okul", parent_name="Veli", phone="05550000000", is_active=1)
+    row.update(name=name, monthly_fee=monthly_fee, start_year=start_year,
+               start_month=start_month, **extra)
+    cur = db.execute(
+        f"INSERT INTO students ({', '.join(row)}) VALUES ({', '.join('?' * len(row))})",
+        tuple(row.values()),
+    )
+    db.commit()
+    return cur.lastrowid
@@ -0,0 +1,63 @@
+from app import apply_vehicle_assignment, load_assignment_inputs, plan_vehicle_assignment
+from conftest import add_student
+
+
+def add_vehicle(db, plate, capacity, route=""):
+    cur = db.execute(
+        "INSERT INTO vehicles (plate, name, capacity, route, is_active) VALUES (?, '', ?, ?, 1)",
+        (plate, capacity, route),
+    )
+    db.commit()
+    return cur.lastrowid
+
+
+def plan(db):
+    return plan_vehicle_assignment(*load_assignment_inputs(db.cursor()))
+
+
+def test_school_group_fits_one_vehicle_on_its_route(db):
+    add_vehicle(db, "06 A 1", 10, "Sanayi")
+    on_route = add_vehicle(db, "06 A 2", 10, "Merkez Okulu hattı")
+    for i in range(4):
+        add_student(db, f"Öğrenci {i}", school="Merkez Okulu")
+
+    result = plan(db)
+    assert {vid for _, vid in result["pairs"]} == {on_route}
+    assert result["split_schools"] == 0 and not result["unplaced"]
+
+
+def test_capacity_is_never_exceeded(db):
+    small = add_vehicle(db, "06 A 1", 2)
+    big = add_vehicle(db, "06 A 2", 3)
+    for i in range(7):
+        add_student(db, f"Öğrenci {i}", school="Okul")
+
+    result = plan(db)
+    per_vehicle = {}
+    for _, vid in result["pairs"]:
+        per_vehicle[vid] = per_vehicle.get(vid, 0) + 1
+    assert per_vehicle == {small: 2, big: 3}
+    assert len(result["unplaced"]) == 2
+
+
+def test_vehicle_without_capacity_is_excluded_with_warning(client, db):
+    add_vehicle(db, "06 BOŞ 1", None)
+    seated = add_vehicle(db, "06 A 1", 5)
+    add_student(db, "Ali", school="Okul")
+
+    result = plan(db)
+    assert [v.plate for v in result["no_capacity"]] == ["06 BOŞ 1"]
+    assert [vid for _, vid in result["pairs"]] == [seated]
+
+    page = client.get("/auto_assign").get_data(as_text=True)
+    assert "Kapasitesi girilmemiş" in page and "06 BOŞ 1" in page
+
+
+def test_apply_skips_pairs_that_went_stale(db):
+    vehicle_id = add_vehicle(db, "06 A 1", 1)
+    first = add_student(db, "Ali", school="Okul")
+    second = add_student(db, "Veli", school="Okul")
+
+    applied, skipped = apply_vehicle_assignment([(first, vehicle_id), (second, vehicle_id)])
+    assert (applied, skipped) == (1, 1)
+    assert db.execute("SELECT student_id FROM student_vehicle").fetchall() == [(first,)]
@@ -0,0 +1,27 @@
+from app import turkish_sort_key
+from conftest import add_student
+
+
+def test_turkish_alphabet_order():
+    names = ["Zeynep", "Ömer", "Çağla", "İsmail", "Işık", "Cem", "Şule", "Ülkü", "Gül", "Ğ", "Oya"]
+    assert sorted(names, key=turkish_sort_key) == [
+        "Cem", "Çağla", "Gül", "Ğ", "Işık", "İsmail", "Oya", "Ömer", "Şule", "Ülkü", "Zeynep",
+    ]
+
+
+def test_case_insensitive_with_turkish_i():
+    # I'nın küçüğü ı, İ'nin küçüğü i'dir; "IŞIK" ile "ışık" aynı yere düşer
+    assert turkish_sort_key("IŞIK")[0] == turkish_sort_key("ışık")[0]
+    assert turkish_sort_key("İNCİ")[0] == turkish_sort_key("inci")[0]
+    assert turkish_sort_key("ısık") < turkish_sort_key("inci")
+
+
+def test_student_list_is_read_in_turkish_order_from_index(db):
+    for name in ["Zeynep", "çağla", "Cem", "ömer", "Oya"]:
+        add_student(db, name)
+
+    query = "SELECT name FROM students ORDER BY name COLLATE turkish"
+    assert [r.name for r in db.execute(query)] == ["Cem", "çağla", "Oya", "ömer", "Zeynep"]
+
+    plan = " ".join(r[3] for r in db.execute("EXPLAIN QUERY PLAN " + query))
+    assert "idx_students_name" in plan and "TEMP B-TREE" not in plan
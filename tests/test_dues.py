@@ -0,0 +1,130 @@
+from datetime import date
+
+import pytest
+
+import app as servis
+from app import (
+    archive_season, get_history_conn, load_overdue_dues, load_parent_statements,
+    refresh_dues_allocation,
+)
+from conftest import add_student
+
+
+def pay(db, student_id, pay_date, amount):
+    db.execute("INSERT INTO payments (student_id, pay_date, amount) VALUES (?, ?, ?)",
+               (student_id, pay_date, amount))
+    refresh_dues_allocation(db, [student_id])
+    db.commit()
+
+
+def test_payments_fill_months_in_order(db):
+    student_id = add_student(db, "Ali", monthly_fee=1000, start_year=2025, start_month=9)
+    pay(db, student_id, "2025-09-05", 1500)
+
+    rows = load_overdue_dues(db.cursor(), date(2025, 11, 15))
+    assert len(rows) == 1
+    row = rows[0]
+    assert row.expected_so_far == 3000
+    assert row.overdue_amount == 1500
+    assert row.remaining_year == 7500
+    assert row.unpaid_months == "2025/10, 2025/11"
+    # 2025/10'un yarısı 45 gün, 2025/11 ise 14 gün gecikmiş
+    assert (row.aging_0_30, row.aging_31_60) == (1000, 500)
+
+
+def test_students_without_schedule_are_not_overdue(db):
+    add_student(db, "Ücretsiz", monthly_fee=0)
+    add_student(db, "Tarihsiz", start_year=None, start_month=None)
+    refresh_dues_allocation(db)
+    db.commit()
+    assert load_overdue_dues(db.cursor(), date(2026, 6, 1)) == []
+
+
+def test_api_dues_keyset_paging(client, db):
+    ids = [add_student(db, f"Öğrenci {i}") for i in range(5)]
+    pay(db, ids[2], "2025-09-01", 9000)  # tamamı ödenmiş: listede olmamalı
+    refresh_dues_allocation(db)
+    db.commit()
+
+    first = client.get("/api/v1/dues?limit=2").get_json()
+    assert [r["id"] for r in first["items"]] == ids[:2]
+    second = client.get(f"/api/v1/dues?limit=2&after={first['next_after']}").get_json()
+    assert [r["id"] for r in second["items"]] == [ids[3], ids[4]]
+    assert second["next_after"] is None
+    assert second["items"][0]["overdue_amount"] == 9000
+
+
+def test_statement_ignores_payments_after_month_end(db):
+    student_id = add_student(db, "Gökhan", monthly_fee=1000, start_year=2025, start_month=9)
+    pay(db, student_id, "2025-09-10", 1000)
+    pay(db, student_id, "2025-12-10", 3000)
+
+    (october,) = load_parent_statements(2025, 10)
+    assert october["total_paid"] == 1000
+    assert october["expected_so_far"] == 2000
+    assert october["overdue_amount"] == 1000
+    assert october["payments"] == []
+
+    (december,) = load_parent_statements(2025, 12)
+    assert december["overdue_amount"] == 0
+    assert [p[1] for p in december["payments"]] == [3000]
+
+
+def test_archived_season_keeps_payments_in_dues(db):
+    student_id = add_student(db, "Ülkü", monthly_fee=1000, start_year=2024, start_month=9)
+    for month in range(9, 13):
+        pay(db, student_id, f"2024-{month:02d}-05", 1000)
+    for month in range(1, 6):
+        pay(db, student_id, f"2025-{month:02d}-05", 1000)
+
+    label, _, moved = archive_season(2024)
+    assert label == "2024-2025" and moved["payments"] == 9
+    assert db.execute("SELECT COUNT(*) FROM payments").fetchone()[0] == 0
+    assert load_overdue_dues(db.cursor(), date(2025, 6, 1)) == []
+
+    (statement,) = load_parent_statements(2025, 6)
+    assert statement["total_paid"] == 9000 and statement["overdue_amount"] == 0
+    ops = {r.op for r in db.execute("SELECT op FROM change_log WHERE entity='payments'")}
+    assert ops == {"insert", "archive"}
+
+
+def test_interrupted_archive_is_not_counted_twice_and_can_be_rerun(db, monkeypatch):
+    student_id = add_student(db, "Ülkü", monthly_fee=1000, start_year=2024, start_month=9)
+    pay(db, student_id, "2024-10-05", 1000)
+
+    def fail(conn, student_ids=None):
+        raise RuntimeError("silme adımı yarıda kaldı")
+
+    with monkeypatch.context() as m:
+        m.setattr(servis, "refresh_dues_allocation", fail)
+        with pytest.raises(RuntimeError):
+            archive_season(2024)
+
+    # Kopya arşivde, satır canlıda da duruyor: geçmiş görünümü tek sayar
+    assert db.execute("SELECT COUNT(*) FROM payments").fetchone()[0] == 1
+    history = get_history_conn()
+    assert history.execute("SELECT SUM(amount) FROM all_payments").fetchone()[0] == 1000
+    history.close()
+
+    _, _, moved = archive_season(2024)
+    assert moved["payments"] == 1
+    history = get_history_conn()
+    assert history.execute("SELECT SUM(amount) FROM all_payments").fetchone()[0] == 1000
+    history.close()
+    assert load_parent_statements(2025, 6)[0]["total_paid"] == 1000
+
+
+@pytest.mark.parametrize("args", [["db", "rebuild"], ["db", "rebuild", "dues_allocation"], ["rebuild-dues"]])
+def test_rebuild_commands_share_one_path(app, db, args):
+    student_id = add_student(db, "Ali", monthly_fee=1000, start_year=2025, start_month=9)
+    db.execute("DELETE FROM dues_allocation")
+    db.execute("UPDATE meta SET value='2000-01-01' WHERE key='dues_allocation_built'")
+    db.commit()
+
+    result = app.test_cli_runner().invoke(args=args)
+    assert result.exit_code == 0, result.output
+    assert "dues_allocation: 9 satır" in result.output
+    assert db.execute("SELECT COUNT(*) FROM dues_allocation WHERE student_id=?",
+                      (student_id,)).fetchone()[0] == 9
+    built = db.execute("SELECT value FROM meta WHERE key='dues_allocation_built'").fetchone()[0]
+    assert built == date.today().isoformat()
@@ -0,0 +1,42 @@
+from app import build_expense_pivot_report, get_history_conn, refresh_dues_allocation
+from conftest import add_student
+
+
+def setup_rider(db, **extra):
+    vehicle_id = db.execute(
+        "INSERT INTO vehicles (plate, name, capacity, route, is_active) VALUES ('06 A 1', '', 10, '', 1)"
+    ).lastrowid
+    student_id = add_student(db, "Ali", **extra)
+    db.execute(
+        "INSERT INTO student_vehicle (student_id, vehicle_id, start_date) VALUES (?, ?, '2025-09-01')",
+        (student_id, vehicle_id),
+    )
+    refresh_dues_allocation(db)
+    db.commit()
+    return student_id
+
+
+def vehicle_summary(start_ym, end_ym):
+    conn = get_history_conn()
+    try:
+        report = build_expense_pivot_report(conn, start_ym, end_ym)
+        return report["sections"][1]["rows"][0]
+    finally:
+        conn.close()
+
+
+def test_fees_accrue_only_in_the_nine_fee_months(db):
+    setup_rider(db)  # 2025/09 - 2026/05 arası 9 aidat ayı
+
+    row = vehicle_summary("2026-04", "2026-08")
+    assert (row.rider_months, row.fees) == (2, 2000.0)
+
+
+def test_deactivated_riders_are_not_counted(db):
+    student_id = setup_rider(db, start_year=2026, start_month=6)
+    db.execute("UPDATE students SET is_active=0 WHERE id=?", (student_id,))
+    refresh_dues_allocation(db, [student_id])
+    db.commit()
+
+    row = vehicle_summary("2026-06", "2026-08")
+    assert (row.rider_months, row.fees, row.margin) == (0, 0, 0)
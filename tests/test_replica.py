@@ -0,0 +1,122 @@
+import os
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import app as servis
+from app import create_app, get_conn, restore_replica, ship_wal, turkish_collation
+
+
+def replica_config(tmp_path, shipper="external"):
+    return {
+        "DATABASE": str(tmp_path / "servis.db"),
+        "BACKUP_DIR": None,
+        "REPORT_WORKER": "external",
+        "ARCHIVE_DIR": str(tmp_path / "archives"),
+        "REPLICA_DIR": str(tmp_path / "replica"),
+        "REPLICA_SHIPPER": shipper,
+        "PASSWORD_HASH_METHOD": "pbkdf2:sha256:1",
+    }
+
+
+@pytest.fixture
+def replica_app(tmp_path):
+    app = create_app(replica_config(tmp_path))
+    with app.app_context():
+        yield app
+
+
+def student_names(path):
+    conn = sqlite3.connect(path)
+    conn.create_collation("turkish", turkish_collation)
+    try:
+        return [r[0] for r in conn.execute("SELECT name FROM students ORDER BY id")]
+    finally:
+        conn.close()
+
+
+def add(conn, name):
+    conn.execute("INSERT INTO students (name, monthly_fee) VALUES (?, 1000)", (name,))
+    conn.commit()
+
+
+def test_point_in_time_restore(replica_app, tmp_path):
+    # Gönderici bağlantısı açık kalmalı; son bağlantı kapanınca SQLite WAL'i siler
+    shipper = get_conn()
+    writer = get_conn()
+    try:
+        add(writer, "Ali")
+        assert ship_wal(shipper, resume=False) > 0
+        time.sleep(0.01)
+        first_shipped = int(time.time() * 1000)
+        time.sleep(0.01)
+
+        add(writer, "Veli")
+        assert ship_wal(shipper) > 0
+        assert ship_wal(shipper) == 0  # yeni commit yoksa gönderilecek çerçeve yok
+
+        target = str(tmp_path / "restored.db")
+        restore_replica(target, until_ms=first_shipped)
+        assert student_names(target) == ["Ali"]
+
+        restore_replica(target)
+        assert student_names(target) == ["Ali", "Veli"]
+    finally:
+        writer.close()
+        shipper.close()
+
+
+def test_uncommitted_frames_are_not_shipped(replica_app, tmp_path):
+    shipper = get_conn()
+    writer = get_conn()
+    try:
+        add(writer, "Ali")
+        ship_wal(shipper, resume=False)
+
+        writer.execute("BEGIN")
+        writer.execute("INSERT INTO students (name, monthly_fee) VALUES ('Yarım', 1)")
+        # Yazar kilidi tutarken gönderici yarım işlemi okuyamaz, kilidi bekler
+        shipper.execute("PRAGMA busy_timeout = 0")
+        with pytest.raises(sqlite3.OperationalError):
+            ship_wal(shipper)
+        writer.rollback()
+
+        target = str(tmp_path / "restored.db")
+        restore_replica(target)
+        assert student_names(target) == ["Ali"]
+    finally:
+        writer.close()
+        shipper.close()
+
+
+def test_shipper_starts_with_app(tmp_path, monkeypatch):
+    started = threading.Event()
+    monkeypatch.setattr(servis, "replica_shipper_loop", started.set)
+
+    create_app(replica_config(tmp_path, shipper="thread"))
+    assert started.wait(5)
+
+
+def test_autocheckpoint_returns_when_shipper_is_silent(replica_app):
+    def autocheckpoint():
+        conn = get_conn()
+        try:
+            return conn.execute("PRAGMA wal_autocheckpoint").fetchone()[0]
+        finally:
+            conn.close()
+
+    # Gönderici hiç çalışmadıysa WAL SQLite'ın kendi checkpoint'iyle sınırlı kalır
+    assert autocheckpoint() > 0
+
+    shipper = get_conn()
+    try:
+        ship_wal(shipper, resume=False)
+        assert autocheckpoint() == 0
+
+        stale = time.time() - servis.REPLICA_STALE_MINUTES * 60 - 1
+        os.utime(servis.replica_path("position.json"), (stale, stale))
+        assert autocheckpoint() > 0
+    finally:
+        shipper.close()
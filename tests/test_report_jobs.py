@@ -0,0 +1,33 @@
+import threading
+
+from app import create_app, enqueue_report_job, get_conn
+
+
+def test_concurrent_identical_submits_share_one_job(tmp_path):
+    app = create_app({
+        "DATABASE": str(tmp_path / "servis.db"),
+        "BACKUP_DIR": None,
+        "REPORT_WORKER": "external",
+        "REPLICA_DIR": "",
+        "PASSWORD_HASH_METHOD": "pbkdf2:sha256:1",
+    })
+    barrier = threading.Barrier(8)
+    job_ids = []
+
+    def submit():
+        with app.app_context():
+            barrier.wait()
+            job_ids.append(enqueue_report_job(
+                "daily_report", {"report_date": "2025-10-01", "report_format": "csv"}, "Günlük Rapor"))
+
+    threads = [threading.Thread(target=submit) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    with app.app_context():
+        conn = get_conn()
+        assert conn.execute("SELECT COUNT(*) FROM report_jobs").fetchone()[0] == 1
+        conn.close()
+    assert len(set(job_ids)) == 1
@@ -0,0 +1,170 @@
+import io
+import zipfile
+
+import app as servis
+
+from conftest import add_student
+
+FETCH = {"X-Requested-With": "fetch"}
+
+
+def test_login_required_redirects(app):
+    response = app.test_client().get("/")
+    assert response.status_code == 302
+    assert "/login" in response.headers["Location"]
+
+
+def test_login_rejects_wrong_password(app):
+    client = app.test_client()
+    response = client.post("/login", data={"username": "admin", "password": "yanlis"})
+    assert response.status_code == 200
+    with client.session_transaction() as session:
+        assert "user_id" not in session
+
+
+def test_index_renders_dashboard(client, db):
+    add_student(db, "Çağla Yılmaz")
+    response = client.get("/")
+    assert response.status_code == 200
+    assert "Çağla Yılmaz" in response.get_data(as_text=True)
+
+
+def test_add_student_fragment_returns_rendered_row(client, db):
+    response = client.post("/add_student", headers=FETCH, data={
+        "name": "Ömer Kaya", "school": "Merkez", "monthly_fee": "1500",
+        "start_year": "2025", "start_month": "9",
+    })
+    data = response.get_json()
+    assert response.status_code == 200 and data["ok"]
+    assert "Ömer Kaya" in data["html"] and "editStudentModal" in data["modal"]
+    assert data["summary"]["student_count"] == 1
+    assert db.execute("SELECT monthly_fee FROM students").fetchone()[0] == 1500
+
+
+def test_add_student_without_fee_is_rejected(client, db):
+    response = client.post("/add_student", headers=FETCH, data={"name": "Ali"})
+    assert response.status_code == 400
+    assert not response.get_json()["ok"]
+    assert db.execute("SELECT COUNT(*) FROM students").fetchone()[0] == 0
+
+
+def test_add_student_without_js_redirects(client):
+    response = client.post("/add_student", data={"name": "Ali", "monthly_fee": "1000"})
+    assert response.status_code == 302
+
+
+def test_add_payment_updates_dues_allocation(client, db):
+    student_id = add_student(db, "Zeynep")
+    response = client.post("/add_payment", headers=FETCH, data={
+        "student_id": student_id, "amount": "2500", "pay_date": "2025-10-01",
+    })
+    assert response.get_json()["ok"]
+    paid = db.execute(
+        "SELECT amount_paid FROM dues_allocation WHERE student_id=? ORDER BY period",
+        (student_id,),
+    ).fetchall()
+    assert [r.amount_paid for r in paid[:4]] == [1000, 1000, 500, 0]
+
+
+def test_add_vehicle_and_expense(client, db):
+    response = client.post("/add_vehicle", headers=FETCH, data={
+        "plate": "06 ABC 123", "driver_name": "Hasan", "capacity": "15", "route": "Merkez",
+    })
+    assert response.get_json()["ok"]
+    vehicle_id = db.execute("SELECT id FROM vehicles").fetchone()[0]
+
+    response = client.post("/add_expense", headers=FETCH, data={
+        "vehicle_id_exp": vehicle_id, "exp_date": "2025-10-02", "category": "Yakıt",
+        "amount_exp": "800", "description_exp": "Mazot",
+    })
+    data = response.get_json()
+    assert data["ok"] and "06 ABC 123" in data["html"]
+
+
+def test_delete_student_marks_passive(client, db):
+    student_id = add_student(db, "Berk")
+    response = client.post(f"/delete_student/{student_id}", headers=FETCH)
+    assert response.get_json()["ok"]
+    assert db.execute("SELECT is_active FROM students WHERE id=?", (student_id,)).fetchone()[0] == 0
+
+
+def test_changes_feed_pages_by_version(client, db):
+    add_student(db, "Ali")
+    add_student(db, "Veli")
+    data = client.get("/changes?since=0&limit=1").get_json()
+    assert data["has_more"]
+    assert data["changes"][0]["entity"] == "students" and data["changes"][0]["op"] == "insert"
+
+    rest = client.get(f"/changes?since={data['version']}").get_json()
+    assert [c["id"] for c in rest["changes"]] == [2] and not rest["has_more"]
+
+
+def test_events_stream_sends_rendered_rows_and_ends(client, db, monkeypatch):
+    monkeypatch.setattr(servis, "SSE_STREAM_SECONDS", 0.5)
+    monkeypatch.setattr(servis, "SSE_POLL_SECONDS", 0.1)
+    student_id = add_student(db, "Şule")
+
+    response = client.get("/events", headers={"Last-Event-ID": "0"})
+    body = response.get_data(as_text=True)
+    assert "event: student" in body and "studentsTable" in body
+    assert f'data-student-id=\\"{student_id}\\"' in body
+    # Akış kapanırken son sürümü bildirir; yeniden bağlanan panel buradan sürer
+    last_version = db.execute("SELECT MAX(version) FROM change_log").fetchone()[0]
+    assert body.rstrip().endswith(f"id: {last_version}")
+
+
+def test_api_token_and_list(app, db):
+    add_student(db, "İsmail")
+    client = app.test_client()
+    assert client.get("/api/v1/students").status_code == 401
+
+    token = client.post("/api/v1/token", json={"username": "admin", "password": "1234"}).get_json()["token"]
+    response = client.get("/api/v1/students", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200
+    assert [s["name"] for s in response.get_json()["items"]] == ["İsmail"]
+
+
+def test_parent_statements_stream_and_stop_on_disconnect(client, db, app, monkeypatch):
+    monkeypatch.setattr(servis, "STATEMENT_WORKERS", 1)
+    monkeypatch.setattr(servis, "STATEMENT_QUEUE_PER_WORKER", 1)
+    for i in range(3):
+        add_student(db, f"Öğrenci {i}")
+    servis.refresh_dues_allocation(db)
+    db.commit()
+
+    response = client.get("/parent_statements?month=2025-10")
+    assert response.status_code == 200
+    assert len(zipfile.ZipFile(io.BytesIO(response.get_data())).namelist()) == 3
+    pool = app.extensions["servis"]["statement_pool"]
+
+    # İstemci ilk parçadan sonra koparsa üçüncü ekstre hiç kuyruğa girmez
+    submitted = []
+    real_submit = pool.submit
+    monkeypatch.setattr(pool, "submit", lambda *a: submitted.append(real_submit(*a)) or submitted[-1])
+    response = client.get("/parent_statements?month=2025-10", buffered=False)
+    next(response.response)
+    response.close()
+    assert len(submitted) == 2
+    assert app.extensions["servis"]["statement_pool"] is pool
+
+
+def test_roster_history_exports_go_through_the_job_queue(client, db):
+    student_id = add_student(db, "Ali")
+    vehicle_id = db.execute(
+        "INSERT INTO vehicles (plate, name, capacity, route, is_active) VALUES ('06 A 1', '', 10, '', 1)"
+    ).lastrowid
+    db.execute("INSERT INTO student_vehicle (student_id, vehicle_id, start_date) VALUES (?, ?, '2025-09-01')",
+               (student_id, vehicle_id))
+    db.commit()
+
+    response = client.get("/roster_history?month=2025-10&report_format=csv")
+    assert response.status_code == 302 and "/report_jobs" in response.headers["Location"]
+    response = client.get(f"/student_timeline/{student_id}?report_format=csv")
+    assert response.status_code == 302
+
+    while (job := servis.claim_report_job()) is not None:
+        servis.run_report_job(job)
+    jobs = db.execute("SELECT kind, status, done, total FROM report_jobs ORDER BY id").fetchall()
+    assert [(j.kind, j.status, j.done, j.total) for j in jobs] == [
+        ("roster_history", "done", 1, 1), ("student_timeline", "done", 1, 1),
+    ]
@@ -0,0 +1,57 @@
+import pytest
+
+import app as servis
+from app import (
+    CampaignActiveError, DEFAULT_REMINDER_TEMPLATE, create_reminder_campaign,
+    refresh_dues_allocation, run_sms_campaign,
+)
+from conftest import add_student
+
+
+@pytest.fixture
+def overdue_parents(db, monkeypatch):
+    monkeypatch.setattr(servis, "SMS_BATCH_INTERVAL", 0)
+    # Kardeşler aynı veli telefonunu paylaşır: tek mesaj gider
+    add_student(db, "Ali", phone="0555 111 22 33")
+    add_student(db, "Ayşe", phone="+90 555 111 22 33")
+    add_student(db, "Can", phone="05554445566")
+    refresh_dues_allocation(db)
+    db.commit()
+
+
+def test_campaign_groups_siblings_by_phone(overdue_parents, db):
+    campaign_id, count = create_reminder_campaign(DEFAULT_REMINDER_TEMPLATE)
+    assert count == 2
+    messages = [r.message for r in db.execute(
+        "SELECT message FROM sms_campaign_messages WHERE campaign_id=? ORDER BY phone",
+        (campaign_id,),
+    )]
+    assert "Ali, Ayşe" in messages[0]
+
+
+def test_second_campaign_is_refused_while_first_is_pending(overdue_parents):
+    campaign_id, _ = create_reminder_campaign(DEFAULT_REMINDER_TEMPLATE)
+    with pytest.raises(CampaignActiveError) as exc:
+        create_reminder_campaign(DEFAULT_REMINDER_TEMPLATE)
+    assert exc.value.campaign_id == campaign_id
+
+
+def test_parents_messaged_today_are_skipped(overdue_parents, db):
+    campaign_id, _ = create_reminder_campaign(DEFAULT_REMINDER_TEMPLATE)
+    run_sms_campaign(campaign_id)
+    assert db.execute("SELECT status FROM sms_campaigns WHERE id=?", (campaign_id,)).fetchone()[0] == "done"
+
+    assert create_reminder_campaign(DEFAULT_REMINDER_TEMPLATE) == (None, 0)
+
+    add_student(db, "Deniz", phone="05557778899")
+    refresh_dues_allocation(db)
+    db.commit()
+    _, count = create_reminder_campaign(DEFAULT_REMINDER_TEMPLATE)
+    assert count == 1
+
+
+def test_double_submit_starts_one_campaign(overdue_parents, client, db, monkeypatch):
+    monkeypatch.setattr(servis, "run_sms_campaign", lambda campaign_id: None)
+    client.post("/sms_campaign", data={"template": ""})
+    client.post("/sms_campaign", data={"template": ""})
+    assert db.execute("SELECT COUNT(*) FROM sms_campaigns").fetchone()[0] == 1